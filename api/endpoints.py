@@ -1,49 +1,133 @@
 import asyncio
+import logging
+import time
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import PlainTextResponse
 from services.document_processor import (
     display_license_extracted_info,
     display_mulkiya_extracted_info,
-    merge_id_information,
-    process_uploaded_document,
-    display_extracted_info,
     process_uploaded_license_document,
     process_uploaded_mulkiya_document,
+    queue_emirates_id_upload,
 )
-from services.voiceText import transcribe_audio
+from services import voiceText
 from services.whatsapp import (
-    download_whatsapp_audio,
     download_whatsapp_media,
     send_whatsapp_message,
     clear_user_language,
 )
-from services.conversation_manager import process_conversation
-from services.llm import initialize_llm, process_message_with_llm
-from config.settings import VERIFY_TOKEN
+from services.conversation_manager import process_conversation, register_outbox_handlers
+from services.llm import LLM_STREAM_STATS, initialize_llm, process_message_with_llm
+from config.settings import METRICS_ENABLED, VERIFY_TOKEN
 from langchain.schema import HumanMessage, SystemMessage
+from services import outbox
+from services.partner_api import PARTNER_API_STATS, close_client as close_partner_client
+from services.plan_kb import plan_kb
+from services.semantic_cache import semantic_cache
+from services.translation import TRANSLATION_STATS
+from utils.cpu_pool import CPU_POOL_STATS, shutdown_cpu_pool
+from utils.extraction_cache import extraction_cache
+from utils import metrics, tracing
+from utils.logging_setup import LOGGING_STATS, configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 llm = initialize_llm()
 user_states = {}
-# Dictionary to store locks for each user to prevent concurrent processing
-user_locks = {}
+# Latest turn taken by each user; see UserTurn
+user_turns = {}
+
+
+class UserTurn:
+    """
+    A message's place in its user's queue, taken when the webhook receives
+    it. Messages are handled one at a time in arrival order, even when an
+    earlier voice note is still being downloaded and transcribed.
+    """
+
+    def __init__(self, from_id: str):
+        self.from_id = from_id
+        self._previous = user_turns.get(from_id)
+        self._done = asyncio.get_running_loop().create_future()
+        user_turns[from_id] = self
+
+    async def wait(self):
+        """Return once the user's earlier messages are handled"""
+        if self._previous is not None:
+            await asyncio.shield(self._previous._done)
+
+    def release(self):
+        """Let the user's next message go ahead; safe to call more than once"""
+        previous = self._previous
+        if previous is not None and not previous._done.done():
+            # Dropped while an earlier message is pending: keep the order
+            previous._done.add_done_callback(lambda _: self.release())
+            return
+        self._previous = None
+        if not self._done.done():
+            self._done.set_result(None)
+        if user_turns.get(self.from_id) is self:
+            del user_turns[self.from_id]
 
 
 async def process_with_lock(
-    from_id: str, text: str, profile_name: str = None, interactive_response: dict = None
+    from_id: str,
+    text: str,
+    profile_name: str = None,
+    interactive_response: dict = None,
+    turn: UserTurn = None,
 ):
     """
-    Process conversation with a lock to prevent concurrent processing for the same user
+    Process a message after the user's earlier messages, so at most one
+    message per user is handled at a time
     """
-    # Get or create a lock for this user
-    if from_id not in user_locks:
-        user_locks[from_id] = asyncio.Lock()
-
-    # Acquire the lock for this user
-    async with user_locks[from_id]:
-        await process_conversation(
-            from_id, text, user_states, profile_name, interactive_response
+    turn = turn or UserTurn(from_id)
+    with tracing.start_trace("message", user=tracing.user_hash(from_id)) as trace_span:
+        waiting_since = time.perf_counter()
+        try:
+            await turn.wait()
+            # Labelled with the stage the message arrived in
+            stage = user_states.get(from_id, {}).get("stage", "new")
+            trace_span.set(
+                stage=stage, lock_wait_ms=round((time.perf_counter() - waiting_since) * 1000, 1)
+            )
+            with metrics.STAGE_SECONDS.time(stage=stage):
+                await process_conversation(
+                    from_id, text, user_states, profile_name, interactive_response
+                )
+        finally:
+            turn.release()
+
+
+def _media_details(message: dict):
+    """Get media ID, mime type and filename based on message type"""
+    msg_type = message.get("type")
+    if msg_type == "document":
+        document = message.get("document", {})
+        return (
+            document.get("id"),
+            document.get("mime_type"),
+            document.get("filename", "unknown"),
         )
+    media_id = message.get("image", {}).get("id")
+    # WhatsApp typically sends JPEGs
+    return media_id, "image/jpeg", f"{msg_type}-{media_id}.jpg"
+
+
+@app.on_event("startup")
+async def startup():
+    register_outbox_handlers(outbox.start_dispatcher(user_states))
+    voiceText.start_voice_queue(user_states, process_with_lock)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await outbox.stop_dispatcher()
+    await voiceText.stop_voice_queue()
+    shutdown_cpu_pool()
+    await close_partner_client()
 
 
 @app.get("/")
@@ -61,14 +145,15 @@ async def webhook(request: Request):
 
         if mode and verify_token:
             if mode == "subscribe" and verify_token == VERIFY_TOKEN:
-                print("WEBHOOK_VERIFIED")
+                logger.info("Webhook verified")
                 return PlainTextResponse(challenge)
             else:
                 raise HTTPException(status_code=403, detail="Verification failed")
 
     elif request.method == "POST":
         data = await request.json()
-        print("Webhook received data:", data)
+        # Payloads hold message text and media ids; only dumped at DEBUG
+        logger.debug("Webhook received data: %s", data)
         if (
             "object" in data
             and "entry" in data
@@ -87,12 +172,16 @@ async def webhook(request: Request):
                             .get("profile", {})
                             .get("name")
                         )
+                        metrics.mark_received(from_id, msg_type)
+                        logger.info("Webhook %s message from %s", msg_type, from_id)
 
                         if msg_type == "text":
                             text = messages[0].get("text", {}).get("body", "")
                             if from_id and text:
                                 asyncio.create_task(
-                                    process_with_lock(from_id, text, profile_name, None)
+                                    process_with_lock(
+                                        from_id, text, profile_name, None, UserTurn(from_id)
+                                    )
                                 )
 
                         elif msg_type == "interactive":
@@ -111,39 +200,25 @@ async def webhook(request: Request):
                                         "",
                                         profile_name,
                                         interactive_response,
+                                        UserTurn(from_id),
                                     )
                                 )
 
                         elif msg_type == "audio":  # Handle voice messages
-                            media_id = messages[0].get("audio", {}).get("id")
-                            if media_id:
-                                audio_data = download_whatsapp_audio(media_id)
-                                if audio_data:
-                                    transcribed_text = await transcribe_audio(
-                                        audio_data
-                                    )
-                                    if transcribed_text:
-                                        print(
-                                            f"Transcribed voice message from {from_id}: {transcribed_text}"
-                                        )
-                                        asyncio.create_task(
-                                            process_with_lock(
-                                                from_id,
-                                                transcribed_text,
-                                                profile_name,
-                                                None,
-                                            )
-                                        )
-                                    else:
-                                        send_whatsapp_message(
-                                            from_id,
-                                            "Sorry, I couldn’t understand your voice message. Could you please try again or type your request?",
-                                        )
-                                else:
-                                    send_whatsapp_message(
-                                        from_id,
-                                        "Sorry, I couldn’t retrieve your voice message. Please try again.",
-                                    )
+                            audio = messages[0].get("audio", {})
+                            media_id = audio.get("id")
+                            # Downloaded and transcribed by the voice queue
+                            # workers; the webhook does not wait for it. The
+                            # turn is taken now, so later texts wait for it
+                            turn = UserTurn(from_id) if media_id else None
+                            if media_id and not voiceText.voice_queue.submit(
+                                from_id, media_id, audio.get("mime_type"), profile_name, turn
+                            ):
+                                turn.release()
+                                send_whatsapp_message(
+                                    from_id,
+                                    "Sorry, I'm receiving a lot of voice messages right now. Please try again in a moment or type your request.",
+                                )
                         # elif msg_type == "document":
                         #     media_id = messages[0].get("document", {}).get("id")
                         #     mime_type = messages[0].get("document", {}).get("mime_type")
@@ -174,26 +249,12 @@ async def webhook(request: Request):
                         #             send_whatsapp_message(from_id, "Sorry, I couldn’t retrieve your document. Please try again.")
                         # Tododclea
                         elif msg_type in ["document", "image"]:
-                            # Get media ID and mime type based on message type
-                            if msg_type == "document":
-                                media_id = messages[0].get("document", {}).get("id")
-                                mime_type = (
-                                    messages[0].get("document", {}).get("mime_type")
-                                )
-                                filename = (
-                                    messages[0]
-                                    .get("document", {})
-                                    .get("filename", "unknown")
-                                )
-                            else:  # image
-                                media_id = messages[0].get("image", {}).get("id")
-                                mime_type = (
-                                    "image/jpeg"  # WhatsApp typically sends JPEGs
-                                )
-                                filename = f"{msg_type}-{media_id}.jpg"
+                            media_id, mime_type, filename = _media_details(
+                                messages[0]
+                            )
 
                             if media_id:
-                                print(f"Received {msg_type} from {from_id}: {filename}")
+                                logger.info("Received %s from %s: %s", msg_type, from_id, filename)
 
                                 # Determine the flow type based on stage
                                 flow_type = None
@@ -209,146 +270,33 @@ async def webhook(request: Request):
                                     ]:
                                         flow_type = "motor"
 
-                                # Check if we're waiting for back side of Emirates ID
-                                if (
-                                    from_id in user_states
-                                    and user_states[from_id]["stage"]
-                                    == "waiting_for_back_id"
-                                ):
-                                    media_data = download_whatsapp_media(media_id)
-                                    if media_data:
-                                        try:
-                                            send_whatsapp_message(
-                                                from_id,
-                                                f"Received the back side of your Emirates ID. Processing now, please wait...",
-                                            )
-                                            back_extracted_info = (
-                                                await process_uploaded_document(
-                                                    from_id,
-                                                    media_data,
-                                                    mime_type,
-                                                    filename,
-                                                    user_states,
-                                                    flow_type,
-                                                )
-                                            )
-                                            if back_extracted_info:
-                                                print(
-                                                    f"Extracted info from back side: {back_extracted_info}"
-                                                )
-                                                # Merge information from front and back sides
-                                                asyncio.create_task(
-                                                    merge_id_information(
-                                                        from_id,
-                                                        back_extracted_info,
-                                                        user_states,
-                                                        flow_type,
-                                                    )
-                                                )
-                                            else:
-                                                send_whatsapp_message(
-                                                    from_id,
-                                                    "Sorry, I couldn't extract information from the back side of your ID. Let's proceed with the information we have.",
-                                                )
-                                                # Display front side information only
-                                                asyncio.create_task(
-                                                    display_extracted_info(
-                                                        from_id,
-                                                        user_states[from_id][
-                                                            "verified_info"
-                                                        ],
-                                                        user_states,
-                                                        flow_type,
-                                                    )
-                                                )
-                                        except Exception as e:
-                                            print(
-                                                f"Error processing back side {msg_type}: {e}"
-                                            )
-                                            send_whatsapp_message(
-                                                from_id,
-                                                "An error occurred while processing the back side of your ID. Let's proceed with the information we have.",
-                                            )
-                                            # Display front side information only
-                                            asyncio.create_task(
-                                                display_extracted_info(
-                                                    from_id,
-                                                    user_states[from_id][
-                                                        "verified_info"
-                                                    ],
-                                                    user_states,
-                                                    flow_type,
-                                                )
-                                            )
-                                    else:
-                                        send_whatsapp_message(
-                                            from_id,
-                                            "Sorry, I couldn't retrieve the back side of your ID. Let's proceed with the information we have.",
-                                        )
-                                        # Display front side information only
-                                        asyncio.create_task(
-                                            display_extracted_info(
-                                                from_id,
-                                                user_states[from_id]["verified_info"],
-                                                user_states,
-                                                flow_type,
-                                            )
-                                        )
-                                    return {"status": "success"}
-
-                                # Check if user is in the stage for document upload
-                                elif from_id in user_states and user_states[from_id][
+                                # Emirates ID sides (front, back or both as an
+                                # album) are batched and extracted concurrently
+                                if from_id in user_states and user_states[from_id][
                                     "stage"
                                 ] in [
                                     "medical_upload_document",
                                     "motor_upload_document",
+                                    "waiting_for_back_id",
                                 ]:
-                                    media_data = download_whatsapp_media(media_id)
-                                    if media_data:
-                                        try:
-                                            send_whatsapp_message(
-                                                from_id,
-                                                f"Received your Emirates ID. Processing now, please wait...",
-                                            )
-                                            extracted_info = (
-                                                await process_uploaded_document(
-                                                    from_id,
-                                                    media_data,
-                                                    mime_type,
-                                                    filename,
-                                                    user_states,
-                                                    flow_type,
-                                                )
-                                            )
-                                            if extracted_info:
-                                                print(
-                                                    f"Extracted info: {extracted_info}"
-                                                )
-                                                # Check if card_number is missing and handle accordingly
-                                                asyncio.create_task(
-                                                    display_extracted_info(
-                                                        from_id,
-                                                        extracted_info,
-                                                        user_states,
-                                                        flow_type,
-                                                    )
-                                                )
-                                            else:
-                                                send_whatsapp_message(
-                                                    from_id,
-                                                    f"Sorry, I couldn't extract information from your {msg_type}. Please try again or enter the details manually.",
-                                                )
-                                        except Exception as e:
-                                            print(f"Error processing {msg_type}: {e}")
-                                            send_whatsapp_message(
+                                    for media_message in messages:
+                                        if media_message.get("type") not in [
+                                            "document",
+                                            "image",
+                                        ]:
+                                            continue
+                                        batch_media_id, batch_mime_type, batch_filename = (
+                                            _media_details(media_message)
+                                        )
+                                        if batch_media_id:
+                                            queue_emirates_id_upload(
                                                 from_id,
-                                                f"An error occurred while processing your {msg_type}. Please try again.",
+                                                batch_media_id,
+                                                batch_mime_type,
+                                                batch_filename,
+                                                user_states,
+                                                flow_type,
                                             )
-                                    else:
-                                        send_whatsapp_message(
-                                            from_id,
-                                            f"Sorry, I couldn't retrieve your {msg_type}. Please try again.",
-                                        )
 
                                 elif from_id in user_states and user_states[from_id][
                                     "stage"
@@ -371,9 +319,7 @@ async def webhook(request: Request):
                                                 )
                                             )
                                             if extracted_info:
-                                                print(
-                                                    f"Extracted info: {extracted_info}"
-                                                )
+                                                logger.debug("Extracted info: %s", extracted_info)
                                                 # Check if card_number is missing and handle accordingly
                                                 asyncio.create_task(
                                                     display_license_extracted_info(
@@ -389,7 +335,7 @@ async def webhook(request: Request):
                                                     f"Sorry, I couldn't extract information from your {msg_type}. Please try again or enter the details manually.",
                                                 )
                                         except Exception as e:
-                                            print(f"Error processing {msg_type}: {e}")
+                                            logger.exception("Error processing %s", msg_type)
                                             send_whatsapp_message(
                                                 from_id,
                                                 f"An error occurred while processing your {msg_type}. Please try again.",
@@ -421,9 +367,7 @@ async def webhook(request: Request):
                                                 )
                                             )
                                             if extracted_info:
-                                                print(
-                                                    f"Extracted info: {extracted_info}"
-                                                )
+                                                logger.debug("Extracted info: %s", extracted_info)
                                                 # Check if card_number is missing and handle accordingly
                                                 asyncio.create_task(
                                                     display_mulkiya_extracted_info(
@@ -439,7 +383,7 @@ async def webhook(request: Request):
                                                     f"Sorry, I couldn't extract information from your {msg_type}. Please try again or enter the details manually.",
                                                 )
                                         except Exception as e:
-                                            print(f"Error processing {msg_type}: {e}")
+                                            logger.exception("Error processing %s", msg_type)
                                             send_whatsapp_message(
                                                 from_id,
                                                 f"An error occurred while processing your {msg_type}. Please try again.",
@@ -478,23 +422,23 @@ async def webhook(request: Request):
                                                     process_sme_excel,
                                                 )
 
-                                                excel_data = await process_sme_excel(
-                                                    from_id,
-                                                    media_data,
-                                                    filename,
-                                                    user_states,
-                                                )
-                                                if excel_data:
-                                                    print(
-                                                        f"Excel data extracted successfully: {excel_data.get('total_employees', 0)} employees"
+                                                # Parsing and the partner upload can take a
+                                                # while for a large census; don't hold the webhook
+                                                asyncio.create_task(
+                                                    process_sme_excel(
+                                                        from_id,
+                                                        media_data,
+                                                        filename,
+                                                        user_states,
                                                     )
+                                                )
                                             else:
                                                 send_whatsapp_message(
                                                     from_id,
                                                     "Please upload a valid Excel file (.xlsx or .xls format).",
                                                 )
                                         except Exception as e:
-                                            print(f"Error processing Excel file: {e}")
+                                            logger.exception("Error processing Excel file")
                                             send_whatsapp_message(
                                                 from_id,
                                                 f"An error occurred while processing your Excel file. Please ensure it's in the correct format and try again.",
@@ -507,8 +451,10 @@ async def webhook(request: Request):
 
                     elif "statuses" in value:
                         status_info = value["statuses"][0]
-                        print(
-                            f"Message to {status_info.get('recipient_id', 'unknown')} is now {status_info.get('status', 'unknown')}"
+                        logger.debug(
+                            "Message to %s is now %s",
+                            status_info.get("recipient_id", "unknown"),
+                            status_info.get("status", "unknown"),
                         )
         return {"status": "success"}
 
@@ -564,6 +510,96 @@ async def test_llm(message: str):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@app.delete("/extraction-cache")
+async def purge_extraction_cache():
+    removed = extraction_cache.purge()
+    return {"status": "success", "removed": removed}
+
+
+@app.delete("/extraction-cache/{document_sha256}")
+async def purge_extraction_cache_entry(document_sha256: str):
+    removed = extraction_cache.purge(document_sha256.lower())
+    return {"status": "success", "removed": removed}
+
+
+@app.get("/semantic-cache")
+async def semantic_cache_status():
+    return {"stats": semantic_cache.stats, "entries": semantic_cache.entries()}
+
+
+@app.delete("/semantic-cache")
+async def invalidate_semantic_cache(question: str = None, language: str = None):
+    removed = semantic_cache.invalidate(question, language)
+    return {"status": "success", "removed": removed}
+
+
+@app.get("/outbox")
+async def list_outbox(status: str = None, limit: int = 100):
+    if outbox.dispatcher is None:
+        raise HTTPException(status_code=503, detail="Outbox dispatcher is not running")
+    rows = outbox.dispatcher.outbox.list(status, limit)
+    return {"status": "success", "entries": rows}
+
+
+@app.get("/transcription")
+async def transcription_status():
+    return {"status": "success", "stats": voiceText.transcription_stats()}
+
+
+def _queue_depths():
+    depths = {"voice_queue": voiceText.voice_queue.queue.qsize() if voiceText.voice_queue else 0}
+    if outbox.dispatcher is not None:
+        depths["outbox_pending"] = outbox.dispatcher.outbox.counts().get("pending", 0)
+    return depths
+
+
+# Existing stats dicts, exported as they are at scrape time
+metrics.register_stats("cpu_pool", CPU_POOL_STATS)
+metrics.register_stats("partner_api", PARTNER_API_STATS, label="endpoint")
+metrics.register_stats("translation", TRANSLATION_STATS)
+metrics.register_stats("llm_stream", LLM_STREAM_STATS)
+metrics.register_stats("semantic_cache", lambda: semantic_cache.stats)
+metrics.register_stats("extraction_cache", lambda: extraction_cache.stats)
+metrics.register_stats("transcription", voiceText.transcription_stats)
+metrics.register_stats(
+    "transcription_backend", lambda: voiceText.transcription_stats()["backends"], label="backend"
+)
+metrics.register_stats("queue", _queue_depths)
+metrics.register_stats("logging", LOGGING_STATS)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/plans")
+async def list_plans():
+    return {
+        "status": "success",
+        "plans": [
+            {
+                "id": plan_id,
+                "name": plan["name"],
+                "benefits": sorted(plan["benefits"]),
+                "brochure": plan_kb.brochures.get(plan_id) is not None,
+            }
+            for plan_id, plan in plan_kb.plans.items()
+        ],
+    }
+
+
+@app.post("/plans/reload")
+async def reload_plans():
+    try:
+        loaded = plan_kb.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Plan knowledge base not reloaded: {e}")
+    return {"status": "success", "plans": loaded}
+
+
 @app.get("/get-llm-responses/{phone_number}")
 async def get_llm_responses(phone_number: str):
     if not phone_number.startswith("+"):
@@ -10,6 +10,209 @@ WHATSAPP_TOKEN = os.getenv("ACCESS_TOKEN")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 DEEPGRAM_API_KEY = os.getenv('DEEPGRAM_API_KEY')
+
+# OCR image preprocessing (see utils/image_preprocessing.py)
+OCR_MAX_DIMENSION = int(os.getenv('OCR_MAX_DIMENSION', '1120'))
+OCR_MIN_DIMENSION = int(os.getenv('OCR_MIN_DIMENSION', '640'))
+OCR_JPEG_QUALITY = int(os.getenv('OCR_JPEG_QUALITY', '85'))
+OCR_GRAYSCALE = os.getenv('OCR_GRAYSCALE', 'true').lower() == 'true'
+OCR_SHARPEN = os.getenv('OCR_SHARPEN', 'true').lower() == 'true'
+OCR_PDF_DPI = int(os.getenv('OCR_PDF_DPI', '300'))
+
+# Process pool for CPU-bound rasterization/encoding (see utils/cpu_pool.py)
+CPU_POOL_WORKERS = int(os.getenv('CPU_POOL_WORKERS', str(os.cpu_count() or 1)))
+CPU_POOL_MAX_PENDING = int(os.getenv('CPU_POOL_MAX_PENDING', str(CPU_POOL_WORKERS * 2)))
+
+# Document extraction cache (see utils/extraction_cache.py). Entries are only
+# persisted when both a directory and a Fernet key are configured.
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '500'))
+EXTRACTION_CACHE_TTL = int(os.getenv('EXTRACTION_CACHE_TTL', '86400'))
+EXTRACTION_CACHE_DIR = os.getenv('EXTRACTION_CACHE_DIR')
+EXTRACTION_CACHE_KEY = os.getenv('EXTRACTION_CACHE_KEY')
+
+# Longest wait (seconds) for the other side of an Emirates ID so both sides
+# sent together (album or back-to-back images) are extracted as one batch;
+# the batch starts as soon as both sides are in
+EMIRATES_ID_BATCH_WINDOW = float(os.getenv('EMIRATES_ID_BATCH_WINDOW', '2.5'))
+
+# SME census uploads (see utils/sme_census.py). Sheets are streamed row by row
+# and converted in chunks; uploads over the row limit are rejected.
+SME_CENSUS_MAX_ROWS = int(os.getenv('SME_CENSUS_MAX_ROWS', '10000'))
+SME_CENSUS_CHUNK_ROWS = int(os.getenv('SME_CENSUS_CHUNK_ROWS', '2000'))
+SME_CENSUS_HEADER_SCAN_ROWS = int(os.getenv('SME_CENSUS_HEADER_SCAN_ROWS', '20'))
+
+# insurancelab/insuranceclub API client (see services/partner_api.py). Only
+# enable gzip once the endpoint is confirmed to accept Content-Encoding: gzip.
+PARTNER_API_TIMEOUTS = {
+    "emaf": float(os.getenv('EMAF_API_TIMEOUT', '10')),
+    "medical_insert": float(os.getenv('MEDICAL_INSERT_API_TIMEOUT', '10')),
+    "sme_add": float(os.getenv('SME_ADD_API_TIMEOUT', '30')),
+}
+PARTNER_API_RETRIES = int(os.getenv('PARTNER_API_RETRIES', '3'))
+# Endpoints that may be resent after the request could have reached the
+# partner (read timeouts, 5xx). The partner is not known to de-duplicate, so
+# by default a submission is only resent when it was never delivered
+# (connection errors, 429).
+PARTNER_IDEMPOTENT_ENDPOINTS = {
+    name for name in os.getenv('PARTNER_IDEMPOTENT_ENDPOINTS', '').split(',') if name
+}
+PARTNER_API_MAX_CONNECTIONS = int(os.getenv('PARTNER_API_MAX_CONNECTIONS', '20'))
+# Consecutive failures that open a host's circuit, and seconds before a trial call
+PARTNER_CIRCUIT_FAILURES = int(os.getenv('PARTNER_CIRCUIT_FAILURES', '5'))
+PARTNER_CIRCUIT_RESET = float(os.getenv('PARTNER_CIRCUIT_RESET', '30'))
+PARTNER_API_GZIP = os.getenv('PARTNER_API_GZIP', 'false').lower() == 'true'
+PARTNER_UPLOAD_CHUNK_BYTES = int(os.getenv('PARTNER_UPLOAD_CHUNK_BYTES', str(64 * 1024)))
+PARTNER_UPLOAD_PROGRESS_MIN_BYTES = int(os.getenv('PARTNER_UPLOAD_PROGRESS_MIN_BYTES', str(512 * 1024)))
+
+# Durable outbox for quote submissions (see services/outbox.py)
+OUTBOX_DB_PATH = os.getenv('OUTBOX_DB_PATH', 'data/outbox.sqlite3')
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '2'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20'))
+# Seconds after which a row claimed for sending but never settled (crash,
+# lost task) is handed out again; longer than any partner call can take
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv('OUTBOX_CLAIM_TIMEOUT', '300'))
+
+# Voice message transcription (see services/voiceText.py and
+# services/speech_backends.py). Voice messages are queued and transcribed by
+# TRANSCRIPTION_WORKERS background workers in the session's language
+# ('session') or with language detection ('detect').
+# TRANSCRIPTION_BACKEND is 'deepgram', 'local' (faster-whisper on the CPU),
+# 'auto' (local for short clips in LOCAL_STT_LANGUAGES, else Deepgram, each
+# falling back to the other) or 'stub' (answers TRANSCRIPTION_STUB_TEXT, for
+# local testing).
+TRANSCRIPTION_BACKEND = os.getenv('TRANSCRIPTION_BACKEND', 'deepgram')
+TRANSCRIPTION_LANGUAGE_MODE = os.getenv('TRANSCRIPTION_LANGUAGE_MODE', 'session')
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '4'))
+TRANSCRIPTION_QUEUE_SIZE = int(os.getenv('TRANSCRIPTION_QUEUE_SIZE', '100'))
+TRANSCRIPTION_STUB_TEXT = os.getenv('TRANSCRIPTION_STUB_TEXT', 'Hello')
+DEEPGRAM_MODEL = os.getenv('DEEPGRAM_MODEL', 'nova-2')
+# Per-language model overrides, e.g. "ar:whisper-large,ur:whisper-large"
+DEEPGRAM_LANGUAGE_MODELS = dict(
+    item.split(':', 1)
+    for item in os.getenv('DEEPGRAM_LANGUAGE_MODELS', 'ar:whisper-large,ur:whisper-large').split(',')
+    if ':' in item
+)
+DEEPGRAM_TIMEOUT = float(os.getenv('DEEPGRAM_TIMEOUT', '30'))
+DEEPGRAM_MAX_CONNECTIONS = int(os.getenv('DEEPGRAM_MAX_CONNECTIONS', '10'))
+# faster-whisper model size or path, e.g. "small" or "models/whisper-small-int8"
+LOCAL_STT_MODEL = os.getenv('LOCAL_STT_MODEL', 'small')
+LOCAL_STT_COMPUTE_TYPE = os.getenv('LOCAL_STT_COMPUTE_TYPE', 'int8')
+LOCAL_STT_THREADS = int(os.getenv('LOCAL_STT_THREADS', '2'))
+LOCAL_STT_LANGUAGES = set(os.getenv('LOCAL_STT_LANGUAGES', 'en').split(','))
+LOCAL_STT_MAX_SECONDS = float(os.getenv('LOCAL_STT_MAX_SECONDS', '30'))
+# Voice notes longer than VOICE_CHUNK_MIN_SECONDS are cut at pauses into
+# segments of at most VOICE_CHUNK_MAX_SECONDS, transcribed
+# VOICE_CHUNK_CONCURRENCY at a time. Pauses are at least
+# VOICE_CHUNK_MIN_SILENCE_MS long and VOICE_CHUNK_SILENCE_DB below the
+# clip's average level.
+VOICE_CHUNK_MIN_SECONDS = float(os.getenv('VOICE_CHUNK_MIN_SECONDS', '40'))
+VOICE_CHUNK_MAX_SECONDS = float(os.getenv('VOICE_CHUNK_MAX_SECONDS', '20'))
+VOICE_CHUNK_MIN_SILENCE_MS = int(os.getenv('VOICE_CHUNK_MIN_SILENCE_MS', '400'))
+VOICE_CHUNK_SILENCE_DB = float(os.getenv('VOICE_CHUNK_SILENCE_DB', '16'))
+VOICE_CHUNK_CONCURRENCY = int(os.getenv('VOICE_CHUNK_CONCURRENCY', '4'))
+# Stages that wait for a short answer (a name, a date, yes/no). A long voice
+# note in these stages is answered from its first segment as soon as that
+# is transcribed; the rest is not transcribed.
+VOICE_SHORT_ANSWER_STAGES = {
+    "awaiting_name",
+    "emaf_name",
+    "emaf_phone",
+    "emaf_company",
+    "medical_member_name",
+    "medical_member_gender",
+    "medical_member_dob",
+    "medical_marital_status",
+    "medical_relationship",
+    "medical_sponsor_phone",
+    "medical_sponsor_email",
+    "medical_advisor_code",
+    "medical_sme_client_name",
+    "medical_sme_client_phone",
+    "medical_sme_client_email",
+    "motor_member_name",
+    "motor_member_gender",
+    "motor_member_dob",
+    "motor_registration_city",
+    "claim_policy",
+    "claim_date",
+    "plan_followup",
+}
+
+# Free-form AI replies are streamed and sent sentence by sentence. The first
+# message goes out once this many characters are ready; later messages batch
+# at least LLM_STREAM_CHUNK_CHARS so a long answer is not split into dozens
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'true').lower() == 'true'
+LLM_STREAM_FIRST_CHUNK_CHARS = int(os.getenv('LLM_STREAM_FIRST_CHUNK_CHARS', '80'))
+LLM_STREAM_CHUNK_CHARS = int(os.getenv('LLM_STREAM_CHUNK_CHARS', '400'))
+
+# Semantic cache of general AI answers (see services/semantic_cache.py).
+# SEMANTIC_CACHE_MODEL names an optional sentence-transformers model; without
+# it a hashed n-gram embedder is used and only identical (normalized)
+# questions share an answer. The threshold applies to the model only.
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '86400'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '2000'))
+SEMANTIC_CACHE_MAX_QUESTION_CHARS = int(os.getenv('SEMANTIC_CACHE_MAX_QUESTION_CHARS', '200'))
+# Shorter questions are usually follow-ups that depend on the conversation
+SEMANTIC_CACHE_MIN_WORDS = int(os.getenv('SEMANTIC_CACHE_MIN_WORDS', '3'))
+SEMANTIC_CACHE_MODEL = os.getenv('SEMANTIC_CACHE_MODEL')
+
+# Conversation context for free-form AI answers (see services/context_builder.py):
+# the last CONTEXT_RECENT_TURNS turns are candidates, older ones are folded
+# into a rolling summary CONTEXT_SUMMARY_BATCH at a time
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1200'))
+CONTEXT_RECENT_TURNS = int(os.getenv('CONTEXT_RECENT_TURNS', '12'))
+CONTEXT_MIN_TURNS = int(os.getenv('CONTEXT_MIN_TURNS', '4'))
+CONTEXT_SUMMARY_BATCH = int(os.getenv('CONTEXT_SUMMARY_BATCH', '8'))
+CONTEXT_TURN_MAX_CHARS = int(os.getenv('CONTEXT_TURN_MAX_CHARS', '500'))
+# Hard cap on stored turns for sessions that never reach the AI assistant
+CONVERSATION_HISTORY_MAX_TURNS = int(os.getenv('CONVERSATION_HISTORY_MAX_TURNS', '200'))
+
+# Plan knowledge base: one JSON file per plan (see services/plan_kb.py).
+# Changed files are picked up at most every PLAN_KB_RELOAD_INTERVAL seconds;
+# regenerate a plan's answer rewrites with python -m services.plan_flow
+PLAN_KB_DIR = os.getenv('PLAN_KB_DIR', 'documents/plans')
+PLAN_KB_RELOAD_INTERVAL = float(os.getenv('PLAN_KB_RELOAD_INTERVAL', '10'))
+
+# Pre-generated variants of fixed bot messages (services/message_templates.py);
+# regenerate with python -m services.message_templates
+MESSAGE_TEMPLATES_PATH = os.getenv('MESSAGE_TEMPLATES_PATH', 'documents/message_templates.json')
+
+# Default output of utils/brochure_index.py; each plan names its own index in
+# "brochure_index". Answers need a BM25 score of at least BROCHURE_MIN_SCORE;
+# the LLM only rephrases the matched rows.
+BROCHURE_INDEX_DIR = os.getenv('BROCHURE_INDEX_DIR', 'documents/index/silver-ad')
+BROCHURE_MIN_SCORE = float(os.getenv('BROCHURE_MIN_SCORE', '3.0'))
+BROCHURE_LLM_PHRASING = os.getenv('BROCHURE_LLM_PHRASING', 'true').lower() == 'true'
+
+# Prometheus metrics served at /metrics (see utils/metrics.py). When disabled
+# the instrumentation is a no-op and /metrics returns 404.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Request tracing (see utils/tracing.py): the share of inbound messages traced
+# (0 turns tracing off, 1 traces everything) and the JSON lines file the spans
+# are written to; show the slowest traces with python -m utils.tracing
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', 'logs/traces.jsonl')
+
+# Logging (see utils/logging_setup.py). LOG_FORMAT is 'json' (one object per
+# line) or 'text'; LOG_LEVELS overrides the level per logger, e.g.
+# "services.whatsapp=DEBUG,httpx=WARNING". Messages are cut at
+# LOG_MAX_MESSAGE_CHARS; records beyond LOG_QUEUE_SIZE waiting to be written
+# are dropped. Logs go to stdout unless LOG_FILE is set.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'httpx=WARNING,httpcore=WARNING')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '2000'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_FILE = os.getenv('LOG_FILE')
+# Secret key for the [phone:<tag>] pseudonyms in logs and traces (HMAC), so
+# a tag cannot be turned back into the number by hashing every number. When
+# unset a random key is used and tags only match within one process run.
+LOG_HASH_KEY = os.getenv('LOG_HASH_KEY')
+
 # Structured questions
 INITIAL_QUESTIONS = [
     {
@@ -1,5 +1,12 @@
 import uvicorn
-from api.endpoints import app
+from utils.logging_setup import configure_logging
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Only in the server process: CPU pool workers are spawned and re-run
+    # this module as __mp_main__, and must not load the whole app.
+    # Logging comes first, so messages logged while loading are kept.
+    configure_logging()
+
+    from api.endpoints import app
+
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import re
+from typing import Dict, List
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from config.settings import (
+    CONTEXT_MIN_TURNS,
+    CONTEXT_RECENT_TURNS,
+    CONTEXT_SUMMARY_BATCH,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TURN_MAX_CHARS,
+)
+from .semantic_cache import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Builds the conversation context for free-form AI answers from the session's
+# conversation_history: a rolling summary of older turns plus the recent turns
+# most relevant to the new message, kept within CONTEXT_TOKEN_BUDGET. Turns
+# older than the recent window are folded into the summary in the background
+# and dropped from the history, so neither the prompt nor the state grows
+# without bound.
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Words that point back at earlier turns ("is it also covered", "explain that
+# again", "and how much does that one cost")
+_ANAPHORA_RE = re.compile(
+    r"\b(?:it|its|this|that|these|those|they|them|their|he|she|him|her|his|one|ones"
+    r"|same|also|again|too|other|another|else|above|previous|earlier|former|latter)\b"
+    r"|^\s*(?:and|but|or|so|then|what about|how about)\b"
+)
+# Stages where the assistant answers free-form questions outside any flow
+FREE_CHAT_STAGES = ("ai_response", "waiting_for_new_query")
+
+SUMMARY_PROMPT = """Update the running summary of a customer's WhatsApp conversation with Insura, an insurance assistant.
+Keep what matters for later answers: the products and plans discussed, facts the customer shared about themselves and their family, preferences, and open questions.
+Leave out greetings, passkeys and document numbers. Write at most 120 words in English.
+
+Current summary:
+{summary}
+
+New exchanges:
+{turns}
+
+Updated summary:"""
+
+
+def _words(text: str) -> set:
+    return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 2}
+
+
+def _clip(text: str) -> str:
+    text = " ".join(str(text).split())
+    if len(text) > CONTEXT_TURN_MAX_CHARS:
+        text = text[:CONTEXT_TURN_MAX_CHARS].rstrip() + "…"
+    return text
+
+
+def format_turn(turn: Dict) -> str:
+    return f"Q: {_clip(turn.get('question', ''))}\nA: {_clip(turn.get('answer', ''))}"
+
+
+def select_turns(history: List[Dict], text: str, budget: int) -> List[Dict]:
+    """
+    Pick turns from the recent window within a token budget
+
+    The last CONTEXT_MIN_TURNS turns are always preferred; the rest of the
+    window is ranked by word overlap with the new message. The selection is
+    returned in conversation order.
+    """
+    window = history[-CONTEXT_RECENT_TURNS:]
+    newest = list(range(len(window) - 1, -1, -1))
+    query = _words(text)
+    older = sorted(
+        newest[CONTEXT_MIN_TURNS:],
+        key=lambda i: len(query & _words(format_turn(window[i]))),
+        reverse=True,
+    )
+
+    chosen = []
+    for position, index in enumerate(newest[:CONTEXT_MIN_TURNS] + older):
+        if position >= CONTEXT_MIN_TURNS and not query & _words(format_turn(window[index])):
+            break
+        cost = estimate_tokens(format_turn(window[index]))
+        if cost > budget:
+            continue
+        budget -= cost
+        chosen.append(index)
+    return [window[i] for i in sorted(chosen)]
+
+
+def is_standalone_question(text: str, state: Dict) -> bool:
+    """
+    A question whose answer does not depend on the conversation: asked
+    outside any flow or plan discussion and not referring back to earlier
+    turns
+    """
+    if state.get("active_plan") or state.get("stage", "ai_response") not in FREE_CHAT_STAGES:
+        return False
+    return not _ANAPHORA_RE.search(re.sub(r"['’]", "", text.lower()))
+
+
+def build_messages(system_content: str, prompt: str, state: Dict, text: str) -> list:
+    """
+    System prompt with the conversation summary and selected turns, then the
+    user's message
+
+    Args:
+        state (dict): The user's session state (may be empty)
+        text (str): The user's message, used to rank older turns
+    """
+    summary = state.get("context_summary", "")
+    budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(summary)
+    turns = select_turns(state.get("conversation_history", []), text, budget)
+
+    context = ""
+    if summary:
+        context += f"\n\nSummary of the conversation so far:\n{summary}"
+    if turns:
+        context += "\n\nRecent conversation:\n" + "\n".join(format_turn(t) for t in turns)
+    if context:
+        context += "\n\nUse this context when it helps; do not repeat it back to the customer."
+    return [SystemMessage(content=system_content + context), HumanMessage(content=prompt)]
+
+
+async def update_summary(llm, state: Dict):
+    """
+    Fold turns older than the recent window into the rolling summary
+
+    Runs once at least CONTEXT_SUMMARY_BATCH such turns have accumulated. The
+    folded turns are removed from conversation_history; turns appended while
+    the summary is being generated are kept. A long backlog (a session that
+    never reached the assistant) contributes only its newest turns.
+    """
+    history = state.get("conversation_history", [])
+    pending = history[: max(0, len(history) - CONTEXT_RECENT_TURNS)]
+    if len(pending) < CONTEXT_SUMMARY_BATCH or state.get("context_summary_running"):
+        return
+
+    state["context_summary_running"] = True
+    try:
+        prompt = SUMMARY_PROMPT.format(
+            summary=state.get("context_summary") or "(none yet)",
+            turns="\n".join(
+                format_turn(turn) for turn in pending[-4 * CONTEXT_SUMMARY_BATCH :]
+            ),
+        )
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, llm.invoke, prompt)
+        state["context_summary"] = response.content.strip()
+
+        folded = {id(turn) for turn in pending}
+        history[:] = [turn for turn in history if id(turn) not in folded]
+        logger.info("Folded %d turns into the conversation summary", len(pending))
+    except Exception as e:
+        logger.error("Error updating conversation summary: %s", e)
+    finally:
+        state["context_summary_running"] = False
@@ -1,9 +1,8 @@
 import asyncio
-import json
+import logging
 import time
 from typing import Dict, Optional, List
 
-import requests
 from config.settings import (
     INITIAL_QUESTIONS,
     MEDICAL_QUESTIONS,
@@ -18,18 +17,11 @@ from .whatsapp import (
     clear_user_language,
 )
 from utils.helpers import emaf_document, store_interaction
-from .takaful_emarat_silver import takaful_emarat_silver_flow
-from .translation import detect_language_change_with_llm
+from . import outbox
+from .plan_flow import plan_flow
+from .translation import LANGUAGE_NAMES, detect_language_change_with_llm
 
-
-LANGUAGE_NAMES = {
-    "en": "English",
-    "ar": "Arabic",
-    "ur": "Urdu",
-    "hi": "Hindi",
-    "fr": "French",
-    "es": "Spanish",
-}
+logger = logging.getLogger(__name__)
 
 
 def normalize_user_id(user_id: str) -> str:
@@ -212,6 +204,48 @@ async def resend_current_prompt(from_id: str, user_states: Dict) -> None:
         )
 
 
+async def deliver_medical_quote(from_id: str, response, user_states: dict):
+    """Outbox follow-up: send the quotation link once medical_insert returns an ID"""
+    medical_detail_response = response.get("id") if isinstance(response, dict) else None
+    logger.info("medical_insert response ID: %s", medical_detail_response)
+
+    # Check if response is an integer ID and send the link
+    if not isinstance(medical_detail_response, int):
+        await medical_quote_failed(from_id, "Failed to get valid ID", user_states)
+        return
+
+    link = f"https://insurancelab.ae/customer_plan/{medical_detail_response}"
+    thanks = f"Your quotation is ready. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. Please find the link below to view your quotation: {link}"
+    send_whatsapp_message(from_id, thanks)
+    store_interaction(from_id, "Completion confirmation with link", thanks, user_states)
+
+    # Add a delay before sending the review request
+    await asyncio.sleep(2)
+
+    # Send the review request with a clickable button
+    from .whatsapp import send_link_button
+
+    review_link = "https://www.google.com/search?client=ms-android-samsung-ss&sca_esv=4eb717e6f42bf628&sxsrf=AHTn8zprabdPVFL3C2gXo4guY8besI3jqQ:1744004771562&q=wehbe+insurance+services+llc+reviews&uds=ABqPDvy-z0dcsfm2PY76_gjn-YWou9-AAVQ4iWjuLR6vmDV0vf3KpBMNjU5ZkaHGmSY0wBrWI3xO9O55WuDmXbDq6a3SqlwKf2NJ5xQAjebIw44UNEU3t4CpFvpLt9qFPlVh2F8Gfv8sMuXXSo2Qq0M_ZzbXbg2c323G_bE4tVi7Ue7d_sW0CrnycpJ1CvV-OyrWryZw_TeQ3gLGDgzUuHD04MpSHquYZaSQ0_mIHLWjnu7fu8c7nb6_aGDb_H1Q-86fD2VmWluYA5jxRkC9U2NsSwSSXV4FPW9w1Q2T_Wjt6koJvLgtikd66MqwYiJPX2x9MwLhoGYlpTbKtkJuHwE9eM6wQgieChskow6tJCVjQ75I315dT8n3tUtasGdBkprOlUK9ibPrYr9HqRz4AwzEQaxAq9_EDcsSG_XW0CHuqi2lRKHw592MlGlhjyQibXKSZJh-v3KW4wIVqa-2x0k1wfbZdpaO3BZaKYCacLOxwUKTnXPbQqDPLQDeYgDBwaTLvaCN221H&si=APYL9bvoDGWmsM6h2lfKzIb8LfQg_oNQyUOQgna9TyfQHAoqUvvaXjJhb-NHEJtDKiWdK3OqRhtZNP2EtNq6veOxTLUq88TEa2J8JiXE33-xY1b8ohiuDLBeOOGhuI1U6V4mDc9jmZkDoxLC9b6s6V8MAjPhY-EC_g%3D%3D&sa=X&sqi=2&ved=2ahUKEwi05JSHnMWMAxUw8bsIHRRCDd0Qk8gLegQIHxAB&ictx=1&stq=1&cs=0&lei=o2bzZ_SGIrDi7_UPlIS16A0#ebo=1"
+    review_message = "If you are satisfied with Wehbe(Broker) services, please leave a review for sharing happiness to others!!😊"
+    send_link_button(from_id, review_message, "Click Here", review_link, user_states)
+    store_interaction(
+        from_id, "Review request sent", f"Review link: {review_link}", user_states
+    )
+
+
+async def medical_quote_failed(from_id: str, error: str, user_states: dict):
+    """Outbox follow-up when the quote request could not be delivered"""
+    send_whatsapp_message(
+        from_id,
+        "Thank you for your patience. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. If you have any questions, please contact support@insuranceclub.ae.",
+    )
+    store_interaction(from_id, "API error", error, user_states)
+
+
+def register_outbox_handlers(dispatcher):
+    dispatcher.register("medical_insert", deliver_medical_quote, medical_quote_failed)
+
+
 async def process_conversation(
     from_id: str,
     text: str,
@@ -305,42 +339,40 @@ async def process_conversation(
             await resend_current_prompt(from_id, user_states)
             return
 
-    # Check for Takaful Emarat Silver trigger first
-    if takaful_emarat_silver_flow.detect_takaful_emarat_silver_trigger(text):
-        await takaful_emarat_silver_flow.start_takaful_emarat_silver_flow(
-            from_id, user_states
-        )
+    # Check for a plan from the knowledge base first. A mention of the plan
+    # already being discussed is a question about it, not a restart.
+    plan_id = plan_flow.detect_plan(text)
+    if plan_id and not (
+        state["stage"].startswith("plan_") and state.get("active_plan") == plan_id
+    ):
+        await plan_flow.start_plan_flow(from_id, plan_id, user_states)
         return
 
-    # Handle Takaful Emarat Silver Q&A flow
-    if state["stage"] == "takaful_emarat_silver_qa":
-        if await takaful_emarat_silver_flow.process_takaful_question(
-            from_id, text, user_states
-        ):
+    # Handle plan Q&A flow
+    if state["stage"] == "plan_qa":
+        if await plan_flow.process_plan_question(from_id, text, user_states):
             return
         else:
-            # If not a Takaful question, use LLM
+            # If not a plan question, use LLM
             from .llm import process_message_with_llm
 
             await process_message_with_llm(
                 from_id=from_id, text=text, user_states=user_states
             )
             await asyncio.sleep(1)
-            await takaful_emarat_silver_flow.ask_followup_question(from_id, user_states)
+            await plan_flow.ask_followup_question(from_id, user_states)
             return
 
-    # Handle Takaful Emarat Silver follow-up responses
-    if state["stage"] == "takaful_emarat_silver_followup":
-        await takaful_emarat_silver_flow.handle_followup_response(
+    # Handle plan follow-up responses
+    if state["stage"] == "plan_followup":
+        await plan_flow.handle_followup_response(
             from_id, text, user_states, interactive_response
         )
         return
 
-    # Check for other Takaful questions (only if Takaful Emarat Silver was asked first)
-    if state.get("takaful_emarat_asked", False):
-        if await takaful_emarat_silver_flow.process_takaful_question(
-            from_id, text, user_states
-        ):
+    # Check for other plan questions (only once a plan was asked about)
+    if state.get("active_plan"):
+        if await plan_flow.process_plan_question(from_id, text, user_states):
             return
 
     if (
@@ -417,7 +449,7 @@ async def process_conversation(
             )
 
             # Call emaf_document with the responses dictionary
-            emaf_id = emaf_document(user_states[from_id]["responses"])
+            emaf_id = await emaf_document(user_states[from_id]["responses"])
             if emaf_id:
                 url = f"https://www.insuranceclub.ae/medical_form/view/{emaf_id}"
                 send_whatsapp_message(
@@ -893,8 +925,7 @@ async def process_conversation(
                 from_id, "Salary question", f"Response: {salary_response}", user_states
             )
             user_states[from_id]["stage"] = "completed"
-            user_json = json.dumps(user_states[from_id]["responses"], indent=2)
-            print(f"User data collected for {from_id}: {user_json}")
+            logger.debug("User data collected for %s: %s", from_id, user_states[from_id]["responses"])
             thanks = "Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry"
             send_whatsapp_message(from_id, thanks)
             store_interaction(from_id, "Completion confirmation", thanks, user_states)
@@ -1227,8 +1258,7 @@ async def process_conversation(
             )
 
             user_states[from_id]["stage"] = "completed"
-            user_json = json.dumps(user_states[from_id]["responses"], indent=2)
-            print(f"User data collected for {from_id}: {user_json}")
+            logger.debug("User data collected for %s: %s", from_id, user_states[from_id]["responses"])
 
             thanks = "Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry"
             send_whatsapp_message(from_id, thanks)
@@ -1265,7 +1295,7 @@ async def process_conversation(
 
             # Construct the payload with all collected responses
             responses_dict = user_states[from_id]["responses"]
-            print(responses_dict)
+            logger.debug("Medical responses: %s", responses_dict)
 
             def convert_gender(gender_str):
                 gender_str = gender_str.lower()
@@ -1300,65 +1330,16 @@ async def process_conversation(
                     }
                 ],
             }
-            print(payload)
-            # API call to medical_insert
-            api = "https://insurancelab.ae/Api/medical_insert"
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "X-Requested-With": "XMLHttpRequest",
-            }
+            logger.debug("medical_insert payload: %s", payload)
+            # Queue the quote request in the outbox and acknowledge right away;
+            # the quotation link follows once insurancelab returns an ID
             try:
-                res = requests.post(api, json=payload, headers=headers, timeout=10)
-                res.raise_for_status()
-                medical_detail_response = res.json()["id"]
-                print(f"Payload sent: {json.dumps(payload, indent=2)}")
-                print(f"API response ID: {medical_detail_response}")
-
-                # Check if response is an integer ID and send the link
-                if isinstance(medical_detail_response, int):
-                    link = f"https://insurancelab.ae/customer_plan/{medical_detail_response}"
-                    thanks = f"Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. Please find the link below to view your quotation: {link}"
-                    send_whatsapp_message(from_id, thanks)
-                    store_interaction(
-                        from_id,
-                        "Completion confirmation with link",
-                        thanks,
-                        user_states,
-                    )
-
-                    # Add a delay before sending the review request
-                    await asyncio.sleep(2)
-
-                    # Send the review request with a clickable button
-                    from .whatsapp import send_link_button
-
-                    review_link = "https://www.google.com/search?client=ms-android-samsung-ss&sca_esv=4eb717e6f42bf628&sxsrf=AHTn8zprabdPVFL3C2gXo4guY8besI3jqQ:1744004771562&q=wehbe+insurance+services+llc+reviews&uds=ABqPDvy-z0dcsfm2PY76_gjn-YWou9-AAVQ4iWjuLR6vmDV0vf3KpBMNjU5ZkaHGmSY0wBrWI3xO9O55WuDmXbDq6a3SqlwKf2NJ5xQAjebIw44UNEU3t4CpFvpLt9qFPlVh2F8Gfv8sMuXXSo2Qq0M_ZzbXbg2c323G_bE4tVi7Ue7d_sW0CrnycpJ1CvV-OyrWryZw_TeQ3gLGDgzUuHD04MpSHquYZaSQ0_mIHLWjnu7fu8c7nb6_aGDb_H1Q-86fD2VmWluYA5jxRkC9U2NsSwSSXV4FPW9w1Q2T_Wjt6koJvLgtikd66MqwYiJPX2x9MwLhoGYlpTbKtkJuHwE9eM6wQgieChskow6tJCVjQ75I315dT8n3tUtasGdBkprOlUK9ibPrYr9HqRz4AwzEQaxAq9_EDcsSG_XW0CHuqi2lRKHw592MlGlhjyQibXKSZJh-v3KW4wIVqa-2x0k1wfbZdpaO3BZaKYCacLOxwUKTnXPbQqDPLQDeYgDBwaTLvaCN221H&si=APYL9bvoDGWmsM6h2lfKzIb8LfQg_oNQyUOQgna9TyfQHAoqUvvaXjJhb-NHEJtDKiWdK3OqRhtZNP2EtNq6veOxTLUq88TEa2J8JiXE33-xY1b8ohiuDLBeOOGhuI1U6V4mDc9jmZkDoxLC9b6s6V8MAjPhY-EC_g%3D%3D&sa=X&sqi=2&ved=2ahUKEwi05JSHnMWMAxUw8bsIHRRCDd0Qk8gLegQIHxAB&ictx=1&stq=1&cs=0&lei=o2bzZ_SGIrDi7_UPlIS16A0#ebo=1"
-                    review_message = "If you are satisfied with Wehbe(Broker) services, please leave a review for sharing happiness to others!!😊"
-                    send_link_button(
-                        from_id, review_message, "Click Here", review_link, user_states
-                    )
-                    store_interaction(
-                        from_id,
-                        "Review request sent",
-                        f"Review link: {review_link}",
-                        user_states,
-                    )
-                    del user_states[from_id]
-                    clear_user_language(from_id)
-
-                else:
-                    send_whatsapp_message(
-                        from_id,
-                        "Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. Please wait for further assistance. If you have any questions, please contact support@insuranceclub.ae.",
-                    )
-                    store_interaction(
-                        from_id, "API error", "Failed to get valid ID", user_states
-                    )
-
-            except requests.RequestException as e:
-                print(f"Error calling medical_insert API: {e}")
+                await outbox.submit("medical_insert", from_id, payload)
+                ack = "Thank you for sharing the details. We are preparing your quotation and will send you the link here shortly."
+                send_whatsapp_message(from_id, ack)
+                store_interaction(from_id, "Quotation request queued", ack, user_states)
+            except Exception as e:
+                logger.error("Error queueing medical_insert request: %s", e)
                 send_whatsapp_message(
                     from_id,
                     "Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. Please wait for further assistance. If you have any questions, please contact support@insuranceclub.ae.",
@@ -1711,8 +1692,7 @@ async def process_conversation(
         user_states[from_id]["stage"] = "completed"
 
         # Create a summary JSON of the user's responses
-        user_json = json.dumps(user_states[from_id]["responses"], indent=2)
-        print(f"User data collected for {from_id}: {user_json}")
+        logger.debug("User data collected for %s: %s", from_id, user_states[from_id]["responses"])
 
         # Send confirmation to user
         confirmation1 = "Thank you for providing the claim information."
@@ -2595,8 +2575,7 @@ async def process_conversation(
                 user_states,
             )
             user_states[from_id]["stage"] = "completed"
-            user_json = json.dumps(user_states[from_id]["responses"], indent=2)
-            print(f"User data collected for {from_id}: {user_json}")
+            logger.debug("User data collected for %s: %s", from_id, user_states[from_id]["responses"])
             thanks = "Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry.Please wait for further  assistance. if you have any questions,Please contact support@insuranceclub.ae"
             send_whatsapp_message(from_id, thanks)
             store_interaction(from_id, "Completion confirmation", thanks, user_states)
@@ -2651,8 +2630,7 @@ async def process_conversation(
             )
 
             user_states[from_id]["stage"] = "completed"
-            user_json = json.dumps(user_states[from_id]["responses"], indent=2)
-            print(f"User data collected for {from_id}: {user_json}")
+            logger.debug("User data collected for %s: %s", from_id, user_states[from_id]["responses"])
             thanks = "Thank you for sharing the details. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry.Please wait for further  assistance. if you have any questions,Please contact support@insuranceclub.ae"
             send_whatsapp_message(from_id, thanks)
             store_interaction(from_id, "Completion confirmation", thanks, user_states)
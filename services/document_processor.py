@@ -1,7 +1,12 @@
-import os
-import tempfile
+import asyncio
+import logging
+from config.settings import EMIRATES_ID_BATCH_WINDOW
 from services.conversation_manager import send_whatsapp_message
-from services.whatsapp import send_yes_no_options, send_interactive_options
+from services.whatsapp import (
+    download_whatsapp_media,
+    send_yes_no_options,
+    send_interactive_options,
+)
 from utils.helpers import (
     extract_image_driving_license,
     extract_image_info1,
@@ -10,7 +15,38 @@ from utils.helpers import (
     extract_pdf_info1,
     extract_pdf_mulkiya,
     store_interaction,
+    EXTRACTION_PROMPT_VERSIONS,
 )
+from utils.extraction_cache import extraction_cache
+from services.partner_api import PartnerAPIError, post_partner
+from utils.cpu_pool import run_cpu_bound
+from utils.sme_census import CensusFormatError, read_census
+from utils.tracing import bind, trace_message
+
+logger = logging.getLogger(__name__)
+
+
+async def _extract_with_cache(
+    document_data: bytes, document_type: str, extractor
+) -> dict:
+    """
+    Run an extractor unless the same upload was already extracted
+
+    Only non-empty results are cached, so a failed extraction is retried the
+    next time the user sends the document.
+    """
+    cache_key = extraction_cache.make_key(
+        document_data, document_type, EXTRACTION_PROMPT_VERSIONS[document_type]
+    )
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Extraction cache hit for %s", document_type)
+        return cached
+
+    extracted_info = await extractor(document_data)
+    if extracted_info and any(value != "" for value in extracted_info.values()):
+        extraction_cache.set(cache_key, extracted_info)
+    return extracted_info
 
 
 async def process_uploaded_document(
@@ -29,28 +65,225 @@ async def process_uploaded_document(
         )
         return None
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-        temp_file.write(document_data)
-        temp_file.flush()
-        temp_path = temp_file.name
-
     try:
-        if file_ext == ".pdf":
-            extracted_info = await extract_pdf_info1(temp_path)
-        else:
-            extracted_info = await extract_image_info1(temp_path)
+        # Bytes go straight to the CPU pool; no temporary file is needed.
+        # Re-sent documents are served from the extraction cache.
+        extractor = extract_pdf_info1 if file_ext == ".pdf" else extract_image_info1
+        extracted_info = await _extract_with_cache(
+            document_data, "emirates_id", extractor
+        )
 
         if not extracted_info or all(value == "" for value in extracted_info.values()):
-            print(f"Extraction failed or returned empty for {filename}")
+            logger.warning("Extraction failed or returned empty for %s", filename)
             return None
 
         user_states[from_id]["document_name"] = filename
         return extracted_info
     except Exception as e:
-        print(f"Error in process_uploaded_document: {e}")
+        logger.exception("Error in process_uploaded_document")
+        return None
+
+
+# Fields printed on each side of the Emirates ID. The back also carries the
+# machine readable zone, which repeats most front fields, so a side is
+# classified by the share of its own fields present rather than by count.
+EMIRATES_ID_FRONT_FIELDS = (
+    "name",
+    "nationality",
+    "date_of_birth",
+    "gender",
+    "issue_date",
+    "expiry_date",
+)
+EMIRATES_ID_BACK_FIELDS = ("card_number", "occupation", "employer", "issuing_place")
+
+
+def _side_score(extracted_info: dict) -> float:
+    """Positive for a back side, negative for a front side"""
+    front = sum(1 for f in EMIRATES_ID_FRONT_FIELDS if extracted_info.get(f))
+    back = sum(1 for f in EMIRATES_ID_BACK_FIELDS if extracted_info.get(f))
+    return back / len(EMIRATES_ID_BACK_FIELDS) - front / len(EMIRATES_ID_FRONT_FIELDS)
+
+
+def classify_emirates_id_side(extracted_info: dict) -> str:
+    """Classify an extraction as "front" or "back" from the fields it contains"""
+    return "back" if _side_score(extracted_info) > 0 else "front"
+
+
+def merge_emirates_id_sides(front_info: dict, back_info: dict) -> dict:
+    """
+    Merge both sides of an Emirates ID field by field
+
+    Each field is taken from the side it is printed on, falling back to the
+    other side when that side did not yield it. Empty values are dropped.
+    """
+    merged_info = {}
+    for key in list(front_info) + [k for k in back_info if k not in front_info]:
+        if key in EMIRATES_ID_BACK_FIELDS:
+            value = back_info.get(key) or front_info.get(key)
+        else:
+            value = front_info.get(key) or back_info.get(key)
+        if value:
+            merged_info[key] = value
+    return merged_info
+
+
+# Emirates ID uploads waiting for the batch window to close, per user
+pending_id_uploads = {}
+# Serializes batch processing per user so a late upload sees the stage left
+# by the previous batch; an entry is removed once its last batch is done
+id_batch_locks = {}
+
+ID_UPLOAD_STAGES = ("medical_upload_document", "motor_upload_document", "waiting_for_back_id")
+
+
+def queue_emirates_id_upload(
+    from_id: str,
+    media_id: str,
+    mime_type: str,
+    filename: str,
+    user_states: dict,
+    flow_type: str = None,
+):
+    """
+    Collect an Emirates ID upload and process it together with any other
+    side that arrives within EMIRATES_ID_BATCH_WINDOW seconds
+    """
+    upload = {"media_id": media_id, "mime_type": mime_type, "filename": filename}
+    batch = pending_id_uploads.get(from_id)
+    if batch is not None:
+        batch["uploads"].append(upload)
+        if len(batch["uploads"]) >= 2:
+            batch["complete"].set()
+        return
+
+    pending_id_uploads[from_id] = {"uploads": [upload], "complete": asyncio.Event()}
+    asyncio.create_task(
+        _process_emirates_id_batch(from_id, user_states, flow_type)
+    )
+
+
+async def _download_and_extract(
+    from_id: str, upload: dict, user_states: dict, flow_type: str = None
+) -> dict:
+    loop = asyncio.get_running_loop()
+    media_data = await loop.run_in_executor(
+        None, bind(download_whatsapp_media), upload["media_id"]
+    )
+    if not media_data:
         return None
+    return await process_uploaded_document(
+        from_id,
+        media_data,
+        upload["mime_type"],
+        upload["filename"],
+        user_states,
+        flow_type,
+    )
+
+
+@trace_message("emirates_id_upload")
+async def _process_emirates_id_batch(
+    from_id: str, user_states: dict, flow_type: str = None
+):
+    batch = pending_id_uploads[from_id]
+    stage = user_states.get(from_id, {}).get("stage")
+    if stage in ID_UPLOAD_STAGES:
+        # Acknowledge right away; extraction starts when the batch closes
+        if stage == "waiting_for_back_id":
+            message = "Received the back side of your Emirates ID. Processing now, please wait..."
+        else:
+            message = "Received your Emirates ID. Processing now, please wait..."
+        send_whatsapp_message(from_id, message)
+
+    # After a front only the back is expected; otherwise wait for the other
+    # side, closing the window early once both are in
+    if stage != "waiting_for_back_id":
+        try:
+            await asyncio.wait_for(batch["complete"].wait(), EMIRATES_ID_BATCH_WINDOW)
+        except asyncio.TimeoutError:
+            pass
+    uploads = pending_id_uploads.pop(from_id)["uploads"]
+    if len(uploads) > 2:
+        logger.info("Received %d Emirates ID images, using the first two", len(uploads))
+        uploads = uploads[:2]
+
+    entry = id_batch_locks.setdefault(from_id, {"lock": asyncio.Lock(), "batches": 0})
+    entry["batches"] += 1
+    try:
+        async with entry["lock"]:
+            await _handle_emirates_id_batch(from_id, uploads, user_states, flow_type)
     finally:
-        os.unlink(temp_path)
+        entry["batches"] -= 1
+        if not entry["batches"]:
+            del id_batch_locks[from_id]
+
+
+async def _handle_emirates_id_batch(
+    from_id: str, uploads: list, user_states: dict, flow_type: str = None
+):
+    if from_id not in user_states:
+        return
+    stage = user_states[from_id]["stage"]
+    if stage not in ID_UPLOAD_STAGES:
+        logger.info("Ignoring Emirates ID upload from %s in stage %s", from_id, stage)
+        return
+
+    try:
+        results = await asyncio.gather(
+            *[
+                _download_and_extract(from_id, upload, user_states, flow_type)
+                for upload in uploads
+            ],
+            return_exceptions=True,
+        )
+    except Exception as e:
+        logger.exception("Error processing Emirates ID batch")
+        results = []
+
+    extracted = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Error processing Emirates ID image: %s", result)
+        elif result:
+            extracted.append(result)
+    logger.info("Extracted info from %d of %d images", len(extracted), len(uploads))
+    logger.debug("Extracted Emirates ID info: %s", extracted)
+
+    if stage == "waiting_for_back_id":
+        # The front is already known; the most back-like image completes it
+        if extracted:
+            back_info = max(extracted, key=_side_score)
+            await merge_id_information(from_id, back_info, user_states, flow_type)
+        else:
+            send_whatsapp_message(
+                from_id,
+                "Sorry, I couldn't extract information from the back side of your ID. Let's proceed with the information we have.",
+            )
+            await display_extracted_info(
+                from_id, user_states[from_id]["verified_info"], user_states, flow_type
+            )
+        return
+
+    if not extracted:
+        send_whatsapp_message(
+            from_id,
+            "Sorry, I couldn't extract information from your Emirates ID. Please try again or enter the details manually.",
+        )
+        return
+
+    if len(extracted) == 2:
+        front_info, back_info = sorted(extracted, key=_side_score)
+        if classify_emirates_id_side(back_info) == "back":
+            user_states[from_id]["extracted_info"] = front_info
+            user_states[from_id]["verified_info"] = front_info.copy()
+            await merge_id_information(from_id, back_info, user_states, flow_type)
+            return
+        # Both images show the front; keep whatever each one yielded
+        extracted = [merge_emirates_id_sides(front_info, back_info)]
+
+    # A single side: asks for the back when the card number is missing
+    await display_extracted_info(from_id, extracted[0], user_states, flow_type)
 
 
 async def display_extracted_info(
@@ -119,22 +352,7 @@ async def merge_id_information(
 ):
     # Retrieve the front side information
     front_info = user_states[from_id]["verified_info"]
-
-    # Merge the information, prioritizing back side for missing fields
-    # but front side for duplicated fields
-    merged_info = {}
-
-    # Start with all back info
-    for key, value in back_extracted_info.items():
-        if value:  # Only include non-empty values
-            merged_info[key] = value
-
-    # Add front info, preserving existing values
-    for key, value in front_info.items():
-        if (
-            value and key not in merged_info
-        ):  # Only add if not already present from back
-            merged_info[key] = value
+    merged_info = merge_emirates_id_sides(front_info, back_extracted_info)
 
     # Update the verified_info with the merged data
     user_states[from_id]["verified_info"] = merged_info
@@ -296,7 +514,7 @@ async def proceed_with_verified_document(from_id: str, user_states: dict):
     verified_info = user_states[from_id]["verified_info"]
     # flow_type = user_states.get("service_type")
     flow_type = user_states[from_id]["service_type"]
-    print("fllow-----------------------------------", flow_type)
+    logger.debug("Verified document for flow %s", flow_type)
     # Update member information with the verified info
     if flow_type == "Medical Insurance":
         user_states[from_id]["responses"]["member_name"] = verified_info.get("name", "")
@@ -398,6 +616,7 @@ async def proceed_without_edits(from_id: str, user_states: dict):
 # ?TodoDriving License
 
 
+@trace_message("driving_license_upload")
 async def process_uploaded_license_document(
     from_id: str,
     document_data: bytes,
@@ -414,28 +633,23 @@ async def process_uploaded_license_document(
         )
         return None
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-        temp_file.write(document_data)
-        temp_file.flush()
-        temp_path = temp_file.name
-
     try:
-        if file_ext == ".pdf":
-            extracted_info = await extract_pdf_driving_license(temp_path)
-        else:
-            extracted_info = await extract_image_driving_license(temp_path)
+        # Bytes go straight to the CPU pool; no temporary file is needed.
+        # Re-sent documents are served from the extraction cache.
+        extractor = extract_pdf_driving_license if file_ext == ".pdf" else extract_image_driving_license
+        extracted_info = await _extract_with_cache(
+            document_data, "driving_license", extractor
+        )
 
         if not extracted_info or all(value == "" for value in extracted_info.values()):
-            print(f"Extraction failed or returned empty for {filename}")
+            logger.warning("Extraction failed or returned empty for %s", filename)
             return None
 
         user_states[from_id]["motor_driving_license_document_name"] = filename
         return extracted_info
     except Exception as e:
-        print(f"Error in process_uploaded_document: {e}")
+        logger.exception("Error in process_uploaded_document")
         return None
-    finally:
-        os.unlink(temp_path)
 
 
 async def display_license_extracted_info(
@@ -723,6 +937,7 @@ async def proceed__license_without_edits(
 # ToDOMulkiya
 
 
+@trace_message("mulkiya_upload")
 async def process_uploaded_mulkiya_document(
     from_id: str,
     document_data: bytes,
@@ -739,28 +954,23 @@ async def process_uploaded_mulkiya_document(
         )
         return None
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-        temp_file.write(document_data)
-        temp_file.flush()
-        temp_path = temp_file.name
-
     try:
-        if file_ext == ".pdf":
-            extracted_info = await extract_pdf_mulkiya(temp_path)
-        else:
-            extracted_info = await extract_image_mulkiya(temp_path)
+        # Bytes go straight to the CPU pool; no temporary file is needed.
+        # Re-sent documents are served from the extraction cache.
+        extractor = extract_pdf_mulkiya if file_ext == ".pdf" else extract_image_mulkiya
+        extracted_info = await _extract_with_cache(
+            document_data, "mulkiya", extractor
+        )
 
         if not extracted_info or all(value == "" for value in extracted_info.values()):
-            print(f"Extraction failed or returned empty for {filename}")
+            logger.warning("Extraction failed or returned empty for %s", filename)
             return None
 
         user_states[from_id]["motor_driving_mulkiya_document_name"] = filename
         return extracted_info
     except Exception as e:
-        print(f"Error in process_uploaded_document: {e}")
+        logger.exception("Error in process_uploaded_document")
         return None
-    finally:
-        os.unlink(temp_path)
 
 
 async def display_mulkiya_extracted_info(
@@ -1069,7 +1279,7 @@ async def proceed__mulkiya_without_edits(
         )
 
         if not send_success:
-            print(f"Failed to send confirmation message to {from_id}")
+            logger.warning("Failed to send confirmation message to %s", from_id)
             send_whatsapp_message(
                 from_id,
                 "There was an issue processing your request. Please try again later.",
@@ -1078,7 +1288,7 @@ async def proceed__mulkiya_without_edits(
 
         # Set the stage to motor_vehicle_wish_to_buy
         user_states[from_id]["stage"] = "motor_vehicle_wish_to_buy"
-        print(f"Stage set to motor_vehicle_wish_to_buy for user {from_id}")
+        logger.info("Stage set to motor_vehicle_wish_to_buy for user %s", from_id)
 
         # Send interactive options for insurance type
         wish_to_buy_question = "Now,let's move on to You Wish to Buy"
@@ -1094,11 +1304,9 @@ async def proceed__mulkiya_without_edits(
                 wish_to_buy_question,
                 user_states,
             )
-            print(
-                f"Interactive options sent successfully to {from_id}: {valid_wish_to_buy}"
-            )
+            logger.info("Interactive options sent to %s: %s", from_id, valid_wish_to_buy)
         else:
-            print(f"Failed to send interactive options to {from_id}")
+            logger.warning("Failed to send interactive options to %s", from_id)
             # Fallback: Send a text prompt to keep the flow moving
             fallback_message = "Please reply with the type of insurance  You Wish to Buy: 'Comprehensive' or 'Third Party'."
             send_whatsapp_message(from_id, fallback_message)
@@ -1110,7 +1318,7 @@ async def proceed__mulkiya_without_edits(
             )
 
     except Exception as e:
-        print(f"Error in proceed__mulkiya_without_edits for user {from_id}: {str(e)}")
+        logger.exception("Error in proceed__mulkiya_without_edits for user %s", from_id)
         error_message = "An error occurred while processing your mulkiya information. Please try again or contact support."
         send_whatsapp_message(from_id, error_message)
         store_interaction(
@@ -1118,246 +1326,38 @@ async def proceed__mulkiya_without_edits(
         )
 
 
-async def extract_excel_sme_census(file_path: str) -> dict:
+async def extract_excel_sme_census(document_data: bytes) -> dict:
     """
     Extract information from SME Census Excel sheet and return as JSON
 
     Args:
-        file_path (str): Path to the Excel file
+        document_data (bytes): Raw bytes of the uploaded workbook
 
     Returns:
         Dict: Structured information extracted from the Excel sheet with list of employee records
     """
     try:
-        import pandas as pd
-        import logging
-        from datetime import datetime
-
-        # Read the Excel file
-        df = pd.read_excel(file_path)
-        logging.info(
-            f"Successfully read Excel file with {len(df)} rows and {len(df.columns)} columns"
-        )
-        print(f"Excel file columns: {df.columns.tolist()}")
-
-        # Normalize column names - convert all to strings first (handle False, NaN, etc.)
-        # Create a mapping of original column names to cleaned string versions
-        normalized_columns = []
-        original_to_normalized = {}
-        for idx, col in enumerate(df.columns):
-            # Convert column name to string, handling False, NaN, None, etc.
-            if pd.isna(col) or col is None or col is False:
-                col_str = f"Column_{idx}"
-            else:
-                col_str = str(col).strip()
-            normalized_columns.append(col_str)
-            original_to_normalized[df.columns[idx]] = col_str
-
-        # Update dataframe with normalized column names
-        df.columns = normalized_columns
-        column_map = {}
-
-        for col in normalized_columns:
-            # Skip auto-generated column names (from empty/missing headers)
-            if col.startswith("Column_"):
-                continue
-
-            col_lower = col.lower()
-            # Try to match column names - check for first name first
-            if "first name" in col_lower or (
-                col_lower == "name"
-                or ("name" in col_lower and col_lower != "nationality")
-            ):
-                if "first_name" not in column_map:  # Only map if not already mapped
-                    column_map["first_name"] = col
-            elif (
-                "date of birth" in col_lower
-                or "dob" in col_lower
-                or "birth" in col_lower
-            ):
-                if "dob" not in column_map:
-                    column_map["dob"] = col
-            elif "gender" in col_lower:
-                if "gender" not in column_map:
-                    column_map["gender"] = col
-            elif "nationality" in col_lower:
-                if "nationality" not in column_map:
-                    column_map["nationality"] = col
-            elif "marital" in col_lower and "status" in col_lower:
-                if "marital_status" not in column_map:
-                    column_map["marital_status"] = col
-            elif "relation" in col_lower:
-                if "relation" not in column_map:
-                    column_map["relation"] = col
-            elif "emirate" in col_lower:
-                if "emirate" not in column_map:
-                    column_map["emirate"] = col
-            elif "visa" in col_lower and (
-                "issued" in col_lower or "location" in col_lower
-            ):
-                if "visa_location" not in column_map:
-                    column_map["visa_location"] = col
-
-        print(f"Mapped columns: {column_map}")
-
-        # Convert DataFrame to list of dictionaries
-        employees_list = []
-        members_list = []
-
-        for index, row in df.iterrows():
-            # Get employee data using mapped columns
-            first_name = ""
-            if "first_name" in column_map:
-                col_name = column_map["first_name"]
-                first_name = (
-                    str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-                )
-
-            dob_raw = ""
-            if "dob" in column_map:
-                col_name = column_map["dob"]
-                dob_raw = row[col_name] if pd.notna(row[col_name]) else ""
-
-            gender_raw = ""
-            if "gender" in column_map:
-                col_name = column_map["gender"]
-                gender_raw = (
-                    str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-                )
-
-            nationality = ""
-            if "nationality" in column_map:
-                col_name = column_map["nationality"]
-                nationality = (
-                    str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-                )
+        # The workbook is streamed and converted in the CPU pool
+        result = await run_cpu_bound(read_census, document_data)
 
-            marital_status_raw = ""
-            if "marital_status" in column_map:
-                col_name = column_map["marital_status"]
-                marital_status_raw = (
-                    str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-                )
-
-            relation = ""
-            if "relation" in column_map:
-                col_name = column_map["relation"]
-                relation = str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-
-            emirate = ""
-            if "emirate" in column_map:
-                col_name = column_map["emirate"]
-                emirate = str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-
-            # If Emirate column not found, try visa issued location
-            if not emirate and "visa_location" in column_map:
-                col_name = column_map["visa_location"]
-                emirate = str(row[col_name]).strip() if pd.notna(row[col_name]) else ""
-
-            # Format date of birth (convert to YYYY-MM-DD format if possible)
-            dob_formatted = ""
-            if dob_raw:
-                try:
-                    # Try parsing different date formats
-                    if isinstance(dob_raw, str):
-                        # Try various date formats
-                        for fmt in [
-                            "%Y-%m-%d",
-                            "%d-%m-%Y",
-                            "%d/%m/%Y",
-                            "%Y/%m/%d",
-                            "%m/%d/%Y",
-                            "%d.%m.%Y",
-                        ]:
-                            try:
-                                parsed_date = datetime.strptime(
-                                    str(dob_raw).strip(), fmt
-                                )
-                                dob_formatted = parsed_date.strftime("%Y-%m-%d")
-                                break
-                            except (ValueError, TypeError):
-                                continue
-                        # If no format matched, try pandas datetime parsing
-                        if not dob_formatted:
-                            parsed_date = pd.to_datetime(dob_raw, errors="coerce")
-                            if pd.notna(parsed_date):
-                                dob_formatted = parsed_date.strftime("%Y-%m-%d")
-                    else:
-                        # If it's already a datetime object
-                        parsed_date = pd.to_datetime(dob_raw, errors="coerce")
-                        if pd.notna(parsed_date):
-                            dob_formatted = parsed_date.strftime("%Y-%m-%d")
-                except Exception as e:
-                    print(f"Error parsing date {dob_raw}: {e}")
-                    dob_formatted = str(dob_raw).strip()
-
-            # Format gender (capitalize first letter)
-            gender = gender_raw.capitalize() if gender_raw else ""
-            if gender.lower() in ["m", "male"]:
-                gender = "Male"
-            elif gender.lower() in ["f", "female"]:
-                gender = "Female"
-
-            # Format marital status (capitalize first letter)
-            marital_status = (
-                marital_status_raw.capitalize() if marital_status_raw else ""
-            )
-            if marital_status.lower() in ["s", "single"]:
-                marital_status = "Single"
-            elif marital_status.lower() in ["m", "married"]:
-                marital_status = "Married"
-
-            employee_record = {
-                "sr_no": str(row.get("SR No.", "")).strip()
-                if pd.notna(row.get("SR No."))
-                else "",
-                "first_name": first_name,
-                "gender": gender,
-                "date_of_birth": dob_formatted,
-                "nationality": nationality,
-                "marital_status": marital_status,
-                "relation": relation,
-                "emirate": emirate,
-                "visa_issued_location": emirate,
-            }
-            employees_list.append(employee_record)
-
-            # Create member record in the required format
-            member_record = {
-                "mem_name": first_name,
-                "mem_dob": dob_formatted,
-                "mem_gender": gender,
-                "mem_marital_status": marital_status,
-                "mem_relation": relation,
-                "mem_nationality": nationality,
-                "mem_emirate": emirate,
-            }
-            members_list.append(member_record)
-
-        # Create the final result structure
-        result = {
-            "total_employees": len(employees_list),
-            "employees": employees_list,
-            "members": members_list,
-            "columns_found": df.columns.tolist(),
-            "file_processed": True,
-        }
-
-        logging.info(
-            f"Successfully extracted {len(employees_list)} employee records from Excel file"
+        logger.info(
+            "Extracted %s employee records from Excel file, columns: %s",
+            result["total_employees"], result["columns_found"],
         )
-        print(f"Extracted {len(members_list)} members from Excel")
         return result
 
+    except CensusFormatError:
+        raise
     except Exception as e:
         import logging
         from fastapi import HTTPException
 
-        logging.error(f"Error in extract_excel_sme_census: {e}")
-        print(f"Error in extract_excel_sme_census: {e}")
+        logger.error("Error in extract_excel_sme_census: %s", e)
+        logger.exception("Error in extract_excel_sme_census")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
+@trace_message("sme_census_upload")
 async def process_sme_excel(
     from_id: str, document_data: bytes, filename: str, user_states: dict
 ):
@@ -1365,18 +1365,10 @@ async def process_sme_excel(
     Process SME Census Excel file
     """
     try:
-        import requests
         import json
-        import asyncio
 
-        # Save the Excel file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-            temp_file.write(document_data)
-            temp_file.flush()
-            temp_path = temp_file.name
-
-        # Extract Excel data
-        excel_data = await extract_excel_sme_census(temp_path)
+        # Extract Excel data straight from the uploaded bytes
+        excel_data = await extract_excel_sme_census(document_data)
 
         # Store the Excel data in user_states
         user_states[from_id]["sme_excel_data"] = excel_data
@@ -1405,12 +1397,11 @@ async def process_sme_excel(
             "members": members,
         }
 
-        # Print payload to terminal for verification
-        print("\n" + "=" * 80)
-        print("SME ADD PAYLOAD:")
-        print("=" * 80)
-        print(json.dumps(payload, indent=2, ensure_ascii=False))
-        print("=" * 80 + "\n")
+        # Members summarized; a large census would flood the log
+        logger.debug(
+            "SME add payload: %s",
+            json.dumps({**payload, "members": f"<{len(members)} members>"}, ensure_ascii=False),
+        )
 
         # Store payload in user_states for reference
         user_states[from_id]["sme_payload"] = payload
@@ -1422,30 +1413,19 @@ async def process_sme_excel(
             from_id, "Excel upload acknowledgment", ack_message, user_states
         )
 
-        await asyncio.sleep(1)
-
-        # Send API request to sme_add endpoint
-        api_url = "https://insurancelab.ae/Api/sme_add/"
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "X-Requested-With": "XMLHttpRequest",
-        }
+        async def report_progress(percent: int):
+            if percent < 100:
+                send_whatsapp_message(
+                    from_id, f"Submitting your census... {percent}% sent"
+                )
 
         try:
-            print(f"\nSending POST request to: {api_url}")
-            print(f"Headers: {headers}")
-
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-
-            # Parse response
-            response_data = response.json()
-            print(f"\nAPI Response Status Code: {response.status_code}")
-            print(
-                f"API Response Data: {json.dumps(response_data, indent=2, ensure_ascii=False)}"
+            # Send API request to sme_add endpoint without blocking the event loop
+            logger.info("Submitting %d members to sme_add", len(members))
+            response_data = await post_partner(
+                "sme_add", payload, progress=report_progress
             )
+            logger.debug("sme_add response: %s", response_data)
 
             # Extract ID from response
             sme_id = None
@@ -1458,8 +1438,7 @@ async def process_sme_excel(
             elif isinstance(response_data, (int, str)):
                 sme_id = response_data
 
-            print(f"\nExtracted SME ID: {sme_id}")
-            print("=" * 80 + "\n")
+            logger.info("sme_add returned SME ID %s", sme_id)
 
             # Store the ID in user_states
             user_states[from_id]["sme_id"] = sme_id
@@ -1501,7 +1480,7 @@ async def process_sme_excel(
 
                 # Reset/delete user state to restart conversation
                 del user_states[from_id]
-                print(f"User state reset for {from_id} after successful SME submission")
+                logger.info("User state reset for %s after successful SME submission", from_id)
             else:
                 # No valid ID - send generic message
                 success_message = "Thank you for sharing the details. Your data has been processed. We will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. Please wait for further assistance. If you have any questions, please contact support@insuranceclub.ae"
@@ -1510,22 +1489,16 @@ async def process_sme_excel(
                     from_id, "SME completion confirmation", success_message, user_states
                 )
 
-        except requests.RequestException as e:
-            print(f"\nError calling SME ADD API: {e}")
-            print(f"Error details: {str(e)}")
-            if hasattr(e, "response") and e.response is not None:
-                print(f"Response status: {e.response.status_code}")
-                print(f"Response body: {e.response.text}")
-            print("=" * 80 + "\n")
+        except PartnerAPIError as e:
+            logger.error(
+                "Error calling sme_add: %s (status %s, body %s)", e, e.status_code, e.body
+            )
 
             # Send error message but continue flow
             error_message = "Thank you for sharing the details. We encountered an issue processing your data, but we will inform Shafeeque Shanavas from Wehbe Insurance to assist you further with your enquiry. Please wait for further assistance. If you have any questions, please contact support@insuranceclub.ae"
             send_whatsapp_message(from_id, error_message)
             store_interaction(from_id, "SME API error", f"Error: {str(e)}", user_states)
 
-        # Clean up temporary file
-        os.unlink(temp_path)
-
         # Only ask "Would you like to purchase our insurance again?" if user state still exists
         # (it will be deleted if we got a valid ID and sent the link)
         if from_id in user_states:
@@ -1540,16 +1513,13 @@ async def process_sme_excel(
 
         return excel_data
 
-    except Exception as e:
-        import traceback
-
-        print(f"Error processing Excel file: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        if "temp_path" in locals():
-            try:
-                os.unlink(temp_path)
-            except (OSError, FileNotFoundError):
-                pass
+    except CensusFormatError as e:
+        logger.info("Rejected Excel file from %s: %s", from_id, e)
+        send_whatsapp_message(from_id, str(e))
+        return None
+
+    except Exception:
+        logger.exception("Error processing Excel file")
         send_whatsapp_message(
             from_id,
             "Sorry, there was an error processing your Excel file. Please ensure it's in the correct format and try again.",
@@ -1,56 +1,208 @@
 import asyncio
+import logging
+import re
+import time
+from typing import Tuple
 from langchain_groq.chat_models import ChatGroq
-from langchain.schema import HumanMessage, SystemMessage
-from config.settings import GROQ_API_KEY
+from config.settings import (
+    CONVERSATION_HISTORY_MAX_TURNS,
+    GROQ_API_KEY,
+    LLM_STREAMING,
+    SEMANTIC_CACHE_ENABLED,
+    LLM_STREAM_CHUNK_CHARS,
+    LLM_STREAM_FIRST_CHUNK_CHARS,
+)
+from .context_builder import build_messages, is_standalone_question, update_summary
+from .semantic_cache import estimate_tokens, semantic_cache
+from .translation import LANGUAGE_NAMES, LocalizedText
 from .whatsapp import send_whatsapp_message, send_typing_indicator
 from utils.helpers import store_interaction
+from utils.metrics import llm_callbacks
+from utils.tracing import bind, span
 
+logger = logging.getLogger(__name__)
 
-def initialize_llm():
+# End of a sentence (Latin, Arabic and Urdu punctuation) or of a paragraph
+_SENTENCE_END_RE = re.compile(r"[.!?؟۔](?=\s)|\n\s*\n")
+# WhatsApp rejects text bodies over 4096 characters
+_MAX_MESSAGE_CHARS = 4000
+
+# Bump when the free-form system prompt changes so cached answers are not reused
+LLM_PROMPT_VERSION = 1
+
+# Streaming statistics
+LLM_STREAM_STATS = {
+    "streamed_replies": 0,
+    "messages_sent": 0,
+    "first_message_seconds_sum": 0.0,
+    "total_seconds_sum": 0.0,
+}
+
+
+def initialize_llm(purpose: str = "chat"):
     return ChatGroq(
         model="llama-3.3-70b-versatile",
         temperature=0,
         api_key=GROQ_API_KEY,
         groq_proxy=None,
+        callbacks=llm_callbacks(purpose),
     )
 
 
+def split_ready_text(buffer: str, min_chars: int):
+    """
+    Split off the part of a streamed answer that can be sent now
+
+    Returns the text up to the last sentence boundary once it is at least
+    `min_chars` long, and the remainder still being generated. A buffer that
+    grows past the WhatsApp limit without a boundary is cut at a space.
+    """
+    end = 0
+    for match in _SENTENCE_END_RE.finditer(buffer):
+        end = match.end()
+    if end and end >= min_chars:
+        return buffer[:end].strip(), buffer[end:].lstrip()
+    if len(buffer) > _MAX_MESSAGE_CHARS:
+        cut = buffer.rfind(" ", 0, _MAX_MESSAGE_CHARS)
+        cut = cut if cut > 0 else _MAX_MESSAGE_CHARS
+        return buffer[:cut].strip(), buffer[cut:].lstrip()
+    return "", buffer
+
+
+async def stream_reply(llm, messages: list, from_id: str, language: str) -> Tuple[str, bool]:
+    """
+    Stream a completion to the user in sentence-sized WhatsApp messages
+
+    The first message is sent as soon as LLM_STREAM_FIRST_CHUNK_CHARS of
+    complete sentences are available. The model already answers in the
+    user's language, so the messages are sent without a translation pass.
+    Messages are sent in order by a separate task, so the stream keeps being
+    read while a Graph API call is in flight.
+
+    Returns:
+        tuple: The answer sent, and False if the stream broke off part way
+    """
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    buffer = ""
+    parts = []
+    outgoing: asyncio.Queue = asyncio.Queue()
+    queued = 0
+    complete = True
+
+    async def sender():
+        while True:
+            text = await outgoing.get()
+            if text is None:
+                return
+            # Sending is a blocking HTTP call; keep it off the event loop
+            await loop.run_in_executor(
+                None, bind(send_whatsapp_message), from_id, LocalizedText(text, language)
+            )
+            if not parts:
+                LLM_STREAM_STATS["first_message_seconds_sum"] += time.monotonic() - start
+                logger.info("First reply chunk sent to %s after %.2fs", from_id, time.monotonic() - start)
+            parts.append(text)
+            LLM_STREAM_STATS["messages_sent"] += 1
+
+    sending = asyncio.create_task(sender())
+    try:
+        try:
+            async for chunk in llm.astream(messages):
+                if sending.done():
+                    # A send failed; its error is raised below
+                    break
+                buffer += chunk.content or ""
+                min_chars = LLM_STREAM_CHUNK_CHARS if queued else LLM_STREAM_FIRST_CHUNK_CHARS
+                ready, buffer = split_ready_text(buffer, min_chars)
+                if ready:
+                    outgoing.put_nowait(ready)
+                    queued += 1
+        except Exception as e:
+            if not queued:
+                raise
+            # Part of the answer is already on its way; send what is left
+            logger.warning("LLM stream interrupted for %s: %s", from_id, e)
+            complete = False
+
+        if buffer.strip() and not sending.done():
+            outgoing.put_nowait(buffer.strip())
+        outgoing.put_nowait(None)
+        await sending
+    finally:
+        sending.cancel()
+
+    LLM_STREAM_STATS["streamed_replies"] += 1
+    LLM_STREAM_STATS["total_seconds_sum"] += time.monotonic() - start
+    return "\n\n".join(parts), complete
+
+
+def send_cached_reply(from_id: str, answer: str, language: str):
+    """Send a cached answer, split like a streamed one if it is very long"""
+    while answer:
+        part, answer = split_ready_text(answer, _MAX_MESSAGE_CHARS)
+        if not part:
+            part, answer = answer, ""
+        send_whatsapp_message(from_id, LocalizedText(part, language))
+
+
 async def process_message_with_llm(from_id: str, text: str, user_states: dict):
-    llm = ChatGroq(
-        model="llama-3.3-70b-versatile",
-        temperature=0,
-        api_key=GROQ_API_KEY,
-        groq_proxy=None,
-    )
+    llm = initialize_llm("chat")
     try:
         send_typing_indicator(from_id)
 
         # Get user's preferred language
         user_language = user_states.get(from_id, {}).get("language", "en")
 
-        # Language names for LLM context
-        language_names = {
-            "ar": "Arabic",
-            "en": "English",
-            "ur": "Urdu",
-            "hi": "Hindi",
-            "fr": "French",
-            "es": "Spanish",
-        }
-        language_name = language_names.get(user_language, "English")
+        language_name = LANGUAGE_NAMES.get(user_language, "English")
 
         # Update system message to include language preference
-        system_content = f"You are Insura, a friendly Insurance assistant created by CloudSubset. Your role is to assist with any inquiries using your vast knowledge base. Provide helpful, accurate, and user-friendly responses to all questions or requests. IMPORTANT: Respond in {language_name} ({user_language}) language. Do not mention being a large language model; you are Insura."
+        system_content = f"You are Insura, a friendly Insurance assistant created by CloudSubset. Your role is to assist with any inquiries using your vast knowledge base. Provide helpful, accurate, and user-friendly responses to all questions or requests. IMPORTANT: Write your entire response in {language_name} ({user_language}) language only; do not mix in other languages. Do not mention being a large language model; you are Insura."
 
         prompt = f"user response: {text}. Please assist."
-        messages = [SystemMessage(content=system_content), HumanMessage(content=prompt)]
 
-        loop = asyncio.get_running_loop()
-        llm_response = await loop.run_in_executor(
-            None, lambda: llm.invoke(messages).content
+        # Standalone general questions get a shared answer built without the
+        # conversation, so it can be cached and no user's context ends up in
+        # another user's answer; every other message gets the context
+        state = user_states.get(from_id, {})
+        cached = None
+        complete = True
+        general = (
+            SEMANTIC_CACHE_ENABLED
+            and is_standalone_question(text, state)
+            and semantic_cache.cacheable(text)
         )
+        if general:
+            messages = build_messages(system_content, prompt, {}, text)
+            cached = semantic_cache.get(text, user_language, LLM_PROMPT_VERSION)
+        else:
+            messages = build_messages(system_content, prompt, state, text)
+
+        if cached is not None:
+            llm_response = cached
+            send_cached_reply(from_id, llm_response, user_language)
+        elif LLM_STREAMING:
+            with span("llm_reply", streaming=True):
+                llm_response, complete = await stream_reply(
+                    llm, messages, from_id, user_language
+                )
+        else:
+            with span("llm_reply", streaming=False):
+                loop = asyncio.get_running_loop()
+                llm_response = await loop.run_in_executor(
+                    None, lambda: llm.invoke(messages).content
+                )
+                # Already generated in the user's language
+                send_whatsapp_message(from_id, LocalizedText(llm_response, user_language))
 
-        send_whatsapp_message(from_id, llm_response)
+        if general and cached is None and complete:
+            semantic_cache.set(
+                text,
+                user_language,
+                LLM_PROMPT_VERSION,
+                llm_response,
+                prompt_tokens=estimate_tokens(system_content + prompt),
+            )
 
         if from_id in user_states:
             if "conversation_history" not in user_states[from_id]:
@@ -67,10 +219,14 @@ async def process_message_with_llm(from_id: str, text: str, user_states: dict):
                 "response": llm_response,
                 "timestamp": asyncio.get_event_loop().time(),
             })
+            del user_states[from_id]["llm_responses"][:-CONVERSATION_HISTORY_MAX_TURNS]
+
+            # Fold older turns into the rolling summary off the reply path
+            asyncio.create_task(update_summary(llm, user_states[from_id]))
 
         return llm_response
     except Exception as e:
-        print(f"Error processing message with LLM: {e}")
+        logger.exception("Error processing message with LLM")
         send_whatsapp_message(
             from_id,
             "I'm sorry, I couldn't process your request at the moment. Please try again later.",
@@ -0,0 +1,162 @@
+import argparse
+import json
+import logging
+import random
+from string import Formatter
+from typing import Dict, List
+
+from config.settings import MESSAGE_TEMPLATES_PATH
+from utils.json_parsing import parse_json_object
+from .translation import LANGUAGE_NAMES, LocalizedText, translate_text
+
+logger = logging.getLogger(__name__)
+
+# Fixed bot messages with pre-generated variants per language. The English
+# text below is the source of every template; MESSAGE_TEMPLATES_PATH holds
+# the variants, written offline by `python -m services.message_templates`.
+# Sending a message picks the next variant for the user, so the wording
+# changes between visits without a model call. Placeholders ({plan_name})
+# are filled in at send time.
+
+DEFAULT_TEMPLATES = {
+    "plan_welcome": "Welcome to the {plan_name} plan! What do you need to know about the {plan_name} plan? Please let me know, I am here to help you!",
+    "plan_document": "Here's the detailed brochure for {plan_name} plan: {document_url}",
+    "plan_followup": "Is there anything else you want me to help you with related to {plan_name}?",
+    "plan_continue": "There's anything else Please ask, I am here to help you. related to {plan_name}",
+    "plan_exit": "Thank you for your interest in {plan_name}! If you have any more questions in the future, feel free to ask. Is there anything else I can help you with today?",
+    "plan_not_selected": "I'd be happy to help you with information about this topic. However, to provide you with the most accurate and specific information, could you please first tell me which plan you are asking about? This will help me give you the most relevant details for your situation.",
+}
+
+
+def placeholders(text: str) -> set:
+    return {field for _, field, _, _ in Formatter().parse(text) if field}
+
+
+def next_variant(state: Dict, key: str, variants: List[str]) -> str:
+    """
+    Rotate through variants per user, starting at a random one
+
+    The position is kept in state["variant_turns"], so a user who comes back
+    to the same message gets the next wording.
+    """
+    turns = state.setdefault("variant_turns", {})
+    index = turns.get(key, random.randrange(len(variants)))
+    turns[key] = index + 1
+    return variants[index % len(variants)]
+
+
+def load_variants(path: str = MESSAGE_TEMPLATES_PATH) -> Dict[str, Dict[str, List[str]]]:
+    """{template name: {language: [variants]}}"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["templates"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Could not load message templates from %s: %s", path, e)
+        return {}
+
+
+class MessageTemplates:
+    def __init__(self, path: str = MESSAGE_TEMPLATES_PATH):
+        self.variants = load_variants(path)
+        # Runtime translations for languages without variants:
+        # {(name, language, english text): translated text}
+        self._translated: Dict[tuple, str] = {}
+
+    async def render(self, name: str, state: Dict, **fields) -> str:
+        """
+        The next variant of a template in the user's language
+
+        Languages without pre-generated variants get an English variant
+        translated once and remembered. The result is marked as localized so
+        the send path does not translate it again.
+        """
+        language = state.get("language", "en")
+        variants = self.variants.get(name, {}).get(language)
+        if variants:
+            try:
+                return LocalizedText(next_variant(state, name, variants).format(**fields), language)
+            except (KeyError, IndexError, ValueError) as e:
+                logger.warning("Broken %s variant of template %s: %s", language, name, e)
+
+        english = self.variants.get(name, {}).get("en") or [DEFAULT_TEMPLATES[name]]
+        try:
+            text = next_variant(state, name, english).format(**fields)
+        except (KeyError, IndexError, ValueError):
+            text = DEFAULT_TEMPLATES[name].format(**fields)
+        if language == "en":
+            return LocalizedText(text, language)
+
+        key = (name, language, text)
+        if key not in self._translated:
+            translated = await translate_text(text, language, "en")
+            if translated == text:
+                # Translation failed; let the send path try again
+                return text
+            self._translated[key] = translated
+        return LocalizedText(self._translated[key], language)
+
+
+# Global instance
+message_templates = MessageTemplates()
+
+
+GENERATE_PROMPT = """Rewrite this message from Insura, a friendly insurance assistant on WhatsApp, so it sounds natural and warm. Keep the same meaning and length.
+Write {count} different versions, all in {language_name}.
+Copy the placeholders in curly braces ({fields}) exactly as they are, untranslated; do not add other curly braces.
+
+Message: '{text}'
+
+Respond with only a JSON object like {{"variants": ["first version", "second version"]}}"""
+
+
+def generate_variants(names: List[str], languages: List[str], count: int, pool: Dict) -> Dict:
+    """Ask the LLM for `count` variants of each template in each language (offline)"""
+    from .llm import initialize_llm
+
+    llm = initialize_llm("generation")
+    for name in names:
+        text = DEFAULT_TEMPLATES[name]
+        fields = placeholders(text)
+        for language in languages:
+            prompt = GENERATE_PROMPT.format(
+                count=count,
+                language_name=LANGUAGE_NAMES.get(language, language),
+                fields=", ".join("{%s}" % field for field in sorted(fields)) or "none",
+                text=text,
+            )
+            result = parse_json_object(llm.invoke(prompt).content) or {}
+            variants = []
+            for variant in result.get("variants", []):
+                if not isinstance(variant, str) or not variant.strip():
+                    continue
+                try:
+                    ok = placeholders(variant) == fields
+                except ValueError:
+                    ok = False
+                if ok:
+                    variants.append(variant.strip())
+            if not variants:
+                print(f"No usable variants for {name} ({language}); keeping the old ones")
+                continue
+            pool.setdefault(name, {})[language] = variants[:count]
+            print(f"{name} ({language}): {len(variants[:count])} variants")
+    return pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate the message template variants")
+    parser.add_argument("--templates", nargs="+", choices=sorted(DEFAULT_TEMPLATES), default=sorted(DEFAULT_TEMPLATES))
+    parser.add_argument("--languages", nargs="+", default=sorted(LANGUAGE_NAMES))
+    parser.add_argument("--variants", type=int, default=3)
+    parser.add_argument("--output", default=MESSAGE_TEMPLATES_PATH)
+    args = parser.parse_args()
+
+    pool = generate_variants(args.templates, args.languages, args.variants, load_variants(args.output))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "templates": pool}, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config.settings import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_CLAIM_TIMEOUT,
+    OUTBOX_DB_PATH,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL,
+)
+from utils.tracing import start_trace, user_hash
+from .partner_api import CircuitOpenError, PartnerAPIError, post_partner
+
+logger = logging.getLogger(__name__)
+
+# Durable outbox for partner submissions (quote requests). The chat turn only
+# writes a row and acknowledges the user; the dispatcher delivers it with
+# retries and hands the partner's response to the endpoint's handler, which
+# sends the follow-up message. Rows survive restarts, so a lead is never lost
+# to a partner outage. Due rows are claimed ('sending') in the same
+# transaction that reads them, so a row is never posted twice at once; a
+# claim that is never settled is released after OUTBOX_CLAIM_TIMEOUT.
+
+DeliveredHandler = Callable[[str, dict, dict], Awaitable[None]]
+FailedHandler = Callable[[str, str, dict], Awaitable[None]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    endpoint TEXT NOT NULL,
+    from_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    claimed_at REAL,
+    response TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+class Outbox:
+    def __init__(self, db_path: str = OUTBOX_DB_PATH):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "claimed_at" not in columns:
+            # Databases created before rows were claimed
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN claimed_at REAL")
+        self._lock = threading.Lock()
+
+    def enqueue(self, endpoint: str, from_id: str, payload: dict) -> int:
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (endpoint, from_id, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (endpoint, from_id, json.dumps(payload), now, now),
+            )
+        return cursor.lastrowid
+
+    def due(self, limit: int = OUTBOX_BATCH_SIZE) -> List[sqlite3.Row]:
+        """Claim up to `limit` rows due for delivery"""
+        now = time.time()
+        with self._lock, self._conn:
+            # Claims left behind by a crash or a lost delivery task
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at <= ?",
+                (now - OUTBOX_CLAIM_TIMEOUT,),
+            )
+            rows = self._conn.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+        return rows
+
+    def mark_delivered(self, row_id: int, response):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'delivered', delivered_at = ?, response = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (time.time(), json.dumps(response), row_id),
+            )
+
+    def reschedule(self, row_id: int, delay: float, error: str, count_attempt: bool = True):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ?, "
+                "attempts = attempts + ? WHERE id = ?",
+                (time.time() + delay, error, 1 if count_attempt else 0, row_id),
+            )
+
+    def mark_failed(self, row_id: int, error: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'failed', last_error = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (error, row_id),
+            )
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Delivery state of recent rows; payloads and responses hold personal data and are left out"""
+        query = (
+            "SELECT id, endpoint, status, attempts, created_at, delivered_at, last_error FROM outbox"
+        )
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params).fetchall()]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of entries per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def close(self):
+        self._conn.close()
+
+
+def _retry_delay(attempts: int) -> float:
+    """Exponential backoff from 10 s, capped at 10 minutes, with jitter"""
+    return min(10 * 2 ** attempts, 600) * random.uniform(0.75, 1.25)
+
+
+class OutboxDispatcher:
+    def __init__(self, outbox: Outbox, user_states: dict):
+        self.outbox = outbox
+        self.user_states = user_states
+        self._handlers = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def register(self, endpoint: str, on_delivered: DeliveredHandler, on_failed: FailedHandler):
+        self._handlers[endpoint] = (on_delivered, on_failed)
+
+    async def submit(self, endpoint: str, from_id: str, payload: dict) -> int:
+        """Persist a submission and wake the dispatcher; returns the outbox row id"""
+        loop = asyncio.get_running_loop()
+        row_id = await loop.run_in_executor(
+            None, self.outbox.enqueue, endpoint, from_id, payload
+        )
+        self._wakeup.set()
+        return row_id
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            full_batch = False
+            try:
+                rows = await loop.run_in_executor(None, self.outbox.due)
+                results = await asyncio.gather(
+                    *[self._deliver(row) for row in rows], return_exceptions=True
+                )
+                for row, result in zip(rows, results):
+                    if isinstance(result, Exception):
+                        # The row stays claimed until OUTBOX_CLAIM_TIMEOUT
+                        logger.error(
+                            "Outbox %s #%s delivery error: %s",
+                            row["endpoint"], row["id"], result, exc_info=result,
+                        )
+                # More rows may already be due; otherwise wait for the next one
+                full_batch = len(rows) == OUTBOX_BATCH_SIZE
+            except Exception as e:
+                logger.error("Outbox dispatcher error: %s", e)
+            if full_batch:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _deliver(self, row: sqlite3.Row):
+        # Deliveries run outside the chat turn, so each one is its own trace
+        with start_trace(
+            "outbox_delivery",
+            endpoint=row["endpoint"],
+            user=user_hash(row["from_id"]),
+            attempt=row["attempts"] + 1,
+        ):
+            await self._deliver_row(row)
+
+    async def _deliver_row(self, row: sqlite3.Row):
+        loop = asyncio.get_running_loop()
+        row_id, endpoint, from_id = row["id"], row["endpoint"], row["from_id"]
+        on_delivered, on_failed = self._handlers[endpoint]
+        try:
+            # The outbox does its own backoff; a single attempt per pass
+            response = await post_partner(endpoint, json.loads(row["payload"]), retries=1)
+        except CircuitOpenError as e:
+            # The partner is known to be down: wait, but don't burn an attempt
+            await loop.run_in_executor(
+                None, self.outbox.reschedule, row_id, _retry_delay(0), str(e), False
+            )
+            return
+        except PartnerAPIError as e:
+            # A submission that may have reached the partner is not resent
+            if not e.retryable or row["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                await loop.run_in_executor(None, self.outbox.mark_failed, row_id, str(e))
+                logger.error("Outbox %s #%s for %s failed: %s", endpoint, row_id, from_id, e)
+                await on_failed(from_id, str(e), self.user_states)
+            else:
+                await loop.run_in_executor(
+                    None, self.outbox.reschedule, row_id, _retry_delay(row["attempts"]), str(e)
+                )
+            return
+
+        await loop.run_in_executor(None, self.outbox.mark_delivered, row_id, response)
+        logger.info("Outbox %s #%s delivered after %s attempt(s)", endpoint, row_id, row['attempts'] + 1)
+        try:
+            await on_delivered(from_id, response, self.user_states)
+        except Exception as e:
+            logger.error("Outbox follow-up for %s #%s failed: %s", endpoint, row_id, e)
+
+
+# Global instance, created at startup with the application's user_states
+dispatcher: Optional[OutboxDispatcher] = None
+
+
+def start_dispatcher(user_states: dict) -> OutboxDispatcher:
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = OutboxDispatcher(Outbox(), user_states)
+    dispatcher.start()
+    return dispatcher
+
+
+async def submit(endpoint: str, from_id: str, payload: dict) -> int:
+    if dispatcher is None:
+        raise RuntimeError("Outbox dispatcher is not running")
+    return await dispatcher.submit(endpoint, from_id, payload)
+
+
+async def stop_dispatcher():
+    if dispatcher is not None:
+        await dispatcher.stop()
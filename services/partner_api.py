@@ -0,0 +1,317 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from urllib.parse import urlparse
+
+import httpx
+import orjson
+
+from config.settings import (
+    PARTNER_API_GZIP,
+    PARTNER_API_MAX_CONNECTIONS,
+    PARTNER_API_RETRIES,
+    PARTNER_API_TIMEOUTS,
+    PARTNER_CIRCUIT_FAILURES,
+    PARTNER_CIRCUIT_RESET,
+    PARTNER_IDEMPOTENT_ENDPOINTS,
+    PARTNER_UPLOAD_CHUNK_BYTES,
+    PARTNER_UPLOAD_PROGRESS_MIN_BYTES,
+)
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Client for the insurancelab/insuranceclub APIs. All calls share one
+# connection pool; each host has its own circuit breaker so a slow partner
+# fails fast instead of holding every user on the final step.
+PARTNER_ENDPOINTS = {
+    "emaf": "https://www.insuranceclub.ae/Api/emaf",
+    "medical_insert": "https://insurancelab.ae/Api/medical_insert",
+    "sme_add": "https://insurancelab.ae/Api/sme_add/",
+}
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+# Per-endpoint call statistics; latency is recorded for every attempt
+PARTNER_API_STATS = {
+    name: {
+        "requests": 0,
+        "errors": 0,
+        "retries": 0,
+        "rejected": 0,
+        "latency_sum": 0.0,
+        "latency_buckets": {bound: 0 for bound in LATENCY_BUCKETS},
+    }
+    for name in PARTNER_ENDPOINTS
+}
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class PartnerAPIError(Exception):
+    """
+    A partner API call failed after all retries
+
+    `retryable` is True when sending the request again cannot create a
+    duplicate submission.
+    """
+
+    def __init__(self, message: str, status_code: int = None, body: str = None, retryable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+        self.retryable = retryable
+
+
+class CircuitOpenError(PartnerAPIError):
+    """The partner host failed repeatedly; the call was not attempted"""
+
+    def __init__(self, message: str):
+        super().__init__(message, retryable=True)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After `failure_threshold` failures in a row the circuit opens and calls
+    are rejected for `reset_timeout` seconds. Then a single trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+
+_breakers = {
+    host: CircuitBreaker(PARTNER_CIRCUIT_FAILURES, PARTNER_CIRCUIT_RESET)
+    for host in {urlparse(url).netloc for url in PARTNER_ENDPOINTS.values()}
+}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            limits=httpx.Limits(
+                max_connections=PARTNER_API_MAX_CONNECTIONS,
+                max_keepalive_connections=PARTNER_API_MAX_CONNECTIONS // 2,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _record_latency(endpoint: str, elapsed: float):
+    stats = PARTNER_API_STATS[endpoint]
+    stats["latency_sum"] += elapsed
+    for bound in LATENCY_BUCKETS:
+        if elapsed <= bound:
+            stats["latency_buckets"][bound] += 1
+            break
+
+
+def _encode_body(payload: dict):
+    """Serialize once; the same bytes are resent on every retry"""
+    body = orjson.dumps(payload)
+    headers = {
+        # Lets the partner de-duplicate a resent submission, should it support it
+        "Idempotency-Key": hashlib.sha256(body).hexdigest(),
+    }
+    if PARTNER_API_GZIP:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    headers["Content-Length"] = str(len(body))
+    return body, headers
+
+
+async def _body_stream(body: bytes, progress: Optional[ProgressCallback]) -> AsyncIterator[bytes]:
+    """Yield the body in slices, reporting each new quarter sent"""
+    reported = 0
+    for start in range(0, len(body), PARTNER_UPLOAD_CHUNK_BYTES):
+        chunk = body[start : start + PARTNER_UPLOAD_CHUNK_BYTES]
+        yield chunk
+        if progress is not None:
+            percent = (start + len(chunk)) * 100 // len(body)
+            quarter = percent // 25 * 25
+            if quarter > reported:
+                reported = quarter
+                await progress(quarter)
+
+
+# Raised before the request could reach the partner
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _is_partner_failure(exc: Exception) -> bool:
+    """Transport errors, 5xx and 429; a 4xx says nothing about the partner's health"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, httpx.TransportError)
+
+
+def _can_resend(endpoint: str, exc: Exception) -> bool:
+    """Whether sending the request again cannot create a duplicate submission"""
+    if isinstance(exc, _NOT_SENT_ERRORS):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
+        return True
+    return endpoint in PARTNER_IDEMPOTENT_ENDPOINTS and _is_partner_failure(exc)
+
+
+async def post_partner(
+    endpoint: str,
+    payload: dict,
+    retries: int = PARTNER_API_RETRIES,
+    progress: Optional[ProgressCallback] = None,
+):
+    """
+    POST a JSON payload to a partner endpoint without blocking the event loop
+
+    Large bodies are streamed in PARTNER_UPLOAD_CHUNK_BYTES slices with an
+    explicit Content-Length, so the endpoint still receives one ordinary JSON
+    request. Failures are retried with exponential backoff and jitter when
+    resending cannot duplicate a submission: connection errors and 429 for
+    every endpoint, read timeouts and 5xx only for PARTNER_IDEMPOTENT_ENDPOINTS.
+
+    Args:
+        endpoint (str): Key of PARTNER_ENDPOINTS
+        progress: Awaited with 25, 50, 75 and 100 as the body is sent; only
+            used for bodies of at least PARTNER_UPLOAD_PROGRESS_MIN_BYTES
+
+    Returns:
+        The decoded JSON response
+
+    Raises:
+        CircuitOpenError: The host's circuit is open; nothing was sent
+        PartnerAPIError: When every attempt failed or the response is not JSON
+    """
+    url = PARTNER_ENDPOINTS[endpoint]
+    breaker = _breakers[urlparse(url).netloc]
+    stats = PARTNER_API_STATS[endpoint]
+    timeout = PARTNER_API_TIMEOUTS[endpoint]
+
+    body, headers = _encode_body(payload)
+    if len(body) < PARTNER_UPLOAD_PROGRESS_MIN_BYTES:
+        progress = None
+    # Allow slow uplinks for big census files: one extra second per 100 KB
+    request_timeout = httpx.Timeout(
+        timeout, connect=min(timeout, 10.0), write=timeout + len(body) / 100_000
+    )
+
+    last_error = None
+    for attempt in range(1, retries + 1):
+        if not breaker.allow():
+            stats["rejected"] += 1
+            raise CircuitOpenError(f"Circuit open for {url}") from last_error
+
+        stats["requests"] += 1
+        start = time.monotonic()
+        try:
+            with span("partner_api", endpoint=endpoint, attempt=attempt, bytes=len(body)):
+                response = await get_client().post(
+                    url,
+                    content=_body_stream(body, progress) if progress else body,
+                    headers=headers,
+                    timeout=request_timeout,
+                )
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            _record_latency(endpoint, time.monotonic() - start)
+            stats["errors"] += 1
+            last_error = e
+            if not _is_partner_failure(e):
+                breaker.record_success()
+                break
+            breaker.record_failure()
+            if attempt == retries or not _can_resend(endpoint, e):
+                break
+            stats["retries"] += 1
+            # Progress is only reported for the first attempt
+            progress = None
+            delay = min(2 ** attempt, 10) * random.uniform(0.5, 1.0)
+            logger.warning("POST %s failed (%s), retry %s in %.1fs", url, e, attempt, delay)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled, or the body stream or progress callback failed. Count
+            # it, so a half-open trial never stays claimed
+            _record_latency(endpoint, time.monotonic() - start)
+            stats["errors"] += 1
+            breaker.record_failure()
+            raise
+
+        _record_latency(endpoint, time.monotonic() - start)
+        breaker.record_success()
+        try:
+            return response.json()
+        except ValueError as e:
+            stats["errors"] += 1
+            raise PartnerAPIError(
+                f"Invalid JSON from {url}", response.status_code, response.text
+            ) from e
+
+    response = getattr(last_error, "response", None)
+    raise PartnerAPIError(
+        f"POST {url} failed: {last_error}",
+        response.status_code if response is not None else None,
+        response.text if response is not None else None,
+        retryable=_is_partner_failure(last_error) and _can_resend(endpoint, last_error),
+    ) from last_error
+
+
+def circuit_states() -> dict:
+    return {host: breaker.state for host, breaker in _breakers.items()}
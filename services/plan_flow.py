@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from .whatsapp import send_whatsapp_message_translated, send_yes_no_options_translated
+from .llm import initialize_llm
+from .message_templates import DEFAULT_TEMPLATES, message_templates, next_variant
+from .plan_kb import plan_kb
+from .translation import LANGUAGE_NAMES, LocalizedText, translate_text
+from config.settings import BROCHURE_LLM_PHRASING, BROCHURE_MIN_SCORE
+from utils.helpers import store_interaction
+from utils.json_parsing import parse_json_object
+from utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# One conversation flow for every plan in the knowledge base (plan_kb). The
+# session remembers the plan being discussed in "active_plan"; answers,
+# rewrites, brochure and document link all come from that plan's file.
+
+BROCHURE_ANSWER_PROMPT = """You are Insura, a friendly insurance assistant. Answer the customer's question using only these rows from the {title} table of benefits:
+{rows}
+
+Question: "{question}"
+
+Reply in 1-3 friendly lines in {language_name}, keeping amounts and conditions exactly as written. If the rows do not answer the question, reply with only NONE."""
+
+
+class PlanFlow:
+    def __init__(self):
+        self.llm = initialize_llm("brochure")
+        # Translations of rewrites made at runtime: {(plan, key): {language: [variants]}}
+        self._translated: Dict[tuple, Dict[str, List[str]]] = {}
+
+    @traced()
+    def detect_plan(self, text: str) -> Optional[str]:
+        """Id of the plan the message asks about (typo-tolerant triggers)"""
+        return plan_kb.find_plan(text)
+
+    def _plan_name(self, user_states: Dict, from_id: str) -> str:
+        plan = plan_kb.get(user_states[from_id].get("active_plan"))
+        return plan["name"] if plan else "this plan"
+
+    async def start_plan_flow(self, from_id: str, plan_id: str, user_states: Dict):
+        """Start the Q&A conversation about a plan"""
+        plan = plan_kb.get(plan_id)
+        user_states[from_id]["stage"] = "plan_qa"
+        user_states[from_id]["active_plan"] = plan_id
+        user_states[from_id]["last_plan_query_time"] = datetime.now()
+        user_states[from_id]["awaiting_plan_followup"] = True
+        user_states[from_id]["plan_qa_count"] = 0
+
+        welcome = plan.get("welcome", {})
+        if welcome.get("text"):
+            welcome_message = await self.pooled_answer(
+                plan_id,
+                "welcome",
+                welcome["text"],
+                welcome.get("rewrites", {}),
+                from_id,
+                user_states,
+            )
+        else:
+            welcome_message = await message_templates.render(
+                "plan_welcome", user_states[from_id], plan_name=plan["name"]
+            )
+        await send_whatsapp_message_translated(from_id, welcome_message, user_states)
+        store_interaction(
+            from_id, f"{plan['name']} Welcome", welcome_message, user_states
+        )
+
+    async def pooled_answer(
+        self,
+        plan_id: str,
+        key: str,
+        base_answer: str,
+        rewrites: Dict[str, List[str]],
+        from_id: str,
+        user_states: Dict,
+    ) -> str:
+        """
+        Next precomputed rewrite of an answer in the user's language
+
+        Variants rotate per user so repeated questions do not get the same
+        wording. When the plan has no variants in the user's language, an
+        English variant is translated once and kept for later users.
+        """
+        language = user_states[from_id].get("language", "en")
+        translated = self._translated.setdefault((plan_id, key), {})
+        variants = rewrites.get(language) or translated.get(language)
+        if not variants:
+            english = rewrites.get("en") or [base_answer]
+            if language == "en":
+                variants = english
+            else:
+                text = await translate_text(english[0], language, "en")
+                if text == english[0]:
+                    # Translation failed; let the send path try again
+                    return english[0]
+                variants = translated[language] = [text]
+
+        variant = next_variant(user_states[from_id], f"{plan_id}:{key}", variants)
+        return LocalizedText(variant, language)
+
+    async def answer_from_brochure(
+        self, plan_id: str, question: str, language: str
+    ) -> Optional[str]:
+        """
+        Answer from the plan's indexed brochure, citing the page
+
+        The matching table rows are found locally; the LLM only turns them
+        into a short reply. Returns None when the brochure has no answer.
+        """
+        brochure = plan_kb.brochures.get(plan_id)
+        if brochure is None:
+            return None
+        hits = [
+            hit for hit in brochure.search(question, top_k=2)
+            if hit["score"] >= BROCHURE_MIN_SCORE
+        ]
+        if not hits:
+            return None
+        citation = f"📄 {brochure.citation(hits[0])}"
+
+        if not BROCHURE_LLM_PHRASING:
+            return f"{hits[0]['text']}\n\n{citation}"
+
+        try:
+            rows = "\n".join(f"- {hit['text']}" for hit in hits)
+            prompt = BROCHURE_ANSWER_PROMPT.format(
+                title=brochure.title,
+                rows=rows,
+                question=question,
+                language_name=LANGUAGE_NAMES.get(language, "English"),
+            )
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, self.llm.invoke, prompt)
+            answer = response.content.strip()
+        except Exception as e:
+            logger.error("Error phrasing brochure answer: %s", e)
+            return f"{hits[0]['text']}\n\n{citation}"
+
+        if not answer or answer.upper().startswith("NONE"):
+            return None
+        return LocalizedText(f"{answer}\n\n{citation}", language)
+
+    async def process_plan_question(
+        self, from_id: str, text: str, user_states: Dict
+    ) -> bool:
+        """Answer a question about the active plan; False when it is not one"""
+        plan_id = user_states[from_id].get("active_plan")
+        plan = plan_kb.get(plan_id)
+        if plan is None:
+            # No plan chosen yet, or it was removed from the knowledge base
+            general_response = await message_templates.render(
+                "plan_not_selected", user_states[from_id]
+            )
+            await send_whatsapp_message_translated(from_id, general_response, user_states)
+            store_interaction(
+                from_id, "Plan General Response", general_response, user_states
+            )
+            return True
+
+        benefit_key = plan_kb.find_benefit(plan_id, text)
+        if benefit_key:
+            benefit = plan["benefits"][benefit_key]
+            # Friendly wording from the plan's precomputed rewrites
+            answer = await self.pooled_answer(
+                plan_id,
+                benefit_key,
+                benefit["answer"],
+                benefit.get("rewrites", {}),
+                from_id,
+                user_states,
+            )
+        elif user_states[from_id].get("stage", "").startswith("plan_"):
+            # Only inside the plan conversation, so answers to other flows'
+            # questions are never taken for brochure queries
+            answer = await self.answer_from_brochure(
+                plan_id, text, user_states[from_id].get("language", "en")
+            )
+        else:
+            answer = None
+
+        if answer:
+            user_states[from_id]["plan_qa_count"] = user_states[from_id].get("plan_qa_count", 0) + 1
+            user_states[from_id]["awaiting_plan_followup"] = True
+
+            await send_whatsapp_message_translated(from_id, answer, user_states)
+            store_interaction(
+                from_id,
+                f"{plan['name']} QA #{user_states[from_id]['plan_qa_count']}",
+                answer,
+                user_states,
+            )
+
+            # After answering, send document
+            await asyncio.sleep(2)
+            await self.send_plan_document(from_id, user_states)
+
+            return True
+
+        return False
+
+    async def send_plan_document(self, from_id: str, user_states: Dict):
+        """Send the plan's brochure link, then ask the follow-up question"""
+        plan = plan_kb.get(user_states[from_id].get("active_plan"))
+        if plan and plan.get("document_url"):
+            document_message = await message_templates.render(
+                "plan_document",
+                user_states[from_id],
+                plan_name=plan["name"],
+                document_url=plan["document_url"],
+            )
+            await send_whatsapp_message_translated(from_id, document_message, user_states)
+            store_interaction(
+                from_id, "Plan Document Sent", document_message, user_states
+            )
+
+            # After document, ask follow-up question
+            await asyncio.sleep(2)
+        await self.ask_followup_question(from_id, user_states)
+
+    async def ask_followup_question(self, from_id: str, user_states: Dict):
+        """Ask follow-up question with Yes/No options"""
+        followup_message = await message_templates.render(
+            "plan_followup",
+            user_states[from_id],
+            plan_name=self._plan_name(user_states, from_id),
+        )
+        await send_yes_no_options_translated(from_id, followup_message, user_states)
+        store_interaction(
+            from_id, "Plan Follow-up Question", followup_message, user_states
+        )
+
+        user_states[from_id]["stage"] = "plan_followup"
+
+    async def handle_followup_response(
+        self,
+        from_id: str,
+        text: str,
+        user_states: Dict,
+        interactive_response: Optional[Dict] = None,
+    ):
+        """Handle user response to follow-up question with Yes/No options"""
+        # Check for interactive response first (button click)
+        selected_option = (
+            interactive_response.get("title") if interactive_response else None
+        )
+
+        if selected_option == "Yes":
+            # User clicked Yes - continue in the plan flow
+            await self.continue_plan_conversation(from_id, user_states)
+        elif selected_option == "No":
+            # User clicked No - exit to original flow
+            await self.exit_plan_conversation(from_id, user_states)
+        else:
+            # Fallback to text-based detection
+            continue_keywords = [
+                "yes",
+                "yeah",
+                "yep",
+                "sure",
+                "ok",
+                "okay",
+                "more",
+                "continue",
+                "another",
+            ]
+            exit_keywords = [
+                "no",
+                "nope",
+                "nah",
+                "done",
+                "finished",
+                "that's all",
+                "nothing else",
+            ]
+
+            text_lower = text.lower()
+
+            if any(keyword in text_lower for keyword in continue_keywords):
+                # User wants to continue
+                await self.continue_plan_conversation(from_id, user_states)
+            elif any(keyword in text_lower for keyword in exit_keywords):
+                # User wants to exit
+                await self.exit_plan_conversation(from_id, user_states)
+            else:
+                # Try to process as another question
+                if not await self.process_plan_question(from_id, text, user_states):
+                    # If not a plan question, use LLM
+                    from .llm import process_message_with_llm
+
+                    await process_message_with_llm(
+                        from_id=from_id, text=text, user_states=user_states
+                    )
+                    await asyncio.sleep(1)
+                    await self.ask_followup_question(from_id, user_states)
+
+    async def continue_plan_conversation(self, from_id: str, user_states: Dict):
+        """Continue the plan conversation"""
+        continue_message = await message_templates.render(
+            "plan_continue",
+            user_states[from_id],
+            plan_name=self._plan_name(user_states, from_id),
+        )
+        await send_whatsapp_message_translated(from_id, continue_message, user_states)
+        store_interaction(
+            from_id, "Plan Continue Message", continue_message, user_states
+        )
+
+        user_states[from_id]["stage"] = "plan_qa"
+
+    async def exit_plan_conversation(self, from_id: str, user_states: Dict):
+        """Exit the plan conversation and return to main flow"""
+        exit_message = await message_templates.render(
+            "plan_exit",
+            user_states[from_id],
+            plan_name=self._plan_name(user_states, from_id),
+        )
+        await send_whatsapp_message_translated(from_id, exit_message, user_states)
+        store_interaction(from_id, "Plan Exit Message", exit_message, user_states)
+
+        # Reset to main flow - clear plan flags and return to initial question stage
+        user_states[from_id]["stage"] = "initial_question"
+        user_states[from_id]["plan_qa_count"] = 0
+        user_states[from_id]["active_plan"] = None
+        user_states[from_id]["awaiting_plan_followup"] = False
+
+        # Send the main menu options
+        from .whatsapp import send_interactive_options
+        from config.settings import INITIAL_QUESTIONS
+
+        await asyncio.sleep(1)
+        greeting_text = f"Great! {INITIAL_QUESTIONS[0]['question']}"
+        send_interactive_options(
+            from_id, greeting_text, INITIAL_QUESTIONS[0]["options"], user_states
+        )
+
+
+# Global instance
+plan_flow = PlanFlow()
+
+
+REWRITE_PROMPT = """Rewrite this exact information about {topic} in a friendly, conversational way as if a real insurance agent is speaking to a customer. Keep the same content but make it sound natural and warm. Use only 1-3 lines maximum.
+Write {count} different versions, all in {language_name}.
+
+This is the content (answer): '{answer}'
+
+Respond with only a JSON object like {{"variants": ["first version", "second version"]}}"""
+
+
+def generate_rewrites(plan: Dict, languages: List[str], count: int) -> Dict:
+    """Ask the LLM for `count` rewrites of the plan's answers in every language (offline)"""
+    llm = initialize_llm("generation")
+    welcome = plan.setdefault("welcome", {})
+    welcome.setdefault("text", DEFAULT_TEMPLATES["plan_welcome"].format(plan_name=plan["name"]))
+    entries = {"welcome": ("the welcome to the plan", welcome)}
+    for key, benefit in plan["benefits"].items():
+        entries[key] = (f"{key.replace('_', ' ')} in the {plan['name']} plan", benefit)
+
+    for key, (topic, entry) in entries.items():
+        for language in languages:
+            prompt = REWRITE_PROMPT.format(
+                topic=topic,
+                count=count,
+                language_name=LANGUAGE_NAMES.get(language, language),
+                answer=entry.get("answer") or entry.get("text"),
+            )
+            result = parse_json_object(llm.invoke(prompt).content) or {}
+            variants = [v.strip() for v in result.get("variants", []) if isinstance(v, str) and v.strip()]
+            if not variants:
+                print(f"No rewrites generated for {key} ({language}); keeping the old ones")
+                continue
+            entry.setdefault("rewrites", {})[language] = variants[:count]
+            print(f"{key} ({language}): {len(variants[:count])} variants")
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Regenerate the answer rewrites of a plan in the knowledge base"
+    )
+    parser.add_argument("--plan", required=True, choices=sorted(plan_kb.plans))
+    parser.add_argument("--languages", nargs="+", default=sorted(LANGUAGE_NAMES))
+    parser.add_argument("--variants", type=int, default=3)
+    args = parser.parse_args()
+
+    path = plan_kb.paths[args.plan]
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    generate_rewrites(plan, args.languages, args.variants)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from difflib import get_close_matches
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import PLAN_KB_DIR, PLAN_KB_RELOAD_INTERVAL
+from utils.brochure_index import BrochureIndex, load_index
+from utils.qa_index import QAIndex, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Plan-benefits knowledge base. Each JSON file in PLAN_KB_DIR describes one
+# plan:
+#
+#   {
+#     "id": "takaful_emarat_silver",
+#     "name": "Takaful Emarat Silver",
+#     "company": "Takaful Emarat",            # optional
+#     "triggers": ["takaful emarat silver", ...],
+#     "document_url": "https://...",          # optional
+#     "brochure_index": "documents/index/...", # optional, utils/brochure_index.py
+#     "welcome": {"text": "...", "rewrites": {"en": [...], "ar": [...]}},
+#     "benefits": {
+#       "<key>": {"synonyms": [...], "answer": "...", "rewrites": {...}}
+#     }
+#   }
+#
+# Trigger phrases of all plans go into one dict keyed by token tuple, so
+# finding the plan a message is about is a handful of hash lookups however
+# many plans there are. Files are re-read when they change.
+
+
+class PlanKBError(ValueError):
+    """A plan file does not follow the schema"""
+
+
+def _validate(plan: Dict, path: str):
+    for field in ("id", "name", "triggers", "benefits"):
+        if field not in plan:
+            raise PlanKBError(f"{path}: missing '{field}'")
+    for key, benefit in plan["benefits"].items():
+        if "answer" not in benefit or not benefit.get("synonyms"):
+            raise PlanKBError(f"{path}: benefit '{key}' needs 'answer' and 'synonyms'")
+
+
+class PlanKB:
+    def __init__(self, directory: str = PLAN_KB_DIR, reload_interval: float = PLAN_KB_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.plans: Dict[str, Dict] = {}
+        self.paths: Dict[str, str] = {}
+        self.benefit_indexes: Dict[str, QAIndex] = {}
+        self.brochures: Dict[str, Optional[BrochureIndex]] = {}
+        self._triggers: Dict[Tuple[str, ...], str] = {}
+        self._trigger_vocabulary: List[str] = []
+        self._trigger_words = frozenset()
+        self._max_trigger_tokens = 0
+        self._mtimes: Dict[str, float] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            logger.error("Could not load the plan knowledge base: %s", e)
+
+    def _file_mtimes(self) -> Dict[str, float]:
+        return {
+            path: os.path.getmtime(path)
+            for path in glob.glob(os.path.join(self.directory, "*.json"))
+        }
+
+    def reload(self) -> int:
+        """
+        Re-read every plan file and rebuild the indexes
+
+        The new indexes are swapped in only when all files load, so a broken
+        edit leaves the previous knowledge base in service.
+
+        Returns:
+            int: Number of plans loaded
+        """
+        with self._lock:
+            mtimes = self._file_mtimes()
+            plans, paths = {}, {}
+            for path in sorted(mtimes):
+                with open(path, encoding="utf-8") as f:
+                    plan = json.load(f)
+                _validate(plan, path)
+                if plan["id"] in plans:
+                    raise PlanKBError(f"{path}: duplicate plan id '{plan['id']}'")
+                plans[plan["id"]] = plan
+                paths[plan["id"]] = path
+
+            triggers = {}
+            for plan_id, plan in plans.items():
+                for phrase in plan["triggers"]:
+                    tokens = tuple(tokenize(phrase))
+                    if tokens in triggers and triggers[tokens] != plan_id:
+                        logger.warning(
+                            "Trigger '%s' is claimed by %s and %s", phrase, triggers[tokens], plan_id
+                        )
+                    triggers.setdefault(tokens, plan_id)
+
+            brochures = {
+                plan_id: load_index(plan["brochure_index"])
+                for plan_id, plan in plans.items()
+                if plan.get("brochure_index")
+            }
+
+            self.plans = plans
+            self.paths = paths
+            self.benefit_indexes = {
+                plan_id: QAIndex(
+                    {key: benefit["synonyms"] for key, benefit in plan["benefits"].items()}
+                )
+                for plan_id, plan in plans.items()
+            }
+            self.brochures = brochures
+            self._triggers = triggers
+            self._trigger_vocabulary = sorted({t for tokens in triggers for t in tokens})
+            self._trigger_words = frozenset(self._trigger_vocabulary)
+            self._max_trigger_tokens = max((len(tokens) for tokens in triggers), default=0)
+            self._mtimes = mtimes
+            self._checked_at = time.monotonic()
+        logger.info("Loaded %d plan(s) from %s", len(plans), self.directory)
+        return len(plans)
+
+    def maybe_reload(self):
+        """Reload when a plan file was added, removed or edited (rate-limited)"""
+        if time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        if self._file_mtimes() != self._mtimes:
+            try:
+                self.reload()
+            except (OSError, ValueError) as e:
+                logger.error("Plan knowledge base reload failed, keeping previous: %s", e)
+
+    def _canonical(self, token: str) -> str:
+        """Map a misspelled word to the trigger vocabulary ("takafull")"""
+        if len(token) < 4 or token in self._trigger_words:
+            return token
+        match = get_close_matches(token, self._trigger_vocabulary, n=1, cutoff=0.8)
+        return match[0] if match else token
+
+    def find_plan(self, text: str) -> Optional[str]:
+        """Id of the plan the message mentions by one of its triggers, or None"""
+        self.maybe_reload()
+        tokens = [self._canonical(token) for token in tokenize(text)]
+        # Longest phrase first, so "takaful emarat silver" beats "takaful emarat"
+        for size in range(min(self._max_trigger_tokens, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                plan_id = self._triggers.get(tuple(tokens[start : start + size]))
+                if plan_id:
+                    return plan_id
+        return None
+
+    def find_benefit(self, plan_id: str, text: str) -> Optional[str]:
+        index = self.benefit_indexes.get(plan_id)
+        match = index.search(text) if index else None
+        return match[0] if match else None
+
+    def get(self, plan_id: str) -> Optional[Dict]:
+        return self.plans.get(plan_id)
+
+
+# Global instance, loaded at import
+plan_kb = PlanKB()
@@ -0,0 +1,314 @@
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config.settings import (
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_MAX_QUESTION_CHARS,
+    SEMANTIC_CACHE_MIN_WORDS,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Embeds a batch of texts into an (n, dim) array of L2-normalized rows
+Embedder = Callable[[List[str]], np.ndarray]
+
+_APOSTROPHE_RE = re.compile(r"['’]")
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_DIGIT_RE = re.compile(r"\d")
+# Personal details that would end up in a shared answer: the asker's own
+# situation, names, and numbers spelled out
+_PERSONAL_RE = re.compile(
+    r"\b(?:my|mine|myself|our|ours|ourselves|im|ive|i am|i have|i was|we are|we have"
+    r"|name|named|called|mr|mrs|ms|miss|dr)\b"
+)
+_NUMBER_WORD_RE = re.compile(
+    r"\b(?:zero|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve"
+    r"|thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|twenty|thirty"
+    r"|forty|fifty|sixty|seventy|eighty|ninety|hundred|thousand|million|dozen|twice)\b"
+)
+# A negation flips the answer, so a match must negate the same way
+_NEGATIONS = frozenset(
+    "not no never without none nor except excluding excluded dont doesnt didnt "
+    "isnt arent wasnt werent cant cannot wont wouldnt shouldnt havent hasnt".split()
+)
+# Words that change nothing about which answer fits
+_STOP_WORDS = frozenset(
+    "a an the is are am was be do does did i me my we our you your it its "
+    "of to for in on at about please can could would will tell kindly what which".split()
+)
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and filler words, and strip plural -s"""
+    text = _PUNCTUATION_RE.sub(" ", _APOSTROPHE_RE.sub("", text.lower()))
+    words = []
+    for word in text.split():
+        if word in _STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+def _negations(normalized: str) -> frozenset:
+    return _NEGATIONS.intersection(normalized.split())
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for llama-family tokenizers
+    return max(1, len(text) // 4)
+
+
+class HashingEmbedder:
+    """
+    Dependency-free embedder: hashed word and character n-gram counts
+
+    Questions that differ in one word ("is diabetes covered" / "is asthma
+    covered") still score around 0.9, so the cache only reuses exact matches
+    of the normalized question with this embedder.
+    """
+
+    def __init__(self, dim: int = 2048, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str):
+        words = text.split()
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        padded = f" {text} "
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            features += [padded[i : i + n] for i in range(len(padded) - n + 1)]
+        return features
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                # crc32 is stable across processes, unlike hash()
+                vectors[row, zlib.crc32(feature.encode("utf-8")) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model (optional dependency)"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(texts, normalize_embeddings=True), dtype=np.float32
+        )
+
+
+def default_embedder() -> Embedder:
+    if SEMANTIC_CACHE_MODEL:
+        try:
+            return SentenceTransformerEmbedder(SEMANTIC_CACHE_MODEL)
+        except Exception as e:
+            logger.warning(
+                "Could not load embedding model %s (%s); using the hashing embedder",
+                SEMANTIC_CACHE_MODEL, e,
+            )
+    return HashingEmbedder()
+
+
+class SemanticCache:
+    """
+    Cache of general-question answers matched by embedding similarity
+
+    Entries are partitioned by (language, prompt version), so an answer is
+    only reused in the language it was written in and a prompt change never
+    serves old answers. The same normalized question is always a hit. With a
+    sentence-transformers model, the cached question with the highest cosine
+    similarity is also a hit when it reaches the threshold and negates the
+    same way; the hashing embedder is too coarse for that. Entries expire
+    after the TTL and the least recently used are evicted.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: int = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self._embedder = embedder
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # (question, language, prompt_version) -> entry dict
+        self._entries = OrderedDict()
+        # (language, prompt_version) -> (keys, matrix), rebuilt after changes
+        self._matrices = {}
+        self.stats = {
+            "hits": 0,
+            "exact_hits": 0,
+            "misses": 0,
+            "skipped": 0,
+            "evictions": 0,
+            "invalidated": 0,
+            "saved_tokens": 0,
+        }
+
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = default_embedder()
+        return self._embedder
+
+    @property
+    def fuzzy(self) -> bool:
+        """Whether similar (not only identical) questions may share an answer"""
+        return not isinstance(self.embedder, HashingEmbedder)
+
+    @staticmethod
+    def cacheable(question: str) -> bool:
+        """
+        Only general questions whose answer can be shared: short, with enough
+        words not to be a follow-up, and without personal details (digits,
+        numbers in words, names, the asker's own situation)
+        """
+        raw = _APOSTROPHE_RE.sub("", question.lower())
+        normalized = normalize_question(question)
+        return (
+            len(normalized) <= SEMANTIC_CACHE_MAX_QUESTION_CHARS
+            and len(normalized.split()) >= SEMANTIC_CACHE_MIN_WORDS
+            and not _DIGIT_RE.search(raw)
+            and not _PERSONAL_RE.search(raw)
+            and not _NUMBER_WORD_RE.search(raw)
+        )
+
+    def _partition(self, language: str, prompt_version):
+        partition = (language, prompt_version)
+        if partition not in self._matrices:
+            keys = [key for key in self._entries if key[1:] == partition]
+            vectors = [self._entries[key]["vector"] for key in keys]
+            matrix = np.vstack(vectors) if vectors else None
+            self._matrices[partition] = (keys, matrix)
+        return self._matrices[partition]
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._matrices.pop(key[1:], None)
+
+    def _matches(self, normalized: str, key, score: float) -> bool:
+        return score >= self.threshold and _negations(key[0]) == _negations(normalized)
+
+    def get(self, question: str, language: str, prompt_version) -> Optional[str]:
+        if not self.cacheable(question):
+            self.stats["skipped"] += 1
+            return None
+
+        normalized = normalize_question(question)
+        key = (normalized, language, prompt_version)
+        entry = self._entries.get(key)
+        similarity = 1.0
+        if entry is None and self.fuzzy:
+            keys, matrix = self._partition(language, prompt_version)
+            if matrix is not None:
+                vector = self.embedder([normalized])[0]
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if self._matches(normalized, keys[best], float(scores[best])):
+                    key, similarity = keys[best], float(scores[best])
+                    entry = self._entries[key]
+        elif entry is not None:
+            self.stats["exact_hits"] += 1
+
+        if entry is not None and time.time() - entry["stored_at"] > self.ttl_seconds:
+            self._drop(key)
+            entry = None
+
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        entry["hits"] += 1
+        self.stats["hits"] += 1
+        self.stats["saved_tokens"] += entry["tokens"]
+        logger.info("Semantic cache hit (%.2f) for '%s'", similarity, normalized)
+        return entry["answer"]
+
+    def set(self, question: str, language: str, prompt_version, answer: str, prompt_tokens: int = 0):
+        if not self.cacheable(question) or not answer:
+            return
+        normalized = normalize_question(question)
+        key = (normalized, language, prompt_version)
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = {
+            # Only needed for similarity lookups
+            "vector": self.embedder([normalized])[0] if self.fuzzy else None,
+            "answer": answer,
+            "stored_at": time.time(),
+            "tokens": prompt_tokens + estimate_tokens(answer),
+            "hits": 0,
+        }
+        self._matrices.pop(key[1:], None)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, question: Optional[str] = None, language: Optional[str] = None) -> int:
+        """
+        Remove cached answers
+
+        Args:
+            question (str, optional): Remove entries this question would hit
+                (the same matching as lookups). When omitted, every entry
+                matching the language filter is removed.
+            language (str, optional): Only touch entries in this language
+
+        Returns:
+            int: Number of entries removed
+        """
+        keys = [key for key in self._entries if language is None or key[1] == language]
+        if question:
+            normalized = normalize_question(question)
+            if self.fuzzy:
+                vector = self.embedder([normalized])[0]
+                keys = [
+                    key for key in keys
+                    if key[0] == normalized
+                    or self._matches(normalized, key, float(self._entries[key]["vector"] @ vector))
+                ]
+            else:
+                keys = [key for key in keys if key[0] == normalized]
+        for key in keys:
+            self._drop(key)
+        self.stats["invalidated"] += len(keys)
+        return len(keys)
+
+    def entries(self) -> List[Dict]:
+        return [
+            {
+                "question": key[0],
+                "language": key[1],
+                "prompt_version": key[2],
+                "hits": entry["hits"],
+                "age_seconds": int(time.time() - entry["stored_at"]),
+            }
+            for key, entry in self._entries.items()
+        ]
+
+
+# Global instance
+semantic_cache = SemanticCache()
@@ -0,0 +1,344 @@
+import asyncio
+import importlib.util
+import io
+import struct
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from config.settings import (
+    DEEPGRAM_API_KEY,
+    DEEPGRAM_LANGUAGE_MODELS,
+    DEEPGRAM_MAX_CONNECTIONS,
+    DEEPGRAM_MODEL,
+    DEEPGRAM_TIMEOUT,
+    LOCAL_STT_COMPUTE_TYPE,
+    LOCAL_STT_LANGUAGES,
+    LOCAL_STT_MAX_SECONDS,
+    LOCAL_STT_MODEL,
+    LOCAL_STT_THREADS,
+    TRANSCRIPTION_BACKEND,
+    TRANSCRIPTION_STUB_TEXT,
+)
+from utils.cpu_pool import run_cpu_bound
+
+# Speech-to-text backends behind services/voiceText.transcribe_audio. Every
+# backend has `name`, `available()` and
+#
+#   async transcribe(audio: bytes, mime_type, language) -> {"text", "language", "duration"}
+#
+# where language None means "detect it". TRANSCRIPTION_BACKEND picks one
+# backend, or 'auto' routes short clips in LOCAL_STT_LANGUAGES to the local
+# engine and the rest to Deepgram, each falling back to the other on errors.
+
+DEEPGRAM_LISTEN_URL = "https://api.deepgram.com/v1/listen"
+SAMPLE_RATE = 16000
+
+# Formats Deepgram decodes itself; everything else is transcoded first
+NATIVE_MIME_TYPES = {
+    "audio/ogg",
+    "audio/opus",
+    "audio/mpeg",
+    "audio/mp4",
+    "audio/aac",
+    "audio/wav",
+    "audio/webm",
+    "audio/flac",
+}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=DEEPGRAM_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=DEEPGRAM_MAX_CONNECTIONS,
+                max_keepalive_connections=DEEPGRAM_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def sniff_mime_type(audio: bytes) -> Optional[str]:
+    """Audio container from the file's magic bytes, or None when unknown"""
+    if audio.startswith(b"OggS"):
+        return "audio/ogg"
+    if audio.startswith(b"RIFF") and audio[8:12] == b"WAVE":
+        return "audio/wav"
+    if audio.startswith(b"ID3") or audio[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if audio[:2] in (b"\xff\xf1", b"\xff\xf9"):
+        return "audio/aac"
+    if audio[4:8] == b"ftyp":
+        return "audio/mp4"
+    if audio.startswith(b"fLaC"):
+        return "audio/flac"
+    if audio.startswith(b"\x1a\x45\xdf\xa3"):
+        return "audio/webm"
+    if audio.startswith(b"#!AMR"):
+        return "audio/amr"
+    return None
+
+
+def ogg_opus_duration(audio: bytes) -> Optional[float]:
+    """
+    Duration of an Ogg/Opus file from its last page header, without decoding
+
+    The granule position of the last page counts 48 kHz samples, including
+    the pre-skip from the OpusHead header.
+    """
+    if not audio.startswith(b"OggS"):
+        return None
+    last_page = audio.rfind(b"OggS")
+    head = audio.find(b"OpusHead")
+    if last_page < 0 or head < 0 or len(audio) < last_page + 14:
+        return None
+    granule = struct.unpack_from("<q", audio, last_page + 6)[0]
+    pre_skip = struct.unpack_from("<H", audio, head + 10)[0]
+    return max(0.0, (granule - pre_skip) / 48000)
+
+
+def audio_duration(audio: bytes) -> Optional[float]:
+    """Duration in seconds read from the Ogg/Opus or WAV header, or None"""
+    if audio.startswith(b"RIFF"):
+        try:
+            with wave.open(io.BytesIO(audio)) as wav:
+                return wav.getnframes() / wav.getframerate()
+        except (wave.Error, EOFError):
+            return None
+    return ogg_opus_duration(audio)
+
+
+def _load_segment(audio: bytes):
+    from pydub import AudioSegment
+
+    # WAV is read directly; everything else goes through ffmpeg
+    audio_format = "wav" if sniff_mime_type(audio) == "audio/wav" else None
+    return AudioSegment.from_file(io.BytesIO(audio), format=audio_format)
+
+
+def decode_audio(audio: bytes) -> np.ndarray:
+    """Decode any ffmpeg-readable audio (Ogg/Opus voice notes) to 16 kHz mono float32"""
+    segment = _load_segment(audio)
+    segment = segment.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+    samples = np.frombuffer(segment.raw_data, dtype=np.int16)
+    return samples.astype(np.float32) / 32768.0
+
+
+def transcode_to_wav(audio: bytes) -> bytes:
+    """16 kHz mono WAV (runs in the CPU pool; pydub needs ffmpeg)"""
+    output = io.BytesIO()
+    _load_segment(audio).set_channels(1).set_frame_rate(SAMPLE_RATE).export(output, format="wav")
+    return output.getvalue()
+
+
+def split_on_silence(
+    audio: bytes, max_seconds: float, min_silence_ms: int, silence_offset_db: float
+) -> List[bytes]:
+    """
+    Cut audio into 16 kHz mono WAV segments of at most max_seconds
+
+    Each cut is placed in the middle of the last pause (quieter than the
+    clip's average level by silence_offset_db, for at least min_silence_ms)
+    before the limit, so words are not split; without a pause the segment is
+    cut at the limit. Runs in the CPU pool.
+    """
+    from pydub.silence import detect_silence
+
+    segment = _load_segment(audio).set_channels(1).set_frame_rate(SAMPLE_RATE)
+    silences = detect_silence(
+        segment,
+        min_silence_len=min_silence_ms,
+        silence_thresh=segment.dBFS - silence_offset_db,
+        seek_step=10,
+    )
+    pauses = [(start + end) // 2 for start, end in silences]
+
+    max_ms = int(max_seconds * 1000)
+    bounds = [0]
+    while len(segment) - bounds[-1] > max_ms:
+        start = bounds[-1]
+        # Ignore pauses right at the start so segments do not get tiny
+        candidates = [p for p in pauses if start + max_ms // 4 <= p <= start + max_ms]
+        bounds.append(candidates[-1] if candidates else start + max_ms)
+    bounds.append(len(segment))
+
+    segments = []
+    for start, end in zip(bounds, bounds[1:]):
+        output = io.BytesIO()
+        segment[start:end].export(output, format="wav")
+        segments.append(output.getvalue())
+    return segments
+
+
+class DeepgramTranscriber:
+    """Deepgram pre-recorded transcription over the shared connection pool"""
+
+    name = "deepgram"
+
+    def available(self) -> bool:
+        return bool(DEEPGRAM_API_KEY)
+
+    def model_for(self, language: Optional[str]) -> str:
+        return DEEPGRAM_LANGUAGE_MODELS.get(language, DEEPGRAM_MODEL)
+
+    async def prepare(self, audio: bytes, mime_type: Optional[str]):
+        """
+        Audio bytes and mime type to upload, transcoding only when needed
+
+        The file's magic bytes take precedence over the type WhatsApp
+        reported ("audio/ogg; codecs=opus").
+        """
+        declared = (mime_type or "").split(";")[0].strip().lower() or None
+        detected = sniff_mime_type(audio) or declared
+        if detected in NATIVE_MIME_TYPES:
+            return audio, detected, False
+        return await run_cpu_bound(transcode_to_wav, audio), "audio/wav", True
+
+    async def transcribe(self, audio: bytes, mime_type: Optional[str], language: Optional[str]) -> Dict:
+        audio, upload_type, transcoded = await self.prepare(audio, mime_type)
+        params = {"model": self.model_for(language), "punctuate": "true", "smart_format": "true"}
+        if language:
+            params["language"] = language
+        else:
+            params["detect_language"] = "true"
+
+        response = await get_client().post(
+            DEEPGRAM_LISTEN_URL,
+            params=params,
+            content=audio,
+            headers={
+                "Authorization": f"Token {DEEPGRAM_API_KEY}",
+                "Content-Type": upload_type,
+            },
+        )
+        response.raise_for_status()
+        data = response.json()
+        channel = data["results"]["channels"][0]
+        return {
+            "text": channel["alternatives"][0]["transcript"].strip(),
+            "language": channel.get("detected_language", language),
+            "duration": float(data.get("metadata", {}).get("duration", 0.0)),
+            "transcoded": transcoded,
+        }
+
+
+class LocalWhisperTranscriber:
+    """
+    faster-whisper (CTranslate2) on the CPU (optional dependency)
+
+    The model is loaded on first use and shared; inference runs on a
+    dedicated thread pool because CTranslate2 releases the GIL and keeping
+    the model in one process avoids loading it per worker.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_STT_MODEL,
+        compute_type: str = LOCAL_STT_COMPUTE_TYPE,
+        threads: int = LOCAL_STT_THREADS,
+    ):
+        self.model_name = model_name
+        self.compute_type = compute_type
+        self.threads = threads
+        self._model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-stt")
+
+    def available(self) -> bool:
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    def _load(self):
+        if self._model is None:
+            from faster_whisper import WhisperModel
+
+            self._model = WhisperModel(
+                self.model_name,
+                device="cpu",
+                compute_type=self.compute_type,
+                cpu_threads=self.threads,
+            )
+        return self._model
+
+    def _run(self, audio: bytes, language: Optional[str]) -> Dict:
+        samples = decode_audio(audio)
+        segments, info = self._load().transcribe(samples, language=language, beam_size=1, vad_filter=True)
+        return {
+            "text": " ".join(segment.text.strip() for segment in segments).strip(),
+            "language": info.language,
+            "duration": len(samples) / SAMPLE_RATE,
+            "transcoded": True,
+        }
+
+    async def transcribe(self, audio: bytes, mime_type: Optional[str], language: Optional[str]) -> Dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, audio, language)
+
+
+class StubTranscriber:
+    """Local stand-in that returns a fixed transcript without any network call"""
+
+    name = "stub"
+
+    def __init__(self, text: str = TRANSCRIPTION_STUB_TEXT):
+        self.text = text
+
+    def available(self) -> bool:
+        return True
+
+    async def transcribe(self, audio: bytes, mime_type: Optional[str], language: Optional[str]) -> Dict:
+        duration = audio_duration(audio)
+        if duration is None:
+            # Opus voice notes run at roughly 16 kbit/s
+            duration = len(audio) / 2000
+        return {"text": self.text, "language": language or "en", "duration": duration, "transcoded": False}
+
+
+_backends: Dict[str, object] = {}
+
+
+def get_backend(name: str):
+    if name not in _backends:
+        if name == "stub":
+            _backends[name] = StubTranscriber()
+        elif name == "local":
+            _backends[name] = LocalWhisperTranscriber()
+        elif name == "deepgram":
+            _backends[name] = DeepgramTranscriber()
+        else:
+            raise ValueError(f"Unknown transcription backend: {name}")
+    return _backends[name]
+
+
+def select_backends(audio: bytes, language: Optional[str], mode: str = TRANSCRIPTION_BACKEND) -> list:
+    """
+    Backends to try for this clip, in order
+
+    In 'auto' mode a clip goes to the local engine first when its language
+    is in LOCAL_STT_LANGUAGES ('*' for any, including detection) and it is
+    at most LOCAL_STT_MAX_SECONDS long; otherwise Deepgram goes first. The
+    other backend is the fallback. Unavailable backends are skipped.
+    """
+    if mode != "auto":
+        return [get_backend(mode)]
+
+    duration = audio_duration(audio)
+    language_ok = "*" in LOCAL_STT_LANGUAGES or language in LOCAL_STT_LANGUAGES
+    short = duration is not None and duration <= LOCAL_STT_MAX_SECONDS
+    order = ["local", "deepgram"] if language_ok and short else ["deepgram", "local"]
+    backends = [get_backend(name) for name in order if get_backend(name).available()]
+    return backends or [get_backend(order[0])]
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import glob
+import os
+import re
+import time
+from typing import Dict, List
+
+from .speech_backends import close_client, get_backend
+
+# Compares speech-to-text backends on sample clips. Every clip (any format
+# ffmpeg reads, e.g. WhatsApp .ogg voice notes) needs a reference transcript
+# next to it with the same name and a .txt extension:
+#
+#   python -m services.stt_benchmark samples/voice --backends deepgram local --language en
+#
+# Reports the real-time factor (transcription seconds per audio second) and
+# the word error rate against the references.
+
+AUDIO_EXTENSIONS = (".ogg", ".opus", ".mp3", ".m4a", ".wav", ".aac", ".amr", ".webm")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level edit distance divided by the reference length"""
+    ref, hyp = words(reference), words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def load_clips(directory: str) -> List[Dict]:
+    clips = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        stem, extension = os.path.splitext(path)
+        if extension.lower() not in AUDIO_EXTENSIONS or not os.path.exists(f"{stem}.txt"):
+            continue
+        with open(path, "rb") as f:
+            audio = f.read()
+        with open(f"{stem}.txt", encoding="utf-8") as f:
+            reference = f.read().strip()
+        clips.append({"name": os.path.basename(path), "audio": audio, "reference": reference})
+    return clips
+
+
+async def benchmark(clips: List[Dict], backend_names: List[str], language: str = None) -> Dict:
+    results = {}
+    for name in backend_names:
+        backend = get_backend(name)
+        if not backend.available():
+            print(f"{name}: not available, skipped")
+            continue
+        latency = audio_seconds = total_wer = 0.0
+        errors = 0
+        for clip in clips:
+            started = time.monotonic()
+            try:
+                result = await backend.transcribe(clip["audio"], None, language)
+            except Exception as e:
+                print(f"{name} {clip['name']}: {e}")
+                errors += 1
+                continue
+            elapsed = time.monotonic() - started
+            wer = word_error_rate(clip["reference"], result["text"])
+            latency += elapsed
+            audio_seconds += result["duration"]
+            total_wer += wer
+            print(f"{name:9} {clip['name']:30} {result['duration']:6.1f}s audio  {elapsed:6.2f}s  WER {wer:.2f}")
+        done = len(clips) - errors
+        results[name] = {
+            "clips": done,
+            "errors": errors,
+            "rtf": latency / audio_seconds if audio_seconds else None,
+            "wer": total_wer / done if done else None,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare speech-to-text backends on sample clips")
+    parser.add_argument("clips", help="Directory of audio clips with .txt reference transcripts")
+    parser.add_argument("--backends", nargs="+", default=["deepgram", "local"])
+    parser.add_argument("--language", default=None, help="Language code (default: detect)")
+    args = parser.parse_args()
+
+    clips = load_clips(args.clips)
+    if not clips:
+        parser.error(f"No clips with reference transcripts in {args.clips}")
+
+    async def run():
+        try:
+            return await benchmark(clips, args.backends, args.language)
+        finally:
+            await close_client()
+
+    results = asyncio.run(run())
+    print()
+    print(f"{'backend':9} {'clips':>5} {'errors':>6} {'RTF':>6} {'WER':>6}")
+    for name, result in results.items():
+        rtf = f"{result['rtf']:.3f}" if result["rtf"] is not None else "-"
+        wer = f"{result['wer']:.3f}" if result["wer"] is not None else "-"
+        print(f"{name:9} {result['clips']:5} {result['errors']:6} {rtf:>6} {wer:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 import asyncio
+import logging
 from langchain_groq.chat_models import ChatGroq
 from langchain.schema import HumanMessage, SystemMessage
 from config.settings import GROQ_API_KEY
+from utils.metrics import llm_callbacks
+from utils.tracing import traced
+
+logger = logging.getLogger(__name__)
 
 # Language code mapping
 LANGUAGE_MAPPING = {
@@ -22,6 +27,41 @@ LANGUAGE_MAPPING = {
 # Default language
 DEFAULT_LANGUAGE = "en"
 
+LANGUAGE_NAMES = {
+    "ar": "Arabic",
+    "en": "English",
+    "ur": "Urdu",
+    "hi": "Hindi",
+    "fr": "French",
+    "es": "Spanish",
+}
+
+# LLM translation calls made, and calls skipped because the text was
+# already generated in the target language
+TRANSLATION_STATS = {"calls": 0, "avoided": 0, "errors": 0}
+
+
+class LocalizedText(str):
+    """
+    Text that is already written in `language`
+
+    Send paths translate outgoing text into the user's language; text marked
+    this way (typically an LLM answer generated directly in that language)
+    is passed through unchanged instead of being translated a second time.
+    """
+
+    def __new__(cls, text: str, language: str):
+        obj = super().__new__(cls, text)
+        obj.language = language
+        return obj
+
+
+def _already_localized(text: str, target_language: str) -> bool:
+    if isinstance(text, LocalizedText) and text.language == target_language:
+        TRANSLATION_STATS["avoided"] += 1
+        return True
+    return False
+
 
 def normalize_language(language_input: str) -> str:
     """Normalize language input to language code"""
@@ -30,17 +70,7 @@ def normalize_language(language_input: str) -> str:
 
 
 def _build_translation_messages(text: str, target_language: str, source_language: str):
-    # Language names for better translation
-    language_names = {
-        "ar": "Arabic",
-        "en": "English",
-        "ur": "Urdu",
-        "hi": "Hindi",
-        "fr": "French",
-        "es": "Spanish",
-    }
-
-    target_lang_name = language_names.get(target_language, "Arabic")
+    target_lang_name = LANGUAGE_NAMES.get(target_language, "Arabic")
 
     prompt = f"""Translate the following text from {source_language} to {target_language} ({target_lang_name}).
         
@@ -62,6 +92,7 @@ Translated text:"""
     return messages
 
 
+@traced()
 async def translate_text(
     text: str, target_language: str = "ar", source_language: str = "en"
 ) -> str:
@@ -79,7 +110,7 @@ async def translate_text(
     if target_language == "en" or target_language == source_language:
         return text
 
-    if not text or not text.strip():
+    if not text or not text.strip() or _already_localized(text, target_language):
         return text
 
     try:
@@ -88,8 +119,10 @@ async def translate_text(
             temperature=0,
             api_key=GROQ_API_KEY,
             groq_proxy=None,
+            callbacks=llm_callbacks("translation"),
         )
 
+        TRANSLATION_STATS["calls"] += 1
         messages = _build_translation_messages(text, target_language, source_language)
 
         loop = asyncio.get_running_loop()
@@ -100,11 +133,13 @@ async def translate_text(
         return translated_text.strip()
 
     except Exception as e:
-        print(f"Error translating text: {e}")
+        TRANSLATION_STATS["errors"] += 1
+        logger.error("Error translating text: %s", e)
         # Return original text if translation fails
         return text
 
 
+@traced()
 async def translate_list(
     items: list, target_language: str = "ar", source_language: str = "en"
 ) -> list:
@@ -134,6 +169,7 @@ async def translate_list(
     return translated_items
 
 
+@traced()
 def translate_text_sync(
     text: str, target_language: str = "ar", source_language: str = "en"
 ) -> str:
@@ -141,7 +177,7 @@ def translate_text_sync(
     if target_language == "en" or target_language == source_language:
         return text
 
-    if not text or not text.strip():
+    if not text or not text.strip() or _already_localized(text, target_language):
         return text
 
     try:
@@ -150,15 +186,19 @@ def translate_text_sync(
             temperature=0,
             api_key=GROQ_API_KEY,
             groq_proxy=None,
+            callbacks=llm_callbacks("translation"),
         )
+        TRANSLATION_STATS["calls"] += 1
         messages = _build_translation_messages(text, target_language, source_language)
         translated_text = llm.invoke(messages).content
         return translated_text.strip()
     except Exception as e:
-        print(f"Error translating text (sync): {e}")
+        TRANSLATION_STATS["errors"] += 1
+        logger.error("Error translating text (sync): %s", e)
         return text
 
 
+@traced()
 def translate_list_sync(
     items: list, target_language: str = "ar", source_language: str = "en"
 ) -> list:
@@ -262,6 +302,7 @@ def detect_language_change_request(text: str) -> tuple[bool, str]:
     return False, "en"
 
 
+@traced()
 async def detect_language_change_with_llm(text: str) -> tuple[bool, str]:
     """
     Use LLM to detect language change requests (more flexible)
@@ -278,6 +319,7 @@ async def detect_language_change_with_llm(text: str) -> tuple[bool, str]:
             temperature=0,
             api_key=GROQ_API_KEY,
             groq_proxy=None,
+            callbacks=llm_callbacks("detection"),
         )
 
         prompt = f"""Analyze if the user EXPLICITLY wants to change the conversation language. Only return a language code if the user is CLEARLY requesting a language change.
@@ -335,6 +377,6 @@ Examples:
         return True, result
 
     except Exception as e:
-        print(f"Error in LLM language detection: {e}")
+        logger.error("Error in LLM language detection: %s", e)
         # Fallback to simple pattern matching
         return detect_language_change_request(text)
@@ -1,29 +1,291 @@
-# services/deepgram.py
-from deepgram import Deepgram
-from config.settings import DEEPGRAM_API_KEY
+# services/voiceText.py
 import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
 
-async def transcribe_audio(audio_data: bytes) -> str:
-    dg_client = Deepgram(DEEPGRAM_API_KEY)
-    
+from config.settings import (
+    TRANSCRIPTION_BACKEND,
+    TRANSCRIPTION_LANGUAGE_MODE,
+    TRANSCRIPTION_QUEUE_SIZE,
+    TRANSCRIPTION_WORKERS,
+    VOICE_CHUNK_CONCURRENCY,
+    VOICE_CHUNK_MAX_SECONDS,
+    VOICE_CHUNK_MIN_SECONDS,
+    VOICE_CHUNK_MIN_SILENCE_MS,
+    VOICE_CHUNK_SILENCE_DB,
+    VOICE_SHORT_ANSWER_STAGES,
+)
+from utils.cpu_pool import run_cpu_bound
+from utils.tracing import bind, span, start_trace, user_hash
+from .speech_backends import audio_duration, close_client, select_backends, split_on_silence
+from .whatsapp import download_whatsapp_audio, send_whatsapp_message
+
+logger = logging.getLogger(__name__)
+
+# Voice message transcription. The speech-to-text engine is chosen per clip
+# by services/speech_backends.py (Deepgram, a local faster-whisper model, or
+# a stub); long notes are cut at pauses and the pieces transcribed in
+# parallel. Voice messages are handled by a small pool of queue workers, so
+# the webhook returns as soon as the message is queued.
+
+TRANSCRIPTION_STATS = {
+    "requests": 0,
+    "errors": 0,
+    "empty": 0,
+    "fallbacks": 0,
+    # Long notes split at pauses, the segments they produced, and notes
+    # answered from their first segment only
+    "segmented": 0,
+    "segments": 0,
+    "partial": 0,
+    "queued": 0,
+    "rejected": 0,
+    # Per backend: calls, errors, transcoded, audio_seconds, latency_sum
+    "backends": {},
+}
+
+# Called with (from_id, transcript, profile_name, turn=turn) for every
+# transcribed message; `turn` is the object passed to submit
+TranscriptHandler = Callable[..., Awaitable[None]]
+
+_segment_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _backend_stats(name: str) -> Dict:
+    return TRANSCRIPTION_STATS["backends"].setdefault(
+        name,
+        {"calls": 0, "errors": 0, "transcoded": 0, "audio_seconds": 0.0, "latency_sum": 0.0},
+    )
+
+
+def transcription_language(state: Optional[dict]) -> Optional[str]:
+    """The session's language, or None for language detection"""
+    if TRANSCRIPTION_LANGUAGE_MODE == "detect" or not state:
+        return None
+    return state.get("language")
+
+
+async def _transcribe_clip(audio: bytes, language: Optional[str], mime_type: Optional[str]) -> Optional[Dict]:
+    """Transcribe one clip, falling back to the next backend on errors"""
+    for attempt, backend in enumerate(select_backends(audio, language)):
+        stats = _backend_stats(backend.name)
+        stats["calls"] += 1
+        if attempt:
+            TRANSCRIPTION_STATS["fallbacks"] += 1
+        try:
+            started = time.monotonic()
+            with span("transcribe", backend=backend.name, bytes=len(audio)):
+                result = await backend.transcribe(audio, mime_type, language)
+            stats["latency_sum"] += time.monotonic() - started
+            stats["audio_seconds"] += result["duration"]
+            stats["transcoded"] += int(result.get("transcoded", False))
+            return result
+        except Exception as e:
+            stats["errors"] += 1
+            logger.warning("Error transcribing audio with %s: %s", backend.name, e)
+    return None
+
+
+def _get_segment_semaphore() -> asyncio.Semaphore:
+    global _segment_semaphore
+    if _segment_semaphore is None:
+        _segment_semaphore = asyncio.Semaphore(VOICE_CHUNK_CONCURRENCY)
+    return _segment_semaphore
+
+
+async def _split(audio: bytes) -> List[bytes]:
+    """Segments of a long voice note, or just the note itself"""
+    duration = audio_duration(audio)
+    if duration is None or duration <= VOICE_CHUNK_MIN_SECONDS:
+        return [audio]
     try:
-        # Configure Deepgram options (e.g., language, model)
-        options = {
-            "model": "nova-2",  # High-accuracy model
-            "language": "en",   # Adjust based on your use case
-            "punctuate": True,
-            "diarize": False    # Set to True if you want speaker detection
-        }
-        
-        # Transcribe the audio
-        response = await dg_client.transcription.prerecorded(
-            {"buffer": audio_data, "mimetype": "audio/ogg"},  # WhatsApp voice messages are typically OGG
-            options
+        segments = await run_cpu_bound(
+            split_on_silence,
+            audio,
+            VOICE_CHUNK_MAX_SECONDS,
+            VOICE_CHUNK_MIN_SILENCE_MS,
+            VOICE_CHUNK_SILENCE_DB,
         )
-        
-        # Extract the transcribed text
-        transcript = response["results"]["channels"][0]["alternatives"][0]["transcript"]
-        return transcript
     except Exception as e:
-        print(f"Error transcribing audio with Deepgram: {e}")
-        return None
\ No newline at end of file
+        logger.warning("Could not split voice note, transcribing it whole: %s", e)
+        return [audio]
+    TRANSCRIPTION_STATS["segmented"] += 1
+    TRANSCRIPTION_STATS["segments"] += len(segments)
+    return segments
+
+
+async def _transcribe_segment(segment: bytes, language: Optional[str]) -> Optional[Dict]:
+    async with _get_segment_semaphore():
+        return await _transcribe_clip(segment, language, "audio/wav")
+
+
+async def transcribe_audio(
+    audio_data: bytes,
+    language: Optional[str] = "en",
+    mime_type: Optional[str] = None,
+    first_segment_only: bool = False,
+) -> Optional[str]:
+    """
+    Transcribe a voice message
+
+    Notes longer than VOICE_CHUNK_MIN_SECONDS are cut at pauses and the
+    segments transcribed concurrently, then joined in order.
+
+    Args:
+        audio_data (bytes): The downloaded audio
+        language (str, optional): Language code, or None to detect it
+        mime_type (str, optional): Type reported by WhatsApp
+        first_segment_only (bool): Return the first segment with speech as
+            soon as it is transcribed and cancel the rest (for stages that
+            only need a short answer)
+
+    Returns:
+        str: The transcript, or None when transcription failed or was empty
+    """
+    TRANSCRIPTION_STATS["requests"] += 1
+    segments = await _split(audio_data)
+    if len(segments) == 1:
+        results = [await _transcribe_clip(audio_data, language, mime_type)]
+    else:
+        tasks = [asyncio.create_task(_transcribe_segment(s, language)) for s in segments]
+        results = []
+        try:
+            for task in tasks:
+                results.append(await task)
+                if first_segment_only and results[-1] and results[-1]["text"]:
+                    TRANSCRIPTION_STATS["partial"] += 1
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if any(result is None for result in results):
+        TRANSCRIPTION_STATS["errors"] += 1
+        return None
+    text = " ".join(result["text"] for result in results if result["text"])
+    if not text:
+        TRANSCRIPTION_STATS["empty"] += 1
+        return None
+    if language is None:
+        logger.info("Detected voice message language: %s", results[0]["language"])
+    return text
+
+
+def transcription_stats() -> Dict:
+    stats = {key: value for key, value in TRANSCRIPTION_STATS.items() if key != "backends"}
+    stats["backends"] = {}
+    for name, backend in TRANSCRIPTION_STATS["backends"].items():
+        # Real-time factor: seconds of transcription per second of audio
+        rtf = backend["latency_sum"] / backend["audio_seconds"] if backend["audio_seconds"] else None
+        stats["backends"][name] = {**backend, "latency_per_audio_second": rtf}
+    stats["mode"] = TRANSCRIPTION_BACKEND
+    stats["in_queue"] = voice_queue.queue.qsize() if voice_queue else 0
+    return stats
+
+
+class VoiceMessageQueue:
+    """Bounded queue of voice messages drained by background workers"""
+
+    def __init__(self, user_states: dict, on_transcript: TranscriptHandler, workers: int = TRANSCRIPTION_WORKERS):
+        self.user_states = user_states
+        self.on_transcript = on_transcript
+        self.queue = asyncio.Queue(maxsize=TRANSCRIPTION_QUEUE_SIZE)
+        self.workers = workers
+        self._tasks = []
+
+    def submit(self, from_id: str, media_id: str, mime_type: Optional[str], profile_name: Optional[str], turn=None) -> bool:
+        """
+        Queue a voice message; False when the queue is full
+
+        `turn` (the message's place in the user's queue, with a release()
+        method) is handed to the transcript handler, and released here when
+        the message is dropped.
+        """
+        try:
+            self.queue.put_nowait((from_id, media_id, mime_type, profile_name, turn))
+        except asyncio.QueueFull:
+            TRANSCRIPTION_STATS["rejected"] += 1
+            return False
+        TRANSCRIPTION_STATS["queued"] += 1
+        return True
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                with start_trace("voice_message", user=user_hash(job[0])):
+                    await self._handle(*job)
+            except Exception as e:
+                logger.error("Voice message worker error: %s", e)
+            finally:
+                self.queue.task_done()
+
+    async def _handle(self, from_id: str, media_id: str, mime_type: Optional[str], profile_name: Optional[str], turn=None):
+        """
+        Download and transcribe, then hand the transcript to its own task, so
+        the worker is free while the message waits for its turn and is handled
+        """
+        handed_off = False
+        try:
+            loop = asyncio.get_running_loop()
+            audio_data = await loop.run_in_executor(None, bind(download_whatsapp_audio), media_id)
+            if not audio_data:
+                await loop.run_in_executor(
+                    None,
+                    bind(send_whatsapp_message),
+                    from_id,
+                    "Sorry, I couldn’t retrieve your voice message. Please try again.",
+                )
+                return
+
+            state = self.user_states.get(from_id)
+            language = transcription_language(state)
+            short_answer = bool(state) and state.get("stage") in VOICE_SHORT_ANSWER_STAGES
+            transcribed_text = await transcribe_audio(
+                audio_data, language, mime_type, first_segment_only=short_answer
+            )
+            if not transcribed_text:
+                await loop.run_in_executor(
+                    None,
+                    bind(send_whatsapp_message),
+                    from_id,
+                    "Sorry, I couldn’t understand your voice message. Could you please try again or type your request?",
+                )
+                return
+
+            logger.info("Transcribed voice message from %s", from_id)
+            logger.debug("Transcript: %s", transcribed_text)
+            asyncio.create_task(self.on_transcript(from_id, transcribed_text, profile_name, turn=turn))
+            handed_off = True
+        finally:
+            # A dropped message must not hold up the user's later messages
+            if turn is not None and not handed_off:
+                turn.release()
+
+
+voice_queue: Optional[VoiceMessageQueue] = None
+
+
+def start_voice_queue(user_states: dict, on_transcript: TranscriptHandler) -> VoiceMessageQueue:
+    global voice_queue
+    if voice_queue is None:
+        voice_queue = VoiceMessageQueue(user_states, on_transcript)
+    voice_queue.start()
+    return voice_queue
+
+
+async def stop_voice_queue():
+    if voice_queue is not None:
+        await voice_queue.stop()
+    await close_client()
@@ -1,9 +1,13 @@
 import json
+import logging
 import requests
 from config.settings import WHATAPP_URL, WHATSAPP_TOKEN, VERSION
 from utils.helpers import store_interaction
+from utils.metrics import GRAPH_API_ERRORS, GRAPH_API_SECONDS, mark_sent
+from utils.tracing import span
 from .translation import translate_text_sync, translate_list_sync
 
+logger = logging.getLogger(__name__)
 
 USER_LANGUAGE_PREFERENCES = {}
 
@@ -21,6 +25,37 @@ def _sanitize_text(text: str, limit: int) -> str:
     return sanitized
 
 
+def _graph_request(method: str, url: str, operation: str, **kwargs) -> requests.Response:
+    """Graph API call, timed and counted per operation"""
+    try:
+        with span("graph_api", operation=operation) as trace_span, GRAPH_API_SECONDS.time(operation=operation):
+            response = requests.request(method, url, **kwargs)
+            trace_span.set(status=response.status_code)
+    except requests.RequestException:
+        GRAPH_API_ERRORS.inc(operation=operation, status="network")
+        raise
+    if response.status_code >= 400:
+        GRAPH_API_ERRORS.inc(operation=operation, status=str(response.status_code))
+    return response
+
+
+def _post_message(payload: dict, headers: dict) -> requests.Response:
+    response = _graph_request("POST", WHATAPP_URL, "messages", headers=headers, json=payload)
+    kind = payload.get("interactive", {}).get("type") or payload.get("type")
+    if response.status_code >= 400:
+        logger.warning(
+            "WhatsApp %s message to %s failed: %s %s",
+            kind, payload.get("to"), response.status_code, response.text,
+        )
+    # Typing indicators do not count as the reply
+    elif payload.get("type") == "reaction":
+        logger.debug("Typing indicator sent to %s", payload.get("to"))
+    else:
+        logger.info("WhatsApp %s message sent to %s", kind, payload.get("to"))
+        mark_sent(payload.get("to"))
+    return response
+
+
 def set_user_language(user_id: str, language: str):
     if not user_id:
         return
@@ -36,6 +71,11 @@ def clear_user_language(user_id: str):
 
 
 def send_whatsapp_message(to: str, message: str) -> bool:
+    """
+    Send a text message, translating it into the user's language first
+
+    A LocalizedText already in the user's language is sent as is.
+    """
     language = get_user_language(to)
     if language != "en":
         message = translate_text_sync(message, language, "en")
@@ -49,8 +89,7 @@ def send_whatsapp_message(to: str, message: str) -> bool:
         "type": "text",
         "text": {"body": message},
     }
-    response = requests.post(WHATAPP_URL, headers=headers, json=payload)
-    print(f"Message sent to {to}, status code: {response.status_code}")
+    response = _post_message(payload, headers)
     return response.status_code == 200
 
 
@@ -71,8 +110,7 @@ def send_typing_indicator(to: str) -> bool:
             "text": {"preview_url": False, "body": "<typing>"},
         },
     }
-    response = requests.post(WHATAPP_URL, headers=headers, json=payload)
-    print(f"Typing indicator sent to {to}, status code: {response.status_code}")
+    response = _post_message(payload, headers)
     return response.status_code == 200
 
 
@@ -126,10 +164,7 @@ def send_interactive_buttons(
         },
     }
 
-    response = requests.post(WHATAPP_URL, headers=headers, json=payload)
-    print(
-        f"Interactive message sent to {recipient}, status code: {response.status_code}"
-    )
+    response = _post_message(payload, headers)
 
     store_interaction(
         from_id=recipient,
@@ -227,12 +262,7 @@ def send_interactive_list(
         },
     }
 
-    response = requests.post(WHATAPP_URL, headers=headers, json=payload)
-    print(
-        f"Interactive list message sent to {recipient}, status code: {response.status_code}"
-    )
-    if response.status_code != 200:
-        print(f"Error response: {response.text}")  # Log the error details
+    response = _post_message(payload, headers)
 
     store_interaction(
         from_id=recipient,
@@ -336,25 +366,24 @@ async def send_yes_no_options_translated(
 def download_whatsapp_audio(media_id: str) -> bytes:
     headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
     media_url = f"https://graph.facebook.com/{VERSION}/{media_id}"
-    print(f"Requesting media URL: {media_url}")
-    print(f"Using token (first 10 chars): {WHATSAPP_TOKEN[:10]}...")
-    response = requests.get(media_url, headers=headers)
+    logger.debug("Requesting media URL for %s", media_id)
+    response = _graph_request("GET", media_url, "media_url", headers=headers)
 
     if response.status_code == 200:
         audio_url = response.json().get("url")
-        print(f"Retrieved audio URL: {audio_url}")
-        audio_response = requests.get(audio_url, headers=headers)
+        audio_response = _graph_request("GET", audio_url, "media_download", headers=headers)
         if audio_response.status_code == 200:
-            print(f"Audio downloaded, size: {len(audio_response.content)} bytes")
+            logger.info("Audio %s downloaded, %d bytes", media_id, len(audio_response.content))
             return audio_response.content
         else:
-            print(
-                f"Failed to download audio: {audio_response.status_code}, Response: {audio_response.text}"
+            logger.warning(
+                "Failed to download audio %s: %s %s",
+                media_id, audio_response.status_code, audio_response.text,
             )
             return None
     else:
-        print(
-            f"Failed to get media URL: {response.status_code}, Response: {response.text}"
+        logger.warning(
+            "Failed to get media URL for %s: %s %s", media_id, response.status_code, response.text
         )
         return None
 
@@ -363,24 +392,24 @@ def download_whatsapp_audio(media_id: str) -> bytes:
 def download_whatsapp_media(media_id: str) -> bytes:
     headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
     media_url = f"https://graph.facebook.com/{VERSION}/{media_id}"
-    print(f"Requesting media URL: {media_url}")
-    response = requests.get(media_url, headers=headers)
+    logger.debug("Requesting media URL for %s", media_id)
+    response = _graph_request("GET", media_url, "media_url", headers=headers)
 
     if response.status_code == 200:
         download_url = response.json().get("url")
-        print(f"Retrieved download URL: {download_url}")
-        download_response = requests.get(download_url, headers=headers)
+        download_response = _graph_request("GET", download_url, "media_download", headers=headers)
         if download_response.status_code == 200:
-            print(f"Media downloaded, size: {len(download_response.content)} bytes")
+            logger.info("Media %s downloaded, %d bytes", media_id, len(download_response.content))
             return download_response.content
         else:
-            print(
-                f"Failed to download media: {download_response.status_code}, Response: {download_response.text}"
+            logger.warning(
+                "Failed to download media %s: %s %s",
+                media_id, download_response.status_code, download_response.text,
             )
             return None
     else:
-        print(
-            f"Failed to get media URL: {response.status_code}, Response: {response.text}"
+        logger.warning(
+            "Failed to get media URL for %s: %s %s", media_id, response.status_code, response.text
         )
         return None
 
@@ -562,10 +591,7 @@ def send_flow_message(to: str, flow_data: dict) -> bool:
     }
 
     # Make the API request
-    response = requests.post(WHATAPP_URL, headers=headers, json=payload)
-    print(f"Flow message sent to {to}, status code: {response.status_code}")
-    if response.status_code != 200:
-        print(f"Error response: {response.text}")
+    response = _post_message(payload, headers)
 
     return response.status_code == 200
 
@@ -613,10 +639,7 @@ def send_link_button(
         },
     }
 
-    response = requests.post(WHATAPP_URL, headers=headers, json=payload)
-    print(f"Link button message sent to {to}, status code: {response.status_code}")
-    if response.status_code != 200:
-        print(f"Error response: {response.text}")
+    response = _post_message(payload, headers)
 
     store_interaction(
         from_id=to,
@@ -13,9 +13,14 @@ from PIL import Image
 import fitz  # PyMuPDF for PDF processing
 from dotenv import load_dotenv
 
+from config.settings import OCR_JPEG_QUALITY, OCR_MAX_DIMENSION
+from .image_preprocessing import encode_image_base64, fit_image, preprocess_image
+from .metrics import llm_callbacks
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
 class DocumentVisionOCR:
     def __init__(self, api_key=None, model=None, max_tokens=1000, temperature=0.2):
         """
@@ -39,24 +44,15 @@ class DocumentVisionOCR:
             groq_api_key=self.api_key,
             model=self.model,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            callbacks=llm_callbacks("vision"),
         )
-        logging.info(f"Initialized DocumentVisionOCR with model: {self.model}")
-        
-    def encode_image(self, image, max_size=(1000, 1000), quality=85):
-        """Encode image to base64 with resizing if needed"""
-        # Resize if image is too large
-        if image.width > max_size[0] or image.height > max_size[1]:
-            image = image.resize(
-                (min(image.width, max_size[0]), 
-                min(image.height, max_size[1])),
-                Image.LANCZOS
-            )
+        logger.info("Initialized DocumentVisionOCR with model: %s", self.model)
         
-        # Save with compression
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG", quality=quality)
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    def encode_image(self, image, max_size=(OCR_MAX_DIMENSION, OCR_MAX_DIMENSION), quality=OCR_JPEG_QUALITY):
+        """Encode image to base64, fitting it inside max_size while keeping its aspect ratio"""
+        image = fit_image(image, max_dimension=min(max_size), min_dimension=0)
+        return encode_image_base64(image, quality)
         
     def extract_text_from_image(self, image, prompt=None):
         """
@@ -71,7 +67,19 @@ class DocumentVisionOCR:
         """
         # Encode image
         base64_image = self.encode_image(image)
+        return self.extract_text_from_base64(base64_image, prompt)
+
+    def extract_text_from_base64(self, base64_image, prompt=None):
+        """
+        Extract text from an image that has already been encoded
         
+        Args:
+            base64_image (str): Base64 JPEG, e.g. produced by the CPU pool
+            prompt (str, optional): Custom prompt for the vision model
+            
+        Returns:
+            str: Extracted text from the image
+        """
         # Use default or custom prompt
         text_prompt = prompt or (
             "You are an OCR expert. Extract ALL text from this image accurately, "
@@ -85,7 +93,7 @@ class DocumentVisionOCR:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
+                            "url": f"data:image/jpeg;base64,{base64_image}"
                         }
                     },
                     {
@@ -96,11 +104,11 @@ class DocumentVisionOCR:
             )
             
             # Invoke OCR
-            logging.info("Sending image to vision model for text extraction")
+            logger.info("Sending image to vision model for text extraction")
             response = self.chat.invoke([msg])
             return response.content
         except Exception as e:
-            logging.error(f"Text Extraction Error: {e}")
+            logger.error("Text Extraction Error: %s", e)
             return None
     
     def extract_text_from_pdf(self, pdf_path, dpi=300, prompt=None):
@@ -122,15 +130,17 @@ class DocumentVisionOCR:
             # Open the PDF
             pdf_document = fitz.open(pdf_path)
             total_pages = len(pdf_document)
-            logging.info(f"Processing PDF with {total_pages} pages at {dpi} DPI")
+            logger.info("Processing PDF with %s pages at %s DPI", total_pages, dpi)
             
             # Process each page
             for page_num, page in enumerate(pdf_document):
                 page_number = page_num + 1
-                logging.info(f"Processing page {page_number} of {total_pages}")
+                logger.info("Processing page %s of %s", page_number, total_pages)
                 
-                # Convert page to an image
-                pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+                # Render straight at the model resolution instead of rendering
+                # at full DPI and downscaling afterwards
+                zoom = min(dpi / 72, OCR_MAX_DIMENSION / max(page.rect.width, page.rect.height))
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
                 
                 # Convert to PIL Image
                 img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
@@ -145,9 +155,29 @@ class DocumentVisionOCR:
             return results
             
         except Exception as e:
-            logging.error(f"PDF Processing Error: {e}")
+            logger.error("PDF Processing Error: %s", e)
             return None
             
+    def extract_text_from_pages(self, base64_pages, prompt=None,
+                                separator="\n\n--- Page {page_num} ---\n\n"):
+        """
+        Extract text from pre-rendered PDF pages and return as a single string
+        
+        Args:
+            base64_pages (list): Base64 JPEG per page, in page order
+            prompt (str, optional): Custom prompt for the vision model
+            separator (str): Text to insert between pages
+            
+        Returns:
+            str: Extracted text from all pages
+        """
+        combined_text = ""
+        for page_num, base64_image in enumerate(base64_pages, start=1):
+            page_prompt = prompt or f"Extract ALL text from page {page_num} of this document. Preserve formatting."
+            text = self.extract_text_from_base64(base64_image, prompt=page_prompt)
+            combined_text += separator.format(page_num=page_num) + (text or "")
+        return combined_text or None
+
     def extract_text_from_pdf_to_string(self, pdf_path, dpi=300, prompt=None, 
                                         separator="\n\n--- Page {page_num} ---\n\n"):
         """
@@ -189,7 +219,7 @@ class DocumentVisionOCR:
         """
         file_path = Path(file_path)
         if not file_path.exists():
-            logging.error(f"File not found: {file_path}")
+            logger.error("File not found: %s", file_path)
             return None
             
         # Determine file type
@@ -197,17 +227,17 @@ class DocumentVisionOCR:
         
         if mime_type and mime_type.startswith('image/'):
             # Handle image file
-            logging.info(f"Processing image file: {file_path}")
-            image = Image.open(file_path)
+            logger.info("Processing image file: %s", file_path)
+            image = preprocess_image(file_path, grayscale=False, sharpen=False)
             return self.extract_text_from_image(image, prompt)
             
         elif mime_type == 'application/pdf':
             # Handle PDF file
-            logging.info(f"Processing PDF file: {file_path}")
+            logger.info("Processing PDF file: %s", file_path)
             return self.extract_text_from_pdf(file_path, dpi, prompt)
             
         else:
-            logging.error(f"Unsupported file type: {mime_type}")
+            logger.error("Unsupported file type: %s", mime_type)
             return None
             
     def extract_text_to_string(self, file_path, dpi=300, prompt=None, 
@@ -226,7 +256,7 @@ class DocumentVisionOCR:
         """
         file_path = Path(file_path)
         if not file_path.exists():
-            logging.error(f"File not found: {file_path}")
+            logger.error("File not found: %s", file_path)
             return None
             
         # Determine file types
@@ -234,16 +264,16 @@ class DocumentVisionOCR:
         
         if mime_type and mime_type.startswith('image/'):
             # Handle image file
-            logging.info(f"Processing image file: {file_path}")
-            image = Image.open(file_path)
+            logger.info("Processing image file: %s", file_path)
+            image = preprocess_image(file_path, grayscale=False, sharpen=False)
             return self.extract_text_from_image(image, prompt)
             
         elif mime_type == 'application/pdf':
             # Handle PDF files
-            logging.info(f"Processing PDF file: {file_path}")
+            logger.info("Processing PDF file: %s", file_path)
             return self.extract_text_from_pdf_to_string(file_path, dpi, prompt, separator)
             
         else:
-            logging.error(f"Unsupported file type: {mime_type}")
+            logger.error("Unsupported file type: %s", mime_type)
             return None
         
\ No newline at end of file
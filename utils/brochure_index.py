@@ -0,0 +1,219 @@
+import argparse
+import json
+import logging
+import os
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .qa_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Offline search index over plan brochures (PDF). Benefit tables become one
+# chunk per row ("benefit: value"); the remaining text is split into
+# overlapping word windows. Chunks are scored with BM25, and the postings are
+# stored as flat numpy arrays that are memory-mapped at load time, so a lookup
+# is a few array slices with no model call. Build with:
+#
+#   python -m utils.brochure_index "documents/Silver-AD 20% (160623) (6) (2).pdf" --title Silver-AD
+
+INDEX_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+CHUNK_WORDS = 80
+CHUNK_OVERLAP = 20
+
+# Question filler, and words every chunk of a single-plan brochure is about
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for from i if in is it its me my of "
+    "on or the this to up what with will you your insurance plan policy "
+    "takaful emarat silver".split()
+)
+
+
+def _clean(text: str) -> str:
+    # NFKC turns the brochure's ligatures ("ﬁ") into plain letters
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def index_terms(text: str) -> List[str]:
+    terms = []
+    for token in tokenize(_clean(text)):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+def _outside(block_rect, table_rects) -> bool:
+    return not any(block_rect.intersects(rect) for rect in table_rects)
+
+
+def extract_chunks(pdf_path: str) -> List[Dict]:
+    """Text and table chunks of a PDF, each with its 1-based page number"""
+    import fitz  # PyMuPDF
+
+    chunks = []
+    with fitz.open(pdf_path) as document:
+        for page_number, page in enumerate(document, start=1):
+            tables = page.find_tables().tables
+            for table in tables:
+                for row in table.extract():
+                    cells = [_clean(cell) for cell in row if cell and _clean(cell)]
+                    if len(cells) >= 2:
+                        chunks.append({
+                            "text": f"{cells[0].rstrip(':')}: {' | '.join(cells[1:])}",
+                            "page": page_number,
+                            "kind": "table",
+                        })
+
+            table_rects = [fitz.Rect(table.bbox) for table in tables]
+            words = []
+            for block in page.get_text("blocks"):
+                if block[6] == 0 and _outside(fitz.Rect(block[:4]), table_rects):
+                    words += _clean(block[4]).split()
+            step = CHUNK_WORDS - CHUNK_OVERLAP
+            for start in range(0, len(words), step):
+                window = words[start : start + CHUNK_WORDS]
+                if len(window) >= 5:
+                    chunks.append({
+                        "text": " ".join(window),
+                        "page": page_number,
+                        "kind": "text",
+                    })
+                if start + CHUNK_WORDS >= len(words):
+                    break
+    return chunks
+
+
+def build_index(chunks: List[Dict], output_dir: str, title: str, source: str):
+    """Write BM25 postings (CSR layout) and chunk metadata to output_dir"""
+    doc_terms = [index_terms(chunk["text"]) for chunk in chunks]
+    vocabulary = sorted({term for terms in doc_terms for term in terms})
+    term_ids = {term: i for i, term in enumerate(vocabulary)}
+
+    postings = [[] for _ in vocabulary]
+    for doc_id, terms in enumerate(doc_terms):
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            postings[term_ids[term]].append((doc_id, count))
+
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in postings])
+    doc_ids = np.array([d for p in postings for d, _ in p], dtype=np.int32)
+    term_freqs = np.array([c for p in postings for _, c in p], dtype=np.float32)
+    doc_lengths = np.array([len(terms) for terms in doc_terms], dtype=np.float32)
+    n_docs = len(chunks)
+    doc_freqs = np.diff(offsets).astype(np.float32)
+    idf = np.log(1 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(output_dir, "doc_ids.npy"), doc_ids)
+    np.save(os.path.join(output_dir, "term_freqs.npy"), term_freqs)
+    np.save(os.path.join(output_dir, "doc_lengths.npy"), doc_lengths)
+    np.save(os.path.join(output_dir, "idf.npy"), idf)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": INDEX_VERSION,
+                "title": title,
+                "source": source,
+                "vocabulary": vocabulary,
+                "chunks": chunks,
+            },
+            f,
+            ensure_ascii=False,
+            indent=1,
+        )
+
+
+class BrochureIndex:
+    """Memory-mapped BM25 index written by build_index"""
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported brochure index version in {index_dir}")
+        self.title = meta["title"]
+        self.source = meta["source"]
+        self.chunks = meta["chunks"]
+        self.term_ids = {term: i for i, term in enumerate(meta["vocabulary"])}
+
+        def load(name):
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.offsets = load("offsets")
+        self.doc_ids = load("doc_ids")
+        self.term_freqs = load("term_freqs")
+        self.doc_lengths = load("doc_lengths")
+        self.idf = load("idf")
+        self.avg_length = float(np.mean(self.doc_lengths)) if len(self.chunks) else 0.0
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict]:
+        """Best chunks for the query, each with its BM25 score and page"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doc_lengths) / self.avg_length)
+        for term in set(index_terms(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm[docs])
+
+        hits = []
+        for doc_id in np.argsort(-scores)[:top_k]:
+            if scores[doc_id] <= 0:
+                break
+            hits.append({**self.chunks[doc_id], "score": float(scores[doc_id])})
+        return hits
+
+    def citation(self, hit: Dict) -> str:
+        return f"{self.title} brochure, page {hit['page']}"
+
+
+def load_index(index_dir: str) -> Optional[BrochureIndex]:
+    if not os.path.exists(os.path.join(index_dir, "meta.json")):
+        logger.warning("No brochure index at %s; run python -m utils.brochure_index", index_dir)
+        return None
+    try:
+        return BrochureIndex(index_dir)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Could not load brochure index from %s: %s", index_dir, e)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a plan brochure PDF for local search")
+    parser.add_argument("pdf")
+    parser.add_argument("--title", help="Plan name used in citations (default: file name)")
+    parser.add_argument("--output", default=None, help="Index directory")
+    parser.add_argument("--query", help="Run a test query against the new index")
+    args = parser.parse_args()
+
+    from config.settings import BROCHURE_INDEX_DIR
+
+    title = args.title or os.path.splitext(os.path.basename(args.pdf))[0]
+    output_dir = args.output or BROCHURE_INDEX_DIR
+    chunks = extract_chunks(args.pdf)
+    build_index(chunks, output_dir, title, os.path.basename(args.pdf))
+    tables = sum(1 for chunk in chunks if chunk["kind"] == "table")
+    print(f"Indexed {len(chunks)} chunks ({tables} table rows) into {output_dir}")
+
+    if args.query:
+        index = BrochureIndex(output_dir)
+        for hit in index.search(args.query):
+            print(f"{hit['score']:.2f}  p{hit['page']}  {hit['text'][:120]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from config.settings import CPU_POOL_MAX_PENDING, CPU_POOL_WORKERS
+from .metrics import CPU_JOB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Process pool for CPU-bound document work (PIL encode, PyMuPDF rendering).
+# Jobs are submitted with raw bytes so workers never touch the filesystem, and
+# at most CPU_POOL_MAX_PENDING jobs are in flight; the rest wait on the event
+# loop without blocking it. A worker that dies (OOM on a huge image, a
+# PyMuPDF crash, a killed ffmpeg) breaks the whole pool; it is then replaced
+# and the job retried once.
+CPU_POOL_STATS = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "waiting": 0,
+    "in_flight": 0,
+    "queue_time_total": 0.0,
+    "queue_time_max": 0.0,
+    "run_time_total": 0.0,
+    "pool_restarts": 0,
+}
+
+_executor = None
+_semaphore = None
+
+
+def get_cpu_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn avoids forking the threads uvicorn and the HTTP clients started
+        _executor = ProcessPoolExecutor(
+            max_workers=CPU_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info("Started CPU pool with %s workers", CPU_POOL_WORKERS)
+    return _executor
+
+
+def _replace_broken_executor(broken: ProcessPoolExecutor):
+    """Drop a pool whose worker died; the next job starts a new one"""
+    global _executor
+    # Concurrent jobs all see the same broken pool; replace it only once
+    if _executor is broken:
+        _executor = None
+        CPU_POOL_STATS["pool_restarts"] += 1
+        logger.error("CPU pool worker died; restarting the pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(CPU_POOL_MAX_PENDING)
+    return _semaphore
+
+
+def _timed_call(fn: Callable, submitted_at: float, args: tuple):
+    """Runs inside the worker: report how long the job sat in the executor queue"""
+    started_at = time.time()
+    result = fn(*args)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+async def run_cpu_bound(fn: Callable, *args) -> Any:
+    """
+    Run a picklable top-level function in the CPU pool
+
+    Args:
+        fn: Module-level function to execute in a worker process
+        *args: Picklable arguments (pass bytes, not file paths)
+
+    Returns:
+        The function's return value
+    """
+    CPU_POOL_STATS["submitted"] += 1
+    CPU_POOL_STATS["waiting"] += 1
+    admitted = False
+    wait_start = time.monotonic()
+    try:
+        async with _get_semaphore():
+            admitted = True
+            admission_wait = time.monotonic() - wait_start
+            CPU_POOL_STATS["waiting"] -= 1
+            CPU_POOL_STATS["in_flight"] += 1
+            try:
+                loop = asyncio.get_running_loop()
+                for attempt in range(2):
+                    executor = get_cpu_executor()
+                    try:
+                        result, executor_wait, run_time = await loop.run_in_executor(
+                            executor, _timed_call, fn, time.time(), args
+                        )
+                        break
+                    except BrokenProcessPool:
+                        _replace_broken_executor(executor)
+                        if attempt:
+                            raise
+            finally:
+                CPU_POOL_STATS["in_flight"] -= 1
+    except Exception:
+        CPU_POOL_STATS["failed"] += 1
+        raise
+    finally:
+        if not admitted:
+            CPU_POOL_STATS["waiting"] -= 1
+
+    queue_time = admission_wait + max(executor_wait, 0.0)
+    CPU_POOL_STATS["completed"] += 1
+    CPU_POOL_STATS["queue_time_total"] += queue_time
+    CPU_POOL_STATS["queue_time_max"] = max(CPU_POOL_STATS["queue_time_max"], queue_time)
+    CPU_POOL_STATS["run_time_total"] += run_time
+    job = getattr(fn, "__name__", str(fn))
+    CPU_JOB_SECONDS.observe(queue_time, job=job, phase="queue")
+    CPU_JOB_SECONDS.observe(run_time, job=job, phase="run")
+    logger.info(
+        "CPU job %s queued %.0f ms, ran %.0f ms", job, queue_time * 1000, run_time * 1000
+    )
+    return result
+
+
+def shutdown_cpu_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,183 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from config.settings import (
+    EXTRACTION_CACHE_DIR,
+    EXTRACTION_CACHE_KEY,
+    EXTRACTION_CACHE_MAX_ENTRIES,
+    EXTRACTION_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def document_sha256(document_data: bytes) -> str:
+    return hashlib.sha256(document_data).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache of validated document extraction results keyed by upload content
+
+    Keys combine the SHA-256 of the uploaded bytes with the document type and
+    the prompt version, so a prompt change never serves stale results. Entries
+    live in an in-memory LRU with a TTL. When a directory and a Fernet key are
+    configured, entries are also written to disk encrypted, so extracted PII
+    never touches the filesystem in plain text.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = EXTRACTION_CACHE_TTL,
+        persist_dir: Optional[str] = EXTRACTION_CACHE_DIR,
+        encryption_key: Optional[str] = EXTRACTION_CACHE_KEY,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "purged": 0}
+
+        self._fernet = None
+        self._persist_dir = None
+        if persist_dir:
+            if not encryption_key:
+                logger.warning(
+                    "EXTRACTION_CACHE_DIR is set without EXTRACTION_CACHE_KEY; "
+                    "extraction results will only be cached in memory"
+                )
+            else:
+                from cryptography.fernet import Fernet
+
+                self._fernet = Fernet(encryption_key)
+                self._persist_dir = Path(persist_dir)
+                self._persist_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(document_data: bytes, document_type: str, prompt_version) -> str:
+        return f"{document_sha256(document_data)}:{document_type}:v{prompt_version}"
+
+    def _path_for(self, key: str) -> Path:
+        # File names must not leak the raw content hash of a PII document
+        return self._persist_dir / (hashlib.sha256(key.encode()).hexdigest() + ".bin")
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if time.time() - stored_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return copy.deepcopy(value)
+            del self._entries[key]
+
+        value = self._load(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            self._remember(key, value)
+            return copy.deepcopy(value)
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Dict):
+        value = copy.deepcopy(value)
+        self._remember(key, value)
+        self._store(key, value)
+
+    def _remember(self, key: str, value: Dict):
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _load(self, key: str) -> Optional[Dict]:
+        if self._fernet is None:
+            return None
+        path = self._path_for(key)
+        if not path.exists():
+            return None
+        try:
+            # Fernet tokens carry their creation time, so the TTL is enforced
+            # by the decryption itself
+            payload = self._fernet.decrypt(path.read_bytes(), ttl=self.ttl_seconds)
+            record = json.loads(payload)
+            if record.get("key") != key:
+                return None
+            return record["value"]
+        except Exception as e:
+            logger.info("Discarding unreadable or expired cache entry: %s", e)
+            path.unlink(missing_ok=True)
+            return None
+
+    def _store(self, key: str, value: Dict):
+        if self._fernet is None:
+            return
+        try:
+            token = self._fernet.encrypt(
+                json.dumps({"key": key, "value": value}).encode("utf-8")
+            )
+            path = self._path_for(key)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(token)
+            os.chmod(tmp_path, 0o600)
+            tmp_path.replace(path)
+            self._evict_persisted()
+        except Exception as e:
+            logger.error("Failed to persist extraction cache entry: %s", e)
+
+    def _evict_persisted(self):
+        files = sorted(self._persist_dir.glob("*.bin"), key=lambda p: p.stat().st_mtime)
+        for path in files[: max(0, len(files) - self.max_entries)]:
+            path.unlink(missing_ok=True)
+            self.stats["evictions"] += 1
+
+    def purge(self, document_hash: Optional[str] = None) -> int:
+        """
+        Remove cached extractions
+
+        Args:
+            document_hash (str, optional): SHA-256 of an uploaded document. When
+                omitted, every entry (memory and disk) is removed.
+
+        Returns:
+            int: Number of entries removed
+        """
+        if document_hash:
+            keys = [key for key in self._entries if key.startswith(f"{document_hash}:")]
+        else:
+            keys = list(self._entries)
+        for key in keys:
+            del self._entries[key]
+        removed = len(keys)
+
+        if self._persist_dir is not None:
+            for path in self._persist_dir.glob("*.bin"):
+                if document_hash:
+                    if self._load_key(path).startswith(f"{document_hash}:"):
+                        path.unlink(missing_ok=True)
+                        removed += 1
+                else:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+
+        self.stats["purged"] += removed
+        return removed
+
+    def _load_key(self, path: Path) -> str:
+        try:
+            return json.loads(self._fernet.decrypt(path.read_bytes())).get("key", "")
+        except Exception:
+            return ""
+
+
+# Global instance
+extraction_cache = ExtractionCache()
@@ -1,7 +1,7 @@
+import asyncio
 import re
 import time
 import logging
-import re
 from typing import Dict, Any, Optional
 from fastapi import HTTPException
 from langchain_groq import ChatGroq
@@ -9,13 +9,23 @@ from langchain.chains import create_extraction_chain
 from langchain_core.messages import HumanMessage
 from langchain_core.pydantic_v1 import BaseModel, Field
 
-from PIL import Image,ImageFilter
 import os
 import io
 import base64
 import json
 
+from config.settings import CONVERSATION_HISTORY_MAX_TURNS
+from services.partner_api import PartnerAPIError, post_partner
 from .VisionModel import DocumentVisionOCR
+from .cpu_pool import run_cpu_bound
+from .metrics import OCR_STAGE_SECONDS, llm_callbacks
+from .tracing import span
+from .image_preprocessing import encode_image_job, render_pdf_job
+from .json_parsing import invalid_fields, parse_json_object
+
+logger = logging.getLogger(__name__)
+
+
 def is_thank_you(text: str) -> bool:
     thank_patterns = [r'thank(?:s| you)', r'thx', r'thnx', r'tysm', r'ty']
     text = text.lower()
@@ -30,48 +40,209 @@ def store_interaction(from_id: str, question: str, answer: str, user_states: dic
             "answer": answer,
             "timestamp": time.time()
         })
+        history = user_states[from_id]["conversation_history"]
+        if len(history) > CONVERSATION_HISTORY_MAX_TURNS:
+            del history[: len(history) - CONVERSATION_HISTORY_MAX_TURNS]
         
-# utils/helpers.py
-import requests
-
-def emaf_document(response_dict):
+async def emaf_document(response_dict):
     payload = {
         "name": response_dict.get("May I know your name, please?"),
         "network_id": response_dict.get("emaf_company_id"),
         "phone": response_dict.get("May I kindly ask for your phone number, please?"),
     }
-    emaf_api = "https://www.insuranceclub.ae/Api/emaf"
     try:
-        respond = requests.post(emaf_api, json=payload, timeout=10)
-        respond.raise_for_status()
-        emaf_id = respond.json()["id"]
+        respond = await post_partner("emaf", payload)
+        emaf_id = respond["id"]
         return emaf_id
-    except requests.RequestException as e:
-        print(f"Error calling EMAF API: {e}")
+    except (PartnerAPIError, KeyError, TypeError) as e:
+        logger.error("Error calling EMAF API: %s", e)
         return None
     
 
+# Bump a version whenever its OCR or extraction prompt changes so cached
+# results produced by the old prompt are no longer served (see
+# utils/extraction_cache.py)
+EXTRACTION_PROMPT_VERSIONS = {
+    "emirates_id": 2,
+    "driving_license": 2,
+    "mulkiya": 2,
+}
+
+
+async def _ocr_image(document_data: bytes, prompt: str) -> str:
+    """Encode the image in the CPU pool, then run the vision model off the event loop"""
+    with span("ocr_preprocess"), OCR_STAGE_SECONDS.time(stage="preprocess"):
+        base64_image = await run_cpu_bound(encode_image_job, document_data)
+    vision_model = DocumentVisionOCR()
+    loop = asyncio.get_running_loop()
+    with span("ocr_vision"), OCR_STAGE_SECONDS.time(stage="vision"):
+        return await loop.run_in_executor(
+            None, vision_model.extract_text_from_base64, base64_image, prompt
+        )
+
+
+async def _ocr_pdf(document_data: bytes, prompt: str) -> str:
+    """Rasterize the PDF in the CPU pool, then OCR the pages off the event loop"""
+    with span("ocr_preprocess", pdf=True), OCR_STAGE_SECONDS.time(stage="preprocess"):
+        base64_pages = await run_cpu_bound(render_pdf_job, document_data)
+    vision_model = DocumentVisionOCR()
+    loop = asyncio.get_running_loop()
+    with span("ocr_vision", pages=len(base64_pages)), OCR_STAGE_SECONDS.time(stage="vision"):
+        return await loop.run_in_executor(
+            None, vision_model.extract_text_from_pages, base64_pages, prompt
+        )
+
+
+
+_DATE = re.compile(r"\d{1,2}[-/.]\d{1,2}[-/.]\d{4}|\d{4}[-/.]\d{1,2}[-/.]\d{1,2}")
+_NUMBER = re.compile(r"\d+")
+
+# Fields each document yields, with the pattern a non-empty value must match
+# (None accepts any text). Values failing their pattern are re-asked once.
+DOCUMENT_SCHEMAS = {
+    "emirates_id": {
+        "name": None,
+        "id_number": re.compile(r"784-?\d{4}-?\d{7}-?\d"),
+        "date_of_birth": _DATE,
+        "nationality": None,
+        "issue_date": _DATE,
+        "expiry_date": _DATE,
+        "gender": re.compile(r"(?i)m|f|male|female"),
+        "card_number": re.compile(r"\d{8,10}"),
+        "occupation": None,
+        "employer": None,
+        "issuing_place": None,
+    },
+    "driving_license": {
+        "name": None,
+        "license_no": re.compile(r"[A-Za-z0-9/-]{3,20}"),
+        "date_of_birth": _DATE,
+        "nationality": None,
+        "issue_date": _DATE,
+        "expiry_date": _DATE,
+        "traffic_code_no": _NUMBER,
+        "place_of_issue": None,
+        "permitted_vehicles": None,
+    },
+    "mulkiya": {
+        "owner": None,
+        "traffic_plate_no": None,
+        "tc_no": _NUMBER,
+        "nationality": None,
+        "reg_date": _DATE,
+        "expiry_date": _DATE,
+        "ins_exp": _DATE,
+        "policy_no": None,
+        "place_of_issue": None,
+        "model_no": re.compile(r"(19|20)\d{2}"),
+        "number_of_pass": re.compile(r"\d{1,3}"),
+        "origin": None,
+        "vehicle_type": None,
+        "empty_weight": re.compile(r"(?i)\d+(\.\d+)?\s*(kg|kgs)?"),
+        "engine_no": None,
+        "chassis_no": re.compile(r"[A-Za-z0-9]{6,17}"),
+        "gvw": re.compile(r"(?i)\d+(\.\d+)?\s*(kg|kgs)?"),
+    },
+}
+
+DOCUMENT_LABELS = {
+    "emirates_id": "Emirates ID",
+    "driving_license": "Driving License",
+    "mulkiya": "vehicle registration card (Mulkiya)",
+}
+
+
+def _extraction_prompt(vision_text: str, document_type: str, fields) -> str:
+    json_format = json.dumps({field: "" for field in fields}, indent=4)
+    return f"""
+        Extract the following information from this {DOCUMENT_LABELS[document_type]}.
+        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
+
+        For dates, use format DD-MM-YYYY if possible.
+        For numbers and codes, preserve exact formatting including any special characters.
+        If a piece of information is not found, use an empty string.
+
+        Text to extract from:
+        {vision_text}
+
+        JSON format:
+        {json_format}
+
+        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
+        """
+
+
+async def _invoke_json(llm, prompt: str) -> Optional[Dict]:
+    """Ask for a JSON object, using the model's JSON mode when it is available"""
+    loop = asyncio.get_running_loop()
+    try:
+        json_llm = llm.bind(response_format={"type": "json_object"})
+        response = await loop.run_in_executor(None, json_llm.invoke, prompt)
+    except Exception as e:
+        logger.warning("JSON mode request failed, retrying without it: %s", e)
+        response = await loop.run_in_executor(None, llm.invoke, prompt)
+    return parse_json_object(response.content)
+
+
+def _clean_value(value) -> str:
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+async def _extract_document_fields(vision_text: str, document_type: str) -> Dict:
+    """
+    Turn OCR text into the document's fields and validate them
+
+    Fields that are missing from the answer or fail their pattern are asked
+    for again, once, from the same OCR text; valid fields are kept as is.
+    """
+    schema = DOCUMENT_SCHEMAS[document_type]
+    llm = ChatGroq(
+        model=os.getenv('LLM_MODEL'),
+        temperature=0,
+        api_key=os.getenv('GROQ_API_KEY'),
+        callbacks=llm_callbacks("extraction"),
+    )
+
+    with span("extract_fields", document_type=document_type), OCR_STAGE_SECONDS.time(stage="extraction"):
+        parsed = await _invoke_json(llm, _extraction_prompt(vision_text, document_type, schema))
+        logger.info("LLM extraction completed")
+        result = {field: _clean_value(value) for field, value in (parsed or {}).items() if field in schema}
+
+        failing = invalid_fields(result, schema)
+        if failing:
+            logger.info("Re-extracting %s fields: %s", document_type, failing)
+            try:
+                retried = await _invoke_json(llm, _extraction_prompt(vision_text, document_type, failing)) or {}
+            except Exception as e:
+                logger.warning("Field re-extraction failed: %s", e)
+                retried = {}
+            for field in failing:
+                value = _clean_value(retried.get(field))
+                # Keep an invalid first answer over an empty retry; the user can
+                # still correct it when confirming the details
+                if field not in result or (value and not invalid_fields({field: value}, schema, [field])):
+                    result[field] = value
+            still_failing = invalid_fields(result, schema)
+            if still_failing:
+                logger.warning("Fields still failing validation for %s: %s", document_type, still_failing)
+
+        # Ensure all expected keys are present, in schema order
+        return {field: result.get(field, "") for field in schema}
 
-async def extract_image_info1(file_path: str) -> Dict:
+
+async def extract_image_info1(document_data: bytes) -> Dict:
     """
     Extract information from  document and return as JSON
     
     Args:
-        file_path (str): Path to the image file
+        document_data (bytes): Raw bytes of the uploaded file
         
     Returns:
         Dict: Structured information extracted from the document
     """
     try:
-        # Preprocess the image
-        image = Image.open(file_path)
-        image = image.convert('L')  # Convert to grayscale
-        image = image.resize((image.width * 2, image.height * 2))  # Resize to improve OCR accuracy
-        image = image.filter(ImageFilter.SHARPEN)  # Sharpen the image to improve OCR accuracy
-        
-        # Extract text from JPG image
-        vision_model = DocumentVisionOCR()
-        
         # Create a specialized prompt for license documents
         license_prompt = """
         Extract ALL English text from this license.
@@ -92,121 +263,27 @@ async def extract_image_info1(file_path: str) -> Dict:
         If any mentioned information is missing, recheck and extract everything accurately.
         """
         
-        # Use the extract_text_from_image method with the preprocessed image
-        vision_text = vision_model.extract_text_from_image(image, prompt=license_prompt)
-        logging.info("Extracted text from license document")
-        
-        # Initialize LLM and create extraction chain
-        llm = ChatGroq(
-            model=os.getenv('LLM_MODEL'),
-            temperature=0,
-            api_key=os.getenv('GROQ_API_KEY')
-        )
-        
-        # Enhanced extraction prompt to ensure structured JSON output
-        extraction_prompt = f"""
-        Extract the following information from this document.
-        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
-        
-        For dates, use format DD-MM-YYYY if possible.
-        For numbers and codes, preserve exact formatting including any special characters.
-        If a piece of information is not found, use an empty string.
-        
-        Text to extract from:
-        {vision_text}
-        
-        JSON format:
-        {{
-                "name": "",
-                "id_number": "",
-                "date_of_birth": "",
-                "nationality": "",
-                "issue_date": "",
-                "expiry_date": "",
-                "gender": "",
-                "card_number": "",
-                "occupation": "",
-                "employer": "",
-                "issuing_place": "",
-            }}
-        
-        
-        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
-        """
-        
-        # Directly use the LLM to extract structured information
-        extraction_response = llm.invoke(extraction_prompt)
-        extracted_content = extraction_response.content
-        logging.info("LLM extraction completed")
-        
-        # Create default empty result structure
-        default_result = {
-                "name": "",
-                "id_number": "",
-                "date_of_birth": "",
-                "nationality": "",
-                "issue_date": "",
-                "expiry_date": "",
-                "gender": "",
-                "card_number": "",
-                "occupation": "",
-                "employer": "",
-                "issuing_place": "",
-            }
-        
-        # Try to parse the response as JSON
-        try:
-            # First, attempt to parse as a JSON string
-            result = json.loads(extracted_content)
-            logging.info("Successfully parsed JSON response")
-        except json.JSONDecodeError as e:
-            logging.warning(f"Direct JSON parsing failed: {e}")
-            try:
-                # Find JSON-like content between curly braces
-                start = extracted_content.find('{')
-                end = extracted_content.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    cleaned_content = extracted_content[start:end]
-                    # Replace potential newlines, tabs and fix common JSON format issues
-                    cleaned_content = cleaned_content.replace('\n', ' ').replace('\t', ' ')
-                    cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas
-                    
-                    result = json.loads(cleaned_content)
-                    logging.info("Successfully parsed JSON after cleaning")
-                else:
-                    raise ValueError("No valid JSON structure found")
-            except (ValueError, json.JSONDecodeError) as e:
-                logging.warning(f"JSON parsing failed: {e}. Creating empty structure.")
-                result = default_result
-        
-        # Ensure all expected keys are present in the result
-        for key in default_result:
-            if key not in result:
-                result[key] = ""
+        # Preprocess in the CPU pool and OCR with the vision model
+        vision_text = await _ocr_image(document_data, license_prompt)
+        logger.info("Extracted text from license document")
         
-        return result
+        return await _extract_document_fields(vision_text, "emirates_id")
     except Exception as e:
-        logging.error(f"Error in extract_image_driving_license: {e}")
+        logger.error("Error in extract_image_driving_license: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
-async def extract_pdf_info1(file_path: str) -> Dict:
+async def extract_pdf_info1(document_data: bytes) -> Dict:
     """
     Extract information from JPG License document and return as JSON
     
     Args:
-        file_path (str): Path to the image file
+        document_data (bytes): Raw bytes of the uploaded file
         
     Returns:
         Dict: Structured information extracted from the driving license document
     """
     try:
-        # Preprocess the image
-       
-        # Extract text from JPG image
-        vision_model = DocumentVisionOCR()
-        
         # Create a specialized prompt for license documents
         emirate_prompt = """
         Extract all English text from this license. 
@@ -230,126 +307,29 @@ async def extract_pdf_info1(file_path: str) -> Dict:
         """
 
         
-        # Use the extract_text_from_image method with the preprocessed image
-        vision_text = vision_model.extract_text_to_string(file_path, prompt=emirate_prompt)
-        logging.info("Extracted text from license document")
-        
-        # Initialize LLM and create extraction chain
-        llm = ChatGroq(
-            model=os.getenv('LLM_MODEL'),
-            temperature=0,
-            api_key=os.getenv('GROQ_API_KEY')
-        )
-        
-        # Enhanced extraction prompt to ensure structured JSON output
-        extraction_prompt = f"""
-        Extract the following information from this Emirate document
-        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
-        
-        For dates, use format DD-MM-YYYY if possible.
-        For numbers and codes, preserve exact formatting including any special characters.
-        If a piece of information is not found, use an empty string.
-        
-        Text to extract from:
-        {vision_text}
-        
-        JSON format:
-       {{
-                "name": "",
-                "id_number": "",
-                "date_of_birth": "",
-                "nationality": "",
-                "issue_date": "",
-                "expiry_date": "",
-                "gender": "",
-                "card_number": "",
-                "occupation": "",
-                "employer": "",
-                "issuing_place": "",
-            }}
-        
-        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
-        """
-        
-        # Directly use the LLM to extract structured information
-        extraction_response = llm.invoke(extraction_prompt)
-        extracted_content = extraction_response.content
-        logging.info("LLM extraction completed")
-        
-        # Create default empty result structure
-        default_result =  {
-                "name": "",
-                "id_number": "",
-                "date_of_birth": "",
-                "nationality": "",
-                "issue_date": "",
-                "expiry_date": "",
-                "gender": "",
-                "card_number": "",
-                "occupation": "",
-                "employer": "",
-                "issuing_place": "",
-            }
-        
-        # Try to parse the response as JSON
-        try:
-            # First, attempt to parse as a JSON string
-            result = json.loads(extracted_content)
-            logging.info("Successfully parsed JSON response")
-        except json.JSONDecodeError as e:
-            logging.warning(f"Direct JSON parsing failed: {e}")
-            try:
-                # Find JSON-like content between curly braces
-                start = extracted_content.find('{')
-                end = extracted_content.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    cleaned_content = extracted_content[start:end]
-                    # Replace potential newlines, tabs and fix common JSON format issues
-                    cleaned_content = cleaned_content.replace('\n', ' ').replace('\t', ' ')
-                    cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas
-                    
-                    result = json.loads(cleaned_content)
-                    logging.info("Successfully parsed JSON after cleaning")
-                else:
-                    raise ValueError("No valid JSON structure found")
-            except (ValueError, json.JSONDecodeError) as e:
-                logging.warning(f"JSON parsing failed: {e}. Creating empty structure.")
-                result = default_result
+        # Rasterize in the CPU pool and OCR each page with the vision model
+        vision_text = await _ocr_pdf(document_data, emirate_prompt)
+        logger.info("Extracted text from license document")
         
-        # Ensure all expected keys are present in the result
-        for key in default_result:
-            if key not in result:
-                result[key] = ""
-        
-        return result
+        return await _extract_document_fields(vision_text, "emirates_id")
     except Exception as e:
-        logging.error(f"Error in extract_image_driving_license: {e}")
+        logger.error("Error in extract_image_driving_license: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
 
 
-async def extract_image_driving_license(file_path: str) -> Dict:
+async def extract_image_driving_license(document_data: bytes) -> Dict:
     """
     Extract information from JPG License document and return as JSON
     
     Args:
-        file_path (str): Path to the image file
+        document_data (bytes): Raw bytes of the uploaded file
         
     Returns:
         Dict: Structured information extracted from the driving license document
     """
     try:
-        # Preprocess the image
-        image = Image.open(file_path)
-        image = image.convert('L')  # Convert to grayscale
-        image = image.resize((image.width * 2, image.height * 2))  # Resize to improve OCR accuracy
-        image = image.filter(ImageFilter.SHARPEN)  # Sharpen the image to improve OCR accuracy
-        
-        # Extract text from JPG image
-        vision_model = DocumentVisionOCR()
-        
         # Create a specialized prompt for license documents
         license_prompt = """
         Extract ALL English text from this license.
@@ -368,97 +348,13 @@ async def extract_image_driving_license(file_path: str) -> Dict:
         If any mentioned information is missing, recheck and extract everything accurately.
         """
         
-        # Use the extract_text_from_image method with the preprocessed image
-        vision_text = vision_model.extract_text_from_image(image, prompt=license_prompt)
-        logging.info("Extracted text from license document")
-        
-        # Initialize LLM and create extraction chain
-        llm = ChatGroq(
-            model=os.getenv('LLM_MODEL'),
-            temperature=0,
-            api_key=os.getenv('GROQ_API_KEY')
-        )
-        
-        # Enhanced extraction prompt to ensure structured JSON output
-        extraction_prompt = f"""
-        Extract the following information from this Driving License.
-        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
-        
-        For dates, use format DD-MM-YYYY if possible.
-        For numbers and codes, preserve exact formatting including any special characters.
-        If a piece of information is not found, use an empty string.
-        
-        Text to extract from:
-        {vision_text}
-        
-        JSON format:
-        {{
-            "name": "",
-            "license_no": "",
-            "date_of_birth": "",
-            "nationality": "",
-            "issue_date": "",
-            "expiry_date": "",
-            "traffic_code_no": "",
-            "place_of_issue": "",
-            "permitted_vehicles": ""
-        }}
-        
-        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
-        """
-        
-        # Directly use the LLM to extract structured information
-        extraction_response = llm.invoke(extraction_prompt)
-        extracted_content = extraction_response.content
-        logging.info("LLM extraction completed")
-        
-        # Create default empty result structure
-        default_result = {
-            "name": "",
-            "license_no": "",
-            "date_of_birth": "",
-            "nationality": "",
-            "issue_date": "",
-            "expiry_date": "",
-            "traffic_code_no": "",
-            "place_of_issue": "",
-            "permitted_vehicles": ""
-        }
-        
-        # Try to parse the response as JSON
-        try:
-            # First, attempt to parse as a JSON string
-            result = json.loads(extracted_content)
-            logging.info("Successfully parsed JSON response")
-        except json.JSONDecodeError as e:
-            logging.warning(f"Direct JSON parsing failed: {e}")
-            try:
-                # Find JSON-like content between curly braces
-                start = extracted_content.find('{')
-                end = extracted_content.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    cleaned_content = extracted_content[start:end]
-                    # Replace potential newlines, tabs and fix common JSON format issues
-                    cleaned_content = cleaned_content.replace('\n', ' ').replace('\t', ' ')
-                    cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas
-                    
-                    result = json.loads(cleaned_content)
-                    logging.info("Successfully parsed JSON after cleaning")
-                else:
-                    raise ValueError("No valid JSON structure found")
-            except (ValueError, json.JSONDecodeError) as e:
-                logging.warning(f"JSON parsing failed: {e}. Creating empty structure.")
-                result = default_result
-        
-        # Ensure all expected keys are present in the result
-        for key in default_result:
-            if key not in result:
-                result[key] = ""
+        # Preprocess in the CPU pool and OCR with the vision model
+        vision_text = await _ocr_image(document_data, license_prompt)
+        logger.info("Extracted text from license document")
         
-        return result
+        return await _extract_document_fields(vision_text, "driving_license")
     except Exception as e:
-        logging.error(f"Error in extract_image_driving_license: {e}")
+        logger.error("Error in extract_image_driving_license: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
     
     
@@ -466,22 +362,17 @@ async def extract_image_driving_license(file_path: str) -> Dict:
     
 
 #Todo
-async def extract_pdf_driving_license(file_path: str) -> Dict:
+async def extract_pdf_driving_license(document_data: bytes) -> Dict:
     """
     Extract information from JPG License document and return as JSON
     
     Args:
-        file_path (str): Path to the image file
+        document_data (bytes): Raw bytes of the uploaded file
         
     Returns:
         Dict: Structured information extracted from the driving license document
     """
     try:
-        # Preprocess the image
-       
-        # Extract text from JPG image
-        vision_model = DocumentVisionOCR()
-        
         # Create a specialized prompt for license documents
         license_prompt = """
         Extract ALL English text from this license.
@@ -501,97 +392,13 @@ async def extract_pdf_driving_license(file_path: str) -> Dict:
         If any mentioned information is missing, recheck and extract everything accurately.
         """
         
-        # Use the extract_text_from_image method with the preprocessed image
-        vision_text = vision_model.extract_text_to_string(file_path, prompt=license_prompt)
-        logging.info("Extracted text from license document")
-        
-        # Initialize LLM and create extraction chain
-        llm = ChatGroq(
-            model=os.getenv('LLM_MODEL'),
-            temperature=0,
-            api_key=os.getenv('GROQ_API_KEY')
-        )
-        
-        # Enhanced extraction prompt to ensure structured JSON output
-        extraction_prompt = f"""
-        Extract the following information from this Driving License.
-        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
-        
-        For dates, use format DD-MM-YYYY if possible.
-        For numbers and codes, preserve exact formatting including any special characters.
-        If a piece of information is not found, use an empty string.
-        
-        Text to extract from:
-        {vision_text}
-        
-        JSON format:
-        {{
-            "name": "",
-            "license_no": "",
-            "date_of_birth": "",
-            "nationality": "",
-            "issue_date": "",
-            "expiry_date": "",
-            "traffic_code_no": "",
-            "place_of_issue": "",
-            "permitted_vehicles": ""
-        }}
-        
-        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
-        """
-        
-        # Directly use the LLM to extract structured information
-        extraction_response = llm.invoke(extraction_prompt)
-        extracted_content = extraction_response.content
-        logging.info("LLM extraction completed")
-        
-        # Create default empty result structure
-        default_result = {
-            "name": "",
-            "license_no": "",
-            "date_of_birth": "",
-            "nationality": "",
-            "issue_date": "",
-            "expiry_date": "",
-            "traffic_code_no": "",
-            "place_of_issue": "",
-            "permitted_vehicles": ""
-        }
-        
-        # Try to parse the response as JSON
-        try:
-            # First, attempt to parse as a JSON string
-            result = json.loads(extracted_content)
-            logging.info("Successfully parsed JSON response")
-        except json.JSONDecodeError as e:
-            logging.warning(f"Direct JSON parsing failed: {e}")
-            try:
-                # Find JSON-like content between curly braces
-                start = extracted_content.find('{')
-                end = extracted_content.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    cleaned_content = extracted_content[start:end]
-                    # Replace potential newlines, tabs and fix common JSON format issues
-                    cleaned_content = cleaned_content.replace('\n', ' ').replace('\t', ' ')
-                    cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas
-                    
-                    result = json.loads(cleaned_content)
-                    logging.info("Successfully parsed JSON after cleaning")
-                else:
-                    raise ValueError("No valid JSON structure found")
-            except (ValueError, json.JSONDecodeError) as e:
-                logging.warning(f"JSON parsing failed: {e}. Creating empty structure.")
-                result = default_result
-        
-        # Ensure all expected keys are present in the result
-        for key in default_result:
-            if key not in result:
-                result[key] = ""
+        # Rasterize in the CPU pool and OCR each page with the vision model
+        vision_text = await _ocr_pdf(document_data, license_prompt)
+        logger.info("Extracted text from license document")
         
-        return result
+        return await _extract_document_fields(vision_text, "driving_license")
     except Exception as e:
-        logging.error(f"Error in extract_image_driving_license: {e}")
+        logger.error("Error in extract_image_driving_license: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
     
     
@@ -604,26 +411,17 @@ async def extract_pdf_driving_license(file_path: str) -> Dict:
 
 
 #Todo Mulkiya
-async def extract_image_mulkiya(file_path: str) -> Dict:
+async def extract_image_mulkiya(document_data: bytes) -> Dict:
     """
     Extract information from JPG License document and return as JSON
     
     Args:
-        file_path (str): Path to the image file
+        document_data (bytes): Raw bytes of the uploaded file
         
     Returns:
         Dict: Structured information extracted from the driving license document
     """
     try:
-        # Preprocess the image
-        image = Image.open(file_path)
-        image = image.convert('L')  # Convert to grayscale
-        image = image.resize((image.width * 2, image.height * 2))  # Resize to improve OCR accuracy
-        image = image.filter(ImageFilter.SHARPEN)  # Sharpen the image to improve OCR accuracy
-        
-        # Extract text from JPG image
-        vision_model = DocumentVisionOCR()
-        
         # Create a specialized prompt for license documents
         license_prompt = """
         Extract ALL English text from this driving license or mulkiya.
@@ -651,112 +449,13 @@ async def extract_image_mulkiya(file_path: str) -> Dict:
         If any mentioned information is missing, recheck and extract everything accurately.
         """
         
-        # Use the extract_text_from_image method with the preprocessed image
-        vision_text = vision_model.extract_text_from_image(image, prompt=license_prompt)
-        logging.info("Extracted text from license document")
-        
-        # Initialize LLM and create extraction chain
-        llm = ChatGroq(
-            model=os.getenv('LLM_MODEL'),
-            temperature=0,
-            api_key=os.getenv('GROQ_API_KEY')
-        )
-        
-        # Enhanced extraction prompt to ensure structured JSON output
-        extraction_prompt = f"""
-        Extract the following information from this Driving License.
-        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
-        
-        For dates, use format DD-MM-YYYY if possible.
-        For numbers and codes, preserve exact formatting including any special characters.
-        If a piece of information is not found, use an empty string.
-        
-        Text to extract from:
-        {vision_text}
-        
-        JSON format:
-        {{
-            "owner": "",
-         "traffic_plate_no": "",
-        "tc_no": "",
-        "nationality": "",
-         "reg_date": "",
-         "expiry_date": "",
-         "ins_exp": "",
-         "policy_no": "",
-        "place_of_issue": "",
-        "model_no": "",
-        "number_of_pass": "",
-         "origin": "",
-         "vehicle_type": "",
-         "empty_weight": "",
-         "engine_no": "",
-         "chassis_no": ""
-         "gvw": "",
-        }}
-        
-        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
-        """
-        
-        # Directly use the LLM to extract structured information
-        extraction_response = llm.invoke(extraction_prompt)
-        extracted_content = extraction_response.content
-        logging.info("LLM extraction completed")
-        
-        # Create default empty result structure
-        default_result = {
-            "owner": "",
-         "traffic_plate_no": "",
-        "tc_no": "",
-        "nationality": "",
-         "reg_date": "",
-         "expiry_date": "",
-         "ins_exp": "",
-         "policy_no": "",
-        "place_of_issue": "",
-        "model_no": "",
-        "number_of_pass": "",
-         "origin": "",
-         "vehicle_type": "",
-         "empty_weight": "",
-         "engine_no": "",
-         "chassis_no": ""
-        }
-        
-        # Try to parse the response as JSON
-        try:
-            # First, attempt to parse as a JSON string
-            result = json.loads(extracted_content)
-            logging.info("Successfully parsed JSON response")
-        except json.JSONDecodeError as e:
-            logging.warning(f"Direct JSON parsing failed: {e}")
-            try:
-                # Find JSON-like content between curly braces
-                start = extracted_content.find('{')
-                end = extracted_content.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    cleaned_content = extracted_content[start:end]
-                    # Replace potential newlines, tabs and fix common JSON format issues
-                    cleaned_content = cleaned_content.replace('\n', ' ').replace('\t', ' ')
-                    cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas
-                    
-                    result = json.loads(cleaned_content)
-                    logging.info("Successfully parsed JSON after cleaning")
-                else:
-                    raise ValueError("No valid JSON structure found")
-            except (ValueError, json.JSONDecodeError) as e:
-                logging.warning(f"JSON parsing failed: {e}. Creating empty structure.")
-                result = default_result
-        
-        # Ensure all expected keys are present in the result
-        for key in default_result:
-            if key not in result:
-                result[key] = ""
+        # Preprocess in the CPU pool and OCR with the vision model
+        vision_text = await _ocr_image(document_data, license_prompt)
+        logger.info("Extracted text from license document")
         
-        return result
+        return await _extract_document_fields(vision_text, "mulkiya")
     except Exception as e:
-        logging.error(f"Error in extract_image_driving_license: {e}")
+        logger.error("Error in extract_image_driving_license: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
     
     
@@ -765,22 +464,17 @@ async def extract_image_mulkiya(file_path: str) -> Dict:
     
 
 
-async def extract_pdf_mulkiya(file_path: str) -> Dict:
+async def extract_pdf_mulkiya(document_data: bytes) -> Dict:
     """
     Extract information from JPG License document and return as JSON
     
     Args:
-        file_path (str): Path to the image file
+        document_data (bytes): Raw bytes of the uploaded file
         
     Returns:
         Dict: Structured information extracted from the driving license document
     """
     try:
-        # Preprocess the image
-       
-        # Extract text from JPG image
-        vision_model = DocumentVisionOCR()
-        
         # Create a specialized prompt for license documents
         mulkiya_prompt = """
         Extract ALL English text from this driving license or mulkiya.
@@ -808,111 +502,12 @@ async def extract_pdf_mulkiya(file_path: str) -> Dict:
         If any mentioned information is missing, recheck and extract everything accurately.
         """
         
-        # Use the extract_text_from_image method with the preprocessed image
-        vision_text = vision_model.extract_text_to_string(file_path, prompt=mulkiya_prompt)
-        logging.info("Extracted text from license document")
-        
-        # Initialize LLM and create extraction chain
-        llm = ChatGroq(
-            model=os.getenv('LLM_MODEL'),
-            temperature=0,
-            api_key=os.getenv('GROQ_API_KEY')
-        )
-        
-        # Enhanced extraction prompt to ensure structured JSON output
-        extraction_prompt = f"""
-        Extract the following information from this Driving License.
-        Respond with ONLY a valid JSON object - no explanations, no markdown formatting.
-        
-        For dates, use format DD-MM-YYYY if possible.
-        For numbers and codes, preserve exact formatting including any special characters.
-        If a piece of information is not found, use an empty string.
-        
-        Text to extract from:
-        {vision_text}
-        
-        JSON format:
-        {{
-            "owner": "",
-         "traffic_plate_no": "",
-        "tc_no": "",
-        "nationality": "",
-         "reg_date": "",
-         "expiry_date": "",
-         "ins_exp": "",
-         "policy_no": "",
-        "place_of_issue": "",
-        "model_no": "",
-        "number_of_pass": "",
-         "origin": "",
-         "vehicle_type": "",
-         "empty_weight": "",
-         "engine_no": "",
-         "chassis_no": ""
-         "gvw": "",
-        }}
-        
-        IMPORTANT: Return ONLY the JSON object with no additional text, code blocks, or explanations.
-        """
-        
-        # Directly use the LLM to extract structured information
-        extraction_response = llm.invoke(extraction_prompt)
-        extracted_content = extraction_response.content
-        logging.info("LLM extraction completed")
-        
-        # Create default empty result structure
-        default_result = {
-            "owner": "",
-         "traffic_plate_no": "",
-        "tc_no": "",
-        "nationality": "",
-         "reg_date": "",
-         "expiry_date": "",
-         "ins_exp": "",
-         "policy_no": "",
-        "place_of_issue": "",
-        "model_no": "",
-        "number_of_pass": "",
-         "origin": "",
-         "vehicle_type": "",
-         "empty_weight": "",
-         "engine_no": "",
-         "chassis_no": ""
-        }
-        
-        # Try to parse the response as JSON
-        try:
-            # First, attempt to parse as a JSON string
-            result = json.loads(extracted_content)
-            logging.info("Successfully parsed JSON response")
-        except json.JSONDecodeError as e:
-            logging.warning(f"Direct JSON parsing failed: {e}")
-            try:
-                # Find JSON-like content between curly braces
-                start = extracted_content.find('{')
-                end = extracted_content.rfind('}') + 1
-                
-                if start >= 0 and end > start:
-                    cleaned_content = extracted_content[start:end]
-                    # Replace potential newlines, tabs and fix common JSON format issues
-                    cleaned_content = cleaned_content.replace('\n', ' ').replace('\t', ' ')
-                    cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas
-                    
-                    result = json.loads(cleaned_content)
-                    logging.info("Successfully parsed JSON after cleaning")
-                else:
-                    raise ValueError("No valid JSON structure found")
-            except (ValueError, json.JSONDecodeError) as e:
-                logging.warning(f"JSON parsing failed: {e}. Creating empty structure.")
-                result = default_result
-        
-        # Ensure all expected keys are present in the result
-        for key in default_result:
-            if key not in result:
-                result[key] = ""
+        # Rasterize in the CPU pool and OCR each page with the vision model
+        vision_text = await _ocr_pdf(document_data, mulkiya_prompt)
+        logger.info("Extracted text from license document")
         
-        return result
+        return await _extract_document_fields(vision_text, "mulkiya")
     except Exception as e:
-        logging.error(f"Error in extract_image_driving_license: {e}")
+        logger.error("Error in extract_image_driving_license: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
     
\ No newline at end of file
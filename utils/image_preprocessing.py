@@ -0,0 +1,194 @@
+import base64
+import io
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple, Union
+
+from PIL import Image, ImageFilter, ImageOps
+import fitz  # PyMuPDF for PDF rasterization
+
+from config.settings import (
+    OCR_GRAYSCALE,
+    OCR_JPEG_QUALITY,
+    OCR_MAX_DIMENSION,
+    OCR_MIN_DIMENSION,
+    OCR_PDF_DPI,
+    OCR_SHARPEN,
+)
+
+ImageSource = Union[str, Path, bytes, Image.Image]
+
+
+def fitted_size(
+    size: Tuple[int, int],
+    max_dimension: int = OCR_MAX_DIMENSION,
+    min_dimension: int = OCR_MIN_DIMENSION,
+) -> Tuple[int, int]:
+    """
+    Compute the aspect-preserving size that fits the vision model resolution
+
+    Images larger than max_dimension are scaled down so the longest side equals
+    max_dimension; very small images are scaled up to min_dimension so the
+    model still sees legible characters. Everything in between is untouched.
+    """
+    width, height = size
+    longest = max(width, height)
+    if longest > max_dimension:
+        scale = max_dimension / longest
+    elif 0 < longest < min_dimension:
+        scale = min_dimension / longest
+    else:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def fit_image(
+    image: Image.Image,
+    max_dimension: int = OCR_MAX_DIMENSION,
+    min_dimension: int = OCR_MIN_DIMENSION,
+) -> Image.Image:
+    """Resize an image to the fitted size, returning it unchanged if it already fits"""
+    target = fitted_size(image.size, max_dimension, min_dimension)
+    if target == image.size:
+        return image
+    return image.resize(target, Image.LANCZOS)
+
+
+def _open_image(source: ImageSource) -> Image.Image:
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def preprocess_image(
+    source: ImageSource,
+    max_dimension: int = OCR_MAX_DIMENSION,
+    min_dimension: int = OCR_MIN_DIMENSION,
+    grayscale: bool = OCR_GRAYSCALE,
+    sharpen: bool = OCR_SHARPEN,
+) -> Image.Image:
+    """
+    Prepare an uploaded document image for the vision model
+
+    Args:
+        source: File path, raw bytes or an already opened PIL image
+        max_dimension (int): Longest side allowed for the model input
+        min_dimension (int): Longest side small images are upscaled to
+        grayscale (bool): Convert to 8-bit grayscale
+        sharpen (bool): Apply a sharpen filter after resizing
+
+    Returns:
+        PIL.Image: Oriented, resized image ready to be encoded once
+    """
+    image = _open_image(source)
+    mode = "L" if grayscale else "RGB"
+
+    # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding so large
+    # phone photos are never fully decompressed. EXIF orientation may swap the
+    # axes afterwards, so ask for the fitted size of the longest side squared.
+    if image.format == "JPEG":
+        target = fitted_size(image.size, max_dimension, min_dimension)
+        longest = max(target)
+        image.draft(mode, (longest, longest) if target != image.size else image.size)
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    image = fit_image(image, max_dimension, min_dimension)
+    if sharpen:
+        image = image.filter(ImageFilter.SHARPEN)
+    return image
+
+
+def encode_jpeg(image: Image.Image, quality: int = OCR_JPEG_QUALITY) -> bytes:
+    """Encode an image as JPEG without any further resizing"""
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return buffered.getvalue()
+
+
+def encode_image_base64(image: Image.Image, quality: int = OCR_JPEG_QUALITY) -> str:
+    return base64.b64encode(encode_jpeg(image, quality)).decode("utf-8")
+
+
+# Process-pool jobs (see utils/cpu_pool.py). They take raw bytes and return
+# base64 strings so nothing but plain data crosses the process boundary.
+
+
+def encode_image_job(
+    document_data: bytes, grayscale: bool = OCR_GRAYSCALE, sharpen: bool = OCR_SHARPEN
+) -> str:
+    """Preprocess and encode an uploaded image, returning base64 JPEG"""
+    return encode_image_base64(
+        preprocess_image(document_data, grayscale=grayscale, sharpen=sharpen)
+    )
+
+
+def render_pdf_job(
+    document_data: bytes,
+    dpi: int = OCR_PDF_DPI,
+    max_dimension: int = OCR_MAX_DIMENSION,
+) -> List[str]:
+    """Rasterize every PDF page at the model resolution, returning base64 JPEGs"""
+    pages = []
+    with fitz.open(stream=document_data, filetype="pdf") as pdf_document:
+        for page in pdf_document:
+            zoom = min(dpi / 72, max_dimension / max(page.rect.width, page.rect.height))
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            pages.append(encode_image_base64(image))
+    return pages
+
+
+def _legacy_pipeline(path: str) -> str:
+    """The pre-pipeline behaviour: 2x upscale, sharpen, distorting clamp, encode"""
+    image = Image.open(path)
+    image = image.convert("L")
+    image = image.resize((image.width * 2, image.height * 2))
+    image = image.filter(ImageFilter.SHARPEN)
+    if image.width > 1000 or image.height > 1000:
+        image = image.resize(
+            (min(image.width, 1000), min(image.height, 1000)), Image.LANCZOS
+        )
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=85)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def benchmark(paths, repeats: int = 5):
+    """
+    Compare CPU time and base64 payload size of the legacy and current pipelines
+
+    Usage: python -m utils.image_preprocessing photo1.jpg photo2.png ...
+    """
+    header = f"{'image':<32} {'legacy ms':>10} {'legacy KB':>10} {'new ms':>10} {'new KB':>10}"
+    print(header)
+    print("-" * len(header))
+    for path in paths:
+        results = []
+        for pipeline in (
+            _legacy_pipeline,
+            lambda p: encode_image_base64(preprocess_image(p)),
+        ):
+            start = time.process_time()
+            for _ in range(repeats):
+                payload = pipeline(path)
+            cpu_ms = (time.process_time() - start) * 1000 / repeats
+            results.extend([cpu_ms, len(payload) / 1024])
+        print(
+            f"{Path(path).name[:32]:<32} {results[0]:>10.1f} {results[1]:>10.1f} "
+            f"{results[2]:>10.1f} {results[3]:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m utils.image_preprocessing IMAGE [IMAGE ...]")
+        sys.exit(1)
+    benchmark(sys.argv[1:])
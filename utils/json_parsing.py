@@ -0,0 +1,193 @@
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Pattern
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Matches ```json ... ``` fences models sometimes wrap their answer in
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+# A value followed directly by the next key without a separating comma
+_MISSING_COMMA_RE = re.compile(r'("|\d|true|false|null)(\s*\n?\s*)(?="[^"\n]*"\s*:)')
+
+
+def _strip_to_object(text: str) -> str:
+    """
+    The first top-level object, or everything from its `{` when it is cut off
+
+    Braces inside strings are skipped, so a truncated answer is not cut at a
+    `}` that belongs to a value.
+    """
+    text = _FENCE_RE.sub("", text.strip())
+    start = text.find("{")
+    if start < 0:
+        return ""
+    depth = 0
+    in_string = False
+    escaped = False
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if not depth:
+                return text[start : pos + 1]
+    return text[start:]
+
+
+def _close_truncated(text: str) -> str:
+    """Close an unterminated string and any open brackets of a cut-off answer"""
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(":"):
+        text += ' ""'
+    text = text.rstrip(",")
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text: str) -> str:
+    """Fix the mistakes LLMs commonly make when asked for a JSON object"""
+    text = _strip_to_object(text)
+    text = _MISSING_COMMA_RE.sub(r"\1,\2", text)
+    text = _close_truncated(text)
+    return _TRAILING_COMMA_RE.sub(r"\1", text)
+
+
+def scan_key_values(text: str) -> Dict[str, str]:
+    """
+    Last-resort scanner for flat objects
+
+    Walks the text once and collects every `"key": value` pair it can read,
+    skipping anything malformed in between, so one broken value does not
+    cost the other fields.
+    """
+    result = {}
+    pos = 0
+    length = len(text)
+    while pos < length:
+        key_start = text.find('"', pos)
+        if key_start < 0:
+            break
+        key_end = text.find('"', key_start + 1)
+        if key_end < 0:
+            break
+        colon = key_end + 1
+        while colon < length and text[colon].isspace():
+            colon += 1
+        if colon >= length or text[colon] != ":":
+            pos = key_end + 1
+            continue
+
+        value_start = colon + 1
+        while value_start < length and text[value_start].isspace():
+            value_start += 1
+        key = text[key_start + 1 : key_end]
+
+        if value_start < length and text[value_start] == '"':
+            value_end = value_start + 1
+            while value_end < length and text[value_end] != '"':
+                value_end += 2 if text[value_end] == "\\" else 1
+            raw = text[value_start : min(value_end, length) + 1]
+            try:
+                result[key] = orjson.loads(raw if raw.endswith('"') else raw + '"')
+            except orjson.JSONDecodeError:
+                result[key] = raw.strip('"')
+            pos = value_end + 1
+        else:
+            match = re.match(r"[^,}\n]*", text[value_start:])
+            literal = match.group(0).strip()
+            if literal in ("null", ""):
+                result[key] = ""
+            else:
+                result[key] = literal
+            pos = value_start + max(len(match.group(0)), 1)
+    return result
+
+
+def parse_json_object(text: str) -> Optional[Dict]:
+    """
+    Parse an LLM response that should contain a single JSON object
+
+    Tries a strict orjson parse first, then a repaired parse, then the
+    key/value scanner.
+
+    Returns:
+        Dict or None: The parsed object, or None when nothing could be read
+    """
+    if not text:
+        return None
+    try:
+        result = orjson.loads(text)
+        if isinstance(result, dict):
+            return result
+    except orjson.JSONDecodeError:
+        pass
+
+    repaired = repair_json(text)
+    try:
+        result = orjson.loads(repaired)
+        if isinstance(result, dict):
+            logger.info("Parsed JSON response after repair")
+            return result
+    except orjson.JSONDecodeError as e:
+        logger.warning("Repaired JSON parsing failed: %s", e)
+
+    result = scan_key_values(repaired)
+    if result:
+        logger.info("Recovered %s fields by scanning the response", len(result))
+        return result
+    return None
+
+
+def invalid_fields(
+    result: Dict, schema: Dict[str, Optional[Pattern]], fields: Iterable[str] = None
+) -> List[str]:
+    """
+    Fields missing from the result or whose non-empty value fails its pattern
+
+    Empty strings are valid: the document may simply not show that field.
+    """
+    failing = []
+    for field in fields or schema:
+        if field not in result:
+            failing.append(field)
+            continue
+        value = result[field]
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            value = str(value)
+        pattern = schema.get(field)
+        if value and pattern is not None and not pattern.fullmatch(value.strip()):
+            failing.append(field)
+    return failing
@@ -0,0 +1,187 @@
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from config.settings import (
+    LOG_FILE,
+    LOG_FORMAT,
+    LOG_HASH_KEY,
+    LOG_LEVEL,
+    LOG_LEVELS,
+    LOG_MAX_MESSAGE_CHARS,
+    LOG_QUEUE_SIZE,
+)
+
+# Application logging. Modules log through logging.getLogger(__name__) with
+# %-style arguments, so a disabled level costs one level check. Enabled
+# records are put on a bounded queue and written by a background thread, so
+# a slow stdout never stalls the event loop; when the queue is full records
+# are dropped and counted. Output is one JSON object per line (LOG_FORMAT=text
+# for local runs). Phone numbers and Emirates ID numbers are redacted and long
+# messages (webhook payloads) are truncated before anything is written.
+
+LOGGING_STATS = {"dropped": 0, "redacted": 0}
+
+# 784-YYYY-NNNNNNN-C with or without separators
+_EMIRATES_ID_RE = re.compile(r"(?<!\d)784[-\s]?\d{4}[-\s]?\d{7}[-\s]?\d(?!\d)")
+# Phone numbers, not any long number (timestamps, amounts, media ids):
+# international with + or 00, UAE local (050 123 4567, 04-123-4567) and
+# WhatsApp ids (country code and number, 11-13 digits)
+_PHONE_RE = re.compile(
+    r"(?<![\w+])(?<!\d\.)(?:"
+    r"(?:\+|00)[1-9]\d{0,2}(?:[\s-]?\d){7,12}"
+    r"|0(?:5\d|[2-4679])(?:[\s-]?\d){7}"
+    r"|[2-9]\d{10,12}|1\d{10}"
+    r")(?!\w|\.\d)"
+)
+
+_listener: Optional[QueueListener] = None
+
+
+def redact(text: str) -> str:
+    """
+    Mask Emirates ID and phone numbers
+
+    Phone numbers become [phone:<tag>] with the keyed tag the traces use
+    (utils.tracing.user_hash), so log lines of one user can still be found.
+    """
+    from .tracing import user_hash
+
+    def phone(match):
+        LOGGING_STATS["redacted"] += 1
+        # Hash the number as WhatsApp sends it: 971501234567
+        digits = re.sub(r"\D", "", match.group())
+        if digits.startswith("00"):
+            digits = digits[2:]
+        elif digits.startswith("0"):
+            digits = "971" + digits[1:]
+        return f"[phone:{user_hash(digits)}]"
+
+    def emirates_id(match):
+        LOGGING_STATS["redacted"] += 1
+        return "784-****-*******-*"
+
+    return _PHONE_RE.sub(phone, _EMIRATES_ID_RE.sub(emirates_id, text))
+
+
+def truncate(text: str, limit: int = LOG_MAX_MESSAGE_CHARS) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more chars]"
+    return text
+
+
+class _QueueHandler(QueueHandler):
+    """Hands records to the writer thread; drops them when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments here, since they may change after the call
+        # returns, but leave redaction and JSON encoding to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGGING_STATS["dropped"] += 1
+
+
+# LogRecord attributes that are not extra fields
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(truncate(record.getMessage())),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = redact(truncate(str(value))) if isinstance(value, str) else value
+        if record.exc_text:
+            entry["exception"] = redact(truncate(record.exc_text, LOG_MAX_MESSAGE_CHARS * 4))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.msg = redact(truncate(record.getMessage()))
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact(truncate(record.exc_text, LOG_MAX_MESSAGE_CHARS * 4))
+        return super().format(record)
+
+
+class _TraceIdFilter(logging.Filter):
+    """Adds the current trace id, so log lines can be matched to a trace"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        from .tracing import current_trace_id
+
+        trace_id = current_trace_id()
+        if trace_id:
+            record.trace_id = trace_id
+        return True
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """'services.whatsapp=WARNING,httpx=WARNING' -> {logger: level}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Install the queue handler on the root logger (once)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.FileHandler(LOG_FILE, encoding="utf-8") if LOG_FILE else logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    handler = _QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(_TraceIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop_logging)
+    if not LOG_HASH_KEY:
+        logging.getLogger(__name__).warning(
+            "LOG_HASH_KEY is not set; phone tags in logs and traces change on every restart"
+        )
+
+
+def stop_logging():
+    """Write out the queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,306 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config.settings import METRICS_ENABLED
+
+# Prometheus metrics, rendered in the text exposition format by /metrics.
+# Metrics are module-level objects updated in place; labels are passed as
+# keyword arguments (STAGE_SECONDS.observe(0.4, stage="awaiting_name")).
+# Existing stats dicts (CPU_POOL_STATS, semantic_cache.stats, ...) are
+# exported as they are at scrape time through register_stats. With
+# METRICS_ENABLED=false every metric is a shared no-op object, so the
+# instrumentation costs one empty method call.
+
+PREFIX = "insura"
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}_total{_format_labels(self.labelnames, key)} {value}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [per-bucket counts..., sum, count]
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(entry)) for key, entry in self._values.items()]
+        lines = self.header()
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}")
+        return lines
+
+
+class _NoopMetric:
+    """Stands in for every metric when metrics are disabled"""
+
+    def inc(self, amount: float = 1, **labels):
+        pass
+
+    def set(self, value: float, **labels):
+        pass
+
+    def observe(self, value: float, **labels):
+        pass
+
+    @contextmanager
+    def time(self, **labels):
+        yield
+
+
+_NOOP = _NoopMetric()
+
+
+def counter(name: str, documentation: str, labels: Tuple[str, ...] = ()):
+    return Counter(name, documentation, labels) if METRICS_ENABLED else _NOOP
+
+
+def gauge(name: str, documentation: str, labels: Tuple[str, ...] = ()):
+    return Gauge(name, documentation, labels) if METRICS_ENABLED else _NOOP
+
+
+def histogram(name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+    return Histogram(name, documentation, labels, buckets) if METRICS_ENABLED else _NOOP
+
+
+def register_stats(prefix: str, stats, label: Optional[str] = None):
+    """
+    Export a stats dict (or a function returning one) at scrape time
+
+    Numeric values become `insura_<prefix>_<key>`; nested dicts are skipped.
+    With `label`, the top-level keys are label values and their dicts hold
+    the numbers ({"emaf": {"requests": 3}} -> insura_<prefix>_requests{label="emaf"}).
+    """
+    if not METRICS_ENABLED:
+        return
+
+    def numeric(value) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def collect():
+        current = stats() if callable(stats) else stats
+        rows = current.items() if label else [(None, current)]
+        lines = []
+        for label_value, values in list(rows):
+            if not isinstance(values, dict):
+                continue
+            labels = f'{{{label}="{_escape(label_value)}"}}' if label else ""
+            for key, value in list(values.items()):
+                if numeric(value):
+                    lines.append(f"{PREFIX}_{prefix}_{key}{labels} {value}")
+        return lines
+
+    _collectors.append(collect)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for collect in _collectors:
+        try:
+            lines += collect()
+        except Exception as e:
+            lines.append(f"# collector error: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+
+# Webhook receive -> first message sent back, per user. The earliest
+# unanswered message counts, so a burst of messages is measured from its start.
+# Messages never answered (ignored uploads, failed turns) expire, so the dict
+# stays bounded and a much later reply is not counted against them.
+_received_at: Dict[str, Tuple[float, str]] = {}
+_received_lock = threading.Lock()
+RECEIVED_MAX_AGE = 600.0
+RECEIVED_MAX_ENTRIES = 10000
+
+FIRST_SEND_SECONDS = histogram(
+    "first_response_seconds",
+    "Time from receiving a user's message to the first message sent back",
+    ("message_type",),
+)
+STAGE_SECONDS = histogram(
+    "stage_handler_seconds", "Time spent handling a message, by conversation stage", ("stage",)
+)
+LLM_SECONDS = histogram("llm_call_seconds", "LLM call latency", ("purpose",))
+LLM_TOKENS = counter("llm_tokens", "LLM tokens used", ("purpose", "kind"))
+LLM_ERRORS = counter("llm_errors", "Failed LLM calls", ("purpose",))
+GRAPH_API_SECONDS = histogram("graph_api_seconds", "WhatsApp Graph API latency", ("operation",))
+GRAPH_API_ERRORS = counter("graph_api_errors", "WhatsApp Graph API errors", ("operation", "status"))
+OCR_STAGE_SECONDS = histogram(
+    "ocr_stage_seconds", "Document pipeline stage time (preprocess, vision, extraction)", ("stage",)
+)
+CPU_JOB_SECONDS = histogram("cpu_job_seconds", "CPU pool job time", ("job", "phase"))
+
+
+def mark_received(from_id: str, message_type: str):
+    if not METRICS_ENABLED or not from_id:
+        return
+    now = time.monotonic()
+    with _received_lock:
+        # Entries are only ever added at the end, so the oldest come first
+        while _received_at:
+            oldest = next(iter(_received_at))
+            if (
+                now - _received_at[oldest][0] < RECEIVED_MAX_AGE
+                and len(_received_at) < RECEIVED_MAX_ENTRIES
+            ):
+                break
+            del _received_at[oldest]
+        if from_id not in _received_at:
+            _received_at[from_id] = (now, message_type)
+
+
+def mark_sent(to: str):
+    """Record the first reply to a user's pending message (called by every send)"""
+    if not METRICS_ENABLED:
+        return
+    with _received_lock:
+        received = _received_at.pop(to, None)
+    if received is not None and time.monotonic() - received[0] < RECEIVED_MAX_AGE:
+        FIRST_SEND_SECONDS.observe(time.monotonic() - received[0], message_type=received[1])
+
+
+def llm_callbacks(purpose: str) -> list:
+    """LangChain callbacks recording latency, tokens and errors of an LLM"""
+    if not METRICS_ENABLED:
+        return []
+    return [LLMMetricsHandler(purpose)]
+
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:  # pragma: no cover - langchain is a hard dependency
+    BaseCallbackHandler = object
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    def __init__(self, purpose: str):
+        self.purpose = purpose
+        self._started: Dict = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            LLM_SECONDS.observe(time.perf_counter() - started, purpose=self.purpose)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            # Streamed responses carry usage on the message instead
+            try:
+                metadata = response.generations[0][0].message.usage_metadata or {}
+                usage = {
+                    "prompt_tokens": metadata.get("input_tokens", 0),
+                    "completion_tokens": metadata.get("output_tokens", 0),
+                }
+            except (AttributeError, IndexError):
+                usage = {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.inc(usage[kind], purpose=self.purpose, kind=kind.split("_")[0])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        LLM_ERRORS.inc(purpose=self.purpose)
@@ -0,0 +1,66 @@
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Tokens shorter than this must match exactly; longer ones may contain typos
+MIN_FUZZY_LENGTH = 4
+FUZZY_RATIO = 0.8
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower().replace("-", " "))
+
+
+@lru_cache(maxsize=4096)
+def _similar(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if min(len(a), len(b)) < MIN_FUZZY_LENGTH or abs(len(a) - len(b)) > 2:
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= FUZZY_RATIO
+
+
+class QAIndex:
+    """
+    Fuzzy phrase index over question variations
+
+    Each entry is a list of phrases ("medicine limit", "drug limit"). A
+    phrase matches when every one of its tokens appears in the message,
+    allowing small typos in longer words ("dentel", "medicin"). The entry
+    whose matching phrase has the most tokens wins, so "annual medicine
+    limit" beats a bare "limit". Built once; lookups need no model calls.
+    """
+
+    def __init__(self, phrases_by_key: Dict[str, Iterable[str]]):
+        self._phrases: List[Tuple[str, Tuple[str, ...]]] = []
+        for key, phrases in phrases_by_key.items():
+            for phrase in phrases:
+                tokens = tuple(tokenize(phrase))
+                if tokens:
+                    self._phrases.append((key, tokens))
+        self.vocabulary = {token for _, tokens in self._phrases for token in tokens}
+
+    def _matches(self, message_tokens: set, token: str) -> bool:
+        if token in message_tokens:
+            return True
+        return any(_similar(token, candidate) for candidate in message_tokens)
+
+    def search(self, text: str) -> Optional[Tuple[str, float]]:
+        """
+        Returns:
+            (key, score) of the best entry, or None when no phrase matches.
+            The score is the token count of the matching phrase.
+        """
+        message_tokens = set(tokenize(text))
+        if not message_tokens:
+            return None
+        best = None
+        for key, tokens in self._phrases:
+            if best is not None and len(tokens) <= best[1]:
+                continue
+            if all(self._matches(message_tokens, token) for token in tokens):
+                best = (key, float(len(tokens)))
+        return best
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config.settings import LOG_HASH_KEY, TRACE_EXPORT_PATH, TRACE_SAMPLE_RATE
+
+# Request tracing. Every inbound message opens a root span (start_trace);
+# work done on its behalf opens child spans (span / @traced), so a slow reply
+# can be broken down into language detection, translations, OCR, partner API
+# calls and WhatsApp sends. The current span lives in a context variable, so
+# it follows the message into tasks it creates; functions sent to a thread
+# pool need bind() to keep it. TRACE_SAMPLE_RATE of the messages are traced
+# and their finished spans appended to TRACE_EXPORT_PATH as JSON lines; show
+# the slowest traces with `python -m utils.tracing`. Outside a sampled trace
+# span() does nothing.
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def _new_id(length: int = 16) -> str:
+    return os.urandom(length // 2).hex()
+
+
+_HASH_KEY = LOG_HASH_KEY.encode() if LOG_HASH_KEY else os.urandom(32)
+
+
+def user_hash(user_id: str) -> str:
+    """
+    Pseudonym of a phone number, keyed with LOG_HASH_KEY, so traces and logs
+    hold no raw numbers and a tag cannot be reversed without the key
+    """
+    digest = hmac.new(_HASH_KEY, (user_id or "").lstrip("+").encode(), hashlib.sha256)
+    return digest.hexdigest()[:16]
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "duration", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 2),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class JsonlExporter:
+    """Appends finished spans to a JSON lines file, flushed when a trace ends"""
+
+    def __init__(self, path: str = TRACE_EXPORT_PATH):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span, flush: bool = False):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            if flush:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+exporter = JsonlExporter()
+
+
+class _SpanContext:
+    def __init__(self, span: Span):
+        self.span = span
+        self._token = None
+        self._started = 0.0
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self.span)
+        self._started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self._started
+        if exc is not None and not isinstance(exc, asyncio.CancelledError):
+            self.span.error = f"{exc_type.__name__}: {exc}"[:300]
+        _current_span.reset(self._token)
+        try:
+            exporter.export(self.span, flush=self.span.parent_id is None)
+        except OSError:
+            pass
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+class _NoopSpanContext:
+    _span = _NoopSpan()
+
+    def __enter__(self):
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_CONTEXT = _NoopSpanContext()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def span(name: str, **attributes):
+    """Child span of the current span; does nothing outside a sampled trace"""
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_CONTEXT
+    return _SpanContext(Span(name, parent.trace_id, parent.span_id, attributes))
+
+
+def start_trace(name: str, sample_rate: float = TRACE_SAMPLE_RATE, **attributes):
+    """
+    Root span for one inbound message (or background job)
+
+    Inside an existing trace this is an ordinary child span, so a voice
+    message keeps one trace from download to reply.
+    """
+    if _current_span.get() is not None:
+        return span(name, **attributes)
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return _NOOP_CONTEXT
+    return _SpanContext(Span(name, _new_id(32), None, attributes))
+
+
+def traced(name: Optional[str] = None):
+    """Decorator wrapping every call of a (sync or async) function in a span"""
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_message(name: Optional[str] = None):
+    """
+    Decorator for async handlers of a user's message whose first argument is
+    the sender's WhatsApp id; each call starts a trace (see start_trace)
+    """
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(from_id, *args, **kwargs):
+            with start_trace(span_name, user=user_hash(from_id)):
+                return await fn(from_id, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bind(fn):
+    """`fn` running in the caller's trace context, for run_in_executor"""
+    if _current_span.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def load_traces(path: str) -> Dict[str, List[Dict]]:
+    traces: Dict[str, List[Dict]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+
+def format_trace(spans: List[Dict]) -> List[str]:
+    """Indented span tree with offsets from the start of the trace"""
+    children: Dict[Optional[str], List[Dict]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in sorted(spans, key=lambda s: s["start"]):
+        # Spans whose parent was not exported are shown at the top level
+        parent = s["parent_id"] if s["parent_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+    origin = min(s["start"] for s in spans)
+    lines = []
+
+    def walk(parent, depth):
+        for s in children.get(parent, []):
+            attributes = " ".join(f"{k}={v}" for k, v in s["attributes"].items())
+            error = f"  ERROR {s['error']}" if s["error"] else ""
+            lines.append(
+                f"{(s['start'] - origin) * 1000:8.0f} ms {s['duration_ms']:9.0f} ms  "
+                f"{'  ' * depth}{s['name']} {attributes}{error}"
+            )
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the slowest traces from the trace file")
+    parser.add_argument("path", nargs="?", default=TRACE_EXPORT_PATH)
+    parser.add_argument("--slowest", type=int, default=5)
+    parser.add_argument("--trace", help="Show one trace by id")
+    parser.add_argument("--user", help="Only traces for this phone number (needs the server's LOG_HASH_KEY)")
+    args = parser.parse_args()
+
+    traces = load_traces(args.path)
+    if args.trace:
+        selected = [traces.get(args.trace, [])]
+    else:
+        if args.user:
+            wanted = user_hash(args.user)
+            traces = {
+                trace_id: spans
+                for trace_id, spans in traces.items()
+                if any(s["attributes"].get("user") == wanted for s in spans)
+            }
+
+        def total(spans):
+            # Tasks started by a message may finish after its root span
+            end = max(s["start"] + s["duration_ms"] / 1000 for s in spans)
+            return end - min(s["start"] for s in spans)
+
+        selected = sorted(traces.values(), key=total, reverse=True)[: args.slowest]
+
+    for spans in selected:
+        if not spans:
+            print("No such trace")
+            continue
+        print(f"trace {spans[0]['trace_id']}")
+        for line in format_trace(spans):
+            print(line)
+        print()
+
+
+if __name__ == "__main__":
+    main()